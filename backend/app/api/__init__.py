@@ -1,6 +1,6 @@
 """API routes module"""
 
-from app.api import auth, conversations, messages, formats, llm
+from app.api import auth, conversations, messages, formats, llm, jobs
 
-__all__ = ["auth", "conversations", "messages", "formats", "llm"]
+__all__ = ["auth", "conversations", "messages", "formats", "llm", "jobs"]
 
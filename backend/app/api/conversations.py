@@ -6,6 +6,8 @@ from app.models import Conversation, Message, MessageRole
 from app.schemas.conversation import ConversationResponse, ConversationCreate, ConversationUpdate
 from app.dependencies import get_current_user
 from app.models import User
+from app.services.serialization import rows_to_dicts, FastJSONResponse
+from app.services.history_cache import history_cache
 
 router = APIRouter(prefix="/conversations", tags=["conversations"])
 
@@ -16,11 +18,13 @@ def get_conversations(
     db: Session = Depends(get_db)
 ):
     """Get all conversations for the current user"""
-    conversations = db.query(Conversation).filter(
+    rows = db.query(
+        Conversation.id, Conversation.user_id, Conversation.title, Conversation.created_at, Conversation.updated_at
+    ).filter(
         Conversation.user_id == current_user.id
     ).order_by(Conversation.updated_at.desc()).all()
     
-    return conversations
+    return FastJSONResponse(rows_to_dicts(rows))
 
 
 @router.post("", response_model=ConversationResponse, status_code=status.HTTP_201_CREATED)
@@ -110,5 +114,6 @@ def delete_conversation(
     
     db.delete(conversation)
     db.commit()
+    history_cache.invalidate(conversation_id)
     
     return None
@@ -11,10 +11,16 @@ from app.schemas.formats import (
 )
 from app.dependencies import get_current_user
 from app.models import User
+from app.services.serialization import rows_to_dicts, FastJSONResponse
 
 router = APIRouter(prefix="/formats", tags=["formats"])
 
 
+def _columns(model, body: str):
+    """The columns of a format list response: only what the client shows, not full ORM rows"""
+    return (model.id, model.user_id, model.name, getattr(model, body), model.created_at, model.updated_at)
+
+
 # JSON Schema endpoints
 @router.get("/schemas", response_model=List[JSONSchemaResponse])
 def get_json_schemas(
@@ -22,10 +28,10 @@ def get_json_schemas(
     db: Session = Depends(get_db)
 ):
     """Get all JSON schemas for the current user"""
-    schemas = db.query(JSONSchema).filter(
+    rows = db.query(*_columns(JSONSchema, "schema")).filter(
         JSONSchema.user_id == current_user.id
     ).order_by(JSONSchema.updated_at.desc()).all()
-    return schemas
+    return FastJSONResponse(rows_to_dicts(rows))
 
 
 @router.post("/schemas", response_model=JSONSchemaResponse, status_code=status.HTTP_201_CREATED)
@@ -105,10 +111,10 @@ def get_templates(
     db: Session = Depends(get_db)
 ):
     """Get all templates for the current user"""
-    templates = db.query(Template).filter(
+    rows = db.query(*_columns(Template, "content")).filter(
         Template.user_id == current_user.id
     ).order_by(Template.updated_at.desc()).all()
-    return templates
+    return FastJSONResponse(rows_to_dicts(rows))
 
 
 @router.post("/templates", response_model=TemplateResponse, status_code=status.HTTP_201_CREATED)
@@ -188,10 +194,10 @@ def get_regex_patterns(
     db: Session = Depends(get_db)
 ):
     """Get all regex patterns for the current user"""
-    patterns = db.query(RegexPattern).filter(
+    rows = db.query(*_columns(RegexPattern, "pattern")).filter(
         RegexPattern.user_id == current_user.id
     ).order_by(RegexPattern.updated_at.desc()).all()
-    return patterns
+    return FastJSONResponse(rows_to_dicts(rows))
 
 
 @router.post("/regex", response_model=RegexPatternResponse, status_code=status.HTTP_201_CREATED)
@@ -271,10 +277,10 @@ def get_csv_presets(
     db: Session = Depends(get_db)
 ):
     """Get all CSV presets for the current user"""
-    presets = db.query(CSVPreset).filter(
+    rows = db.query(*_columns(CSVPreset, "columns")).filter(
         CSVPreset.user_id == current_user.id
     ).order_by(CSVPreset.updated_at.desc()).all()
-    return presets
+    return FastJSONResponse(rows_to_dicts(rows))
 
 
 @router.post("/csv", response_model=CSVPresetResponse, status_code=status.HTTP_201_CREATED)
@@ -0,0 +1,176 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from typing import List
+from datetime import datetime
+import csv
+import io
+from app.database import get_db, SessionLocal
+from app.models import Job, JobItem, JobStatus
+from app.schemas.job import JobCreate, JobResponse, JobProgress
+from app.dependencies import get_current_user
+from app.models import User
+from app.services.jobs import create_job, job_progress
+from app.services.serialization import dumps
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# Rows fetched per query while streaming results
+EXPORT_PAGE_SIZE = 1000
+
+
+def _get_user_job(db: Session, job_id: int, user_id: int) -> Job:
+    job = db.query(Job).filter(Job.id == job_id, Job.user_id == user_id).first()
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return job
+
+
+def _job_response(db: Session, job: Job) -> JobResponse:
+    response = JobResponse.model_validate(job)
+    response.progress = JobProgress(**job_progress(db, job))
+    return response
+
+
+@router.post("", response_model=JobResponse, status_code=status.HTTP_201_CREATED)
+async def submit_job(
+    job: JobCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Submit an offline extraction job; items are processed by the background workers"""
+    if not job.prompts:
+        raise HTTPException(status_code=400, detail="No prompts provided")
+    new_job = create_job(
+        db,
+        user_id=current_user.id,
+        prompts=job.prompts,
+        backend=job.backend,
+        model=job.model,
+        output_format=job.output_format,
+        format_spec=job.format_spec,
+        parameters=job.llm_parameters,
+        name=job.name
+    )
+    return _job_response(db, new_job)
+
+
+@router.get("", response_model=List[JobResponse])
+async def get_jobs(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get all jobs of the current user"""
+    jobs = db.query(Job).filter(Job.user_id == current_user.id).order_by(Job.created_at.desc()).all()
+    return [JobResponse.model_validate(job) for job in jobs]
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get status, progress, throughput and ETA of a job"""
+    return _job_response(db, _get_user_job(db, job_id, current_user.id))
+
+
+@router.post("/{job_id}/cancel", response_model=JobResponse)
+async def cancel_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stop handing out the remaining items of a job"""
+    job = _get_user_job(db, job_id, current_user.id)
+    if job.status == JobStatus.running:
+        job.status = JobStatus.cancelled
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        db.refresh(job)
+    return _job_response(db, job)
+
+
+@router.delete("/{job_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Delete a job and all its items"""
+    job = _get_user_job(db, job_id, current_user.id)
+    # Cancel first so the workers stop claiming its items, then delete in bulk
+    # instead of loading every item through the relationship cascade
+    if job.status in (JobStatus.pending, JobStatus.running):
+        job.status = JobStatus.cancelled
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    db.query(JobItem).filter(JobItem.job_id == job.id).delete(synchronize_session=False)
+    db.query(Job).filter(Job.id == job.id).delete(synchronize_session=False)
+    db.commit()
+    return None
+
+
+@router.get("/{job_id}/results")
+async def export_results(
+    job_id: int,
+    format: str = Query("jsonl", pattern="^(jsonl|csv)$"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stream the job results as JSONL or CSV, ordered by prompt index"""
+    _get_user_job(db, job_id, current_user.id)
+
+    def rows():
+        # Own session: the export can outlive the request-scoped one
+        export_db = SessionLocal()
+        try:
+            last_index = -1
+            while True:
+                page = export_db.query(
+                    JobItem.index, JobItem.status, JobItem.prompt, JobItem.result, JobItem.error, JobItem.attempts
+                ).filter(
+                    JobItem.job_id == job_id,
+                    JobItem.index > last_index
+                ).order_by(JobItem.index).limit(EXPORT_PAGE_SIZE).all()
+                if not page:
+                    break
+                for row in page:
+                    yield row
+                last_index = page[-1].index
+        finally:
+            export_db.close()
+
+    if format == "csv":
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(["index", "status", "prompt", "result", "error", "attempts"])
+            for row in rows():
+                writer.writerow([row.index, row.status.value, row.prompt, row.result or "", row.error or "", row.attempts])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        media_type = "text/csv"
+    else:
+        def generate():
+            for row in rows():
+                yield dumps({
+                    "index": row.index,
+                    "status": row.status.value,
+                    "prompt": row.prompt,
+                    "result": row.result,
+                    "error": row.error,
+                    "attempts": row.attempts,
+                }) + "\n"
+        media_type = "application/x-ndjson"
+
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="job-{job_id}.{format}"'}
+    )
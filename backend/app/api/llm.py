@@ -1,15 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_db, SessionLocal
 from app.models import Message, Conversation, MessageRole
 from app.schemas.message import LLMBackend, OutputFormat
-from app.services.llm import get_available_models, generate_llm_response_stream
-from app.dependencies import get_current_user
-from app.models import User, BackendSetting
+from app.services.llm import get_available_models, lookup_models, generate_llm_response_stream, validation_metrics
+from app.services.clients import registry
+from app.services.plans import plan_cache_stats
+from app.services.response_cache import bypass_requested, response_cache_stats
+from app.services.coalescing import coalescing_stats
+from app.services.batch import run_batch, batch_concurrency, BATCH_MAX_PROMPTS
+from app.services.backend_settings import merge_backend_settings
+from app.services.jobs import worker_pool
+from app.services.scheduler import scheduler, user_weight, QueueFullError
+from app.services.endpoints import endpoint_router, prompt_cache_stats
+from app.services.hedging import hedging_stats
+from app.services.model_cache import model_cache
+from app.services.sse import coalesce_events
+from app.services.serialization import dumps
+from app.services.context_budget import conversation_history, context_budget_stats
+from app.services.history_cache import history_cache
+from app.services.residency import residency
+from app.services.context_window import context_windows
+from app.services.generations import generations, Generation, parse_event_id
+from app.dependencies import get_current_user, get_admin_user
+from app.models import User
 from pydantic import BaseModel
-import json
+import asyncio
+import os
+import time
+from contextlib import aclosing
+from functools import partial
 from datetime import datetime
 
 router = APIRouter(prefix="/llm", tags=["llm"])
@@ -24,6 +46,46 @@ class ModelsResponse(BaseModel):
     models: List[str]
 
 
+class BackendModels(BaseModel):
+    status: str  # ok, error, not_configured
+    models: List[str] = []
+    cached: bool = False
+    stale: bool = False
+    error: Optional[str] = None
+    elapsed_ms: float
+
+
+class AllModelsResponse(BaseModel):
+    backends: Dict[str, BackendModels]
+
+
+class WarmupRequest(BaseModel):
+    backend: LLMBackend
+    model: str
+    parameters: Dict[str, Any] = {}
+
+
+class WarmupEndpoint(BaseModel):
+    endpoint: str
+    model: str
+    status: str  # loaded, error or skipped
+    elapsed_ms: Optional[float] = None
+    # Ollama only: time spent loading the model into memory
+    load_ms: Optional[float] = None
+    # Ollama only: context size the model was loaded with
+    num_ctx: Optional[int] = None
+    error: Optional[str] = None
+
+
+class WarmupResponse(BaseModel):
+    endpoints: List[WarmupEndpoint]
+
+
+class CancelResponse(BaseModel):
+    id: str
+    cancelled: bool
+
+
 class GenerateRequest(BaseModel):
     conversation_id: int
     message: str
@@ -35,23 +97,21 @@ class GenerateRequest(BaseModel):
     message_id: Optional[int] = None
 
 
+class BatchRequest(BaseModel):
+    prompts: List[str]
+    backend: LLMBackend
+    model: str
+    output_format: OutputFormat
+    format_spec: Optional[str] = None
+    parameters: Optional[Dict[str, Any]] = None
+    concurrency: Optional[int] = None
+    # Store every prompt/result pair as its own conversation
+    persist: bool = False
+
+
 async def _get_merged_parameters(db: Session, user_id: int, backend: str, request_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Merge provided parameters with stored backend settings"""
-    params = request_params.copy() if request_params else {}
-    
-    # Load stored settings
-    setting = db.query(BackendSetting).filter(
-        BackendSetting.user_id == user_id,
-        BackendSetting.backend == backend
-    ).first()
-    
-    if setting:
-        if not params.get("base_url") and setting.base_url:
-            params["base_url"] = setting.base_url
-        if not params.get("api_key") and setting.api_key:
-            params["api_key"] = setting.api_key
-            
-    return params
+    return merge_backend_settings(db, user_id, backend, request_params)
 
 
 @router.post("/models", response_model=ModelsResponse)
@@ -73,6 +133,69 @@ async def list_models(
         )
 
 
+@router.get("/models/all", response_model=AllModelsResponse)
+async def list_all_models(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Query every backend concurrently; slow or failing backends don't hold up the others"""
+    async def discover(backend: LLMBackend, params: Dict[str, Any]) -> BackendModels:
+        started = time.monotonic()
+        if backend == LLMBackend.openai and not (params.get("api_key") or os.getenv("OPENAI_API_KEY")):
+            return BackendModels(status="not_configured", elapsed_ms=0.0)
+        if backend in (LLMBackend.vllm, LLMBackend.ollama) and not params.get("base_url"):
+            # Probing the default localhost URL would only report a connection error
+            return BackendModels(status="not_configured", elapsed_ms=0.0)
+        result = await lookup_models(backend, params)
+        return BackendModels(
+            status="error" if result["error"] and not result["models"] else "ok",
+            elapsed_ms=round((time.monotonic() - started) * 1000, 1),
+            **{k: v for k, v in result.items() if k != "fetch_ms"}
+        )
+
+    backends = list(LLMBackend)
+    params = [await _get_merged_parameters(db, current_user.id, backend) for backend in backends]
+    results = await asyncio.gather(*(discover(backend, p) for backend, p in zip(backends, params)))
+    return AllModelsResponse(backends={backend.value: result for backend, result in zip(backends, results)})
+
+
+@router.post("/warmup", response_model=WarmupResponse)
+async def warmup_model(
+    request: WarmupRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Load a model on every endpoint of the backend ahead of the first request"""
+    params = await _get_merged_parameters(db, current_user.id, request.backend, request.parameters)
+    results = await residency.warm(request.backend, request.model, params)
+    return WarmupResponse(endpoints=[WarmupEndpoint(**result) for result in results])
+
+
+@router.get("/generations/{generation_id}/events")
+async def generation_events(
+    generation_id: str,
+    http_request: Request,
+    last_event_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """(Re)attach to a generation's event stream, after the Last-Event-ID header (or ?last_event_id=) if given"""
+    generation = generations.get(generation_id, current_user.id)
+    if generation is None:
+        raise HTTPException(status_code=404, detail="Generation not found or expired")
+    after = http_request.headers.get("last-event-id") or last_event_id or ""
+    # Either an id as sent in the stream ("<generation>:<number>") or just the number
+    _, last_event = parse_event_id(after if ":" in after else f":{after}")
+    return StreamingResponse(generations.subscribe(generation, last_event, http_request), media_type="text/event-stream")
+
+
+@router.post("/generations/{generation_id}/cancel", response_model=CancelResponse)
+async def cancel_generation(generation_id: str, current_user: User = Depends(get_current_user)):
+    """Stop a running streaming generation; its partial answer is saved as truncated"""
+    if generations.cancel(generation_id, current_user.id) is None:
+        raise HTTPException(status_code=404, detail="Generation not found or already finished")
+    return CancelResponse(id=generation_id, cancelled=True)
+
+
 @router.get("/capabilities", response_model=Dict[str, List[str]])
 async def get_capabilities():
     """Get the supported output formats for each backend"""
@@ -97,16 +220,136 @@ async def get_capabilities():
     }
 
 
+@router.get("/metrics")
+async def get_metrics(current_user: User = Depends(get_admin_user)):
+    """Report runtime metrics of the LLM service layer (admins only: they cover every user's endpoints)"""
+    return {
+        "clients": registry.stats(),
+        "generation_plans": plan_cache_stats(),
+        "stream_validation": dict(validation_metrics),
+        "response_cache": response_cache_stats(),
+        "coalescing": coalescing_stats(),
+        "jobs": worker_pool.stats(),
+        "scheduler": scheduler.stats(),
+        "endpoints": endpoint_router.stats(),
+        "prompt_cache": prompt_cache_stats(),
+        "hedging": hedging_stats(),
+        "model_cache": model_cache.stats(),
+        "context_budget": context_budget_stats(),
+        "history_cache": history_cache.stats(),
+        "residency": residency.stats(),
+        "context_windows": context_windows.stats(),
+        "generations": generations.stats(),
+    }
+
+
+def _save_answer(request: GenerateRequest, content: str, truncated: bool) -> int:
+    # Own session: the generation outlives the request that started it
+    db = SessionLocal()
+    try:
+        assistant_message = Message(
+            conversation_id=request.conversation_id,
+            role=MessageRole.assistant,
+            content=content,
+            backend=request.backend,
+            model=request.model,
+            output_format=request.output_format,
+            format_spec=request.format_spec,
+            llm_parameters=request.parameters,
+            truncated=truncated
+        )
+        db.add(assistant_message)
+        db.query(Conversation).filter(Conversation.id == request.conversation_id).update(
+            {Conversation.updated_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.commit()
+        db.refresh(assistant_message)
+        history_cache.append(assistant_message)
+        return assistant_message.id
+    finally:
+        db.close()
+
+
+async def _produce(
+    generation: Generation,
+    request: GenerateRequest,
+    parameters: Dict[str, Any],
+    user_id: int,
+    weight: float,
+    user_message_id: int,
+    llm_messages: List[Dict[str, Any]],
+    context: Optional[Dict[str, Any]]
+) -> None:
+    """Stream the answer of a /generate request into the generation's event buffer and save it"""
+    # Send the IDs of the messages to the client
+    generation.publish({"user_message_id": user_message_id, "generation_id": generation.id})
+    if context:
+        generation.publish({"context": context})
+
+    accumulated_content = ""
+    saved = False
+    try:
+        events = generations.stream(generation, coalesce_events(generate_llm_response_stream(
+            backend=request.backend,
+            model=request.model,
+            messages=llm_messages,
+            output_format=request.output_format,
+            format_spec=request.format_spec,
+            parameters=parameters
+        ), parameters))
+        async with scheduler.slot(request.backend, parameters, user_id, weight, request.model), aclosing(events):
+            async for chunk in events:
+                if chunk:
+                    if "content" in chunk:
+                        accumulated_content += chunk["content"]
+                    generation.publish(chunk)
+
+        # Save assistant message once done (or what there is of it, marked as truncated)
+        if accumulated_content:
+            assistant_message_id = _save_answer(request, accumulated_content, generation.stopped)
+            saved = True
+            generation.publish({"assistant_message_id": assistant_message_id})
+        if generation.stopped:
+            generation.publish({"cancelled": True, "reason": generation.reason, "truncated": saved})
+    except asyncio.CancelledError:
+        # Shutdown: keep what there is
+        generation.cancel("interrupted")
+        if accumulated_content and not saved:
+            _save_answer(request, accumulated_content, True)
+            saved = True
+        raise
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        generation.publish({"error": str(e)})
+    finally:
+        generations.finish(generation, saved and generation.stopped)
+
+
 @router.post("/generate")
 async def generate(
     request: GenerateRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Generate a streaming response from the LLM"""
+    # A client reconnecting to a generation it already started resumes it instead of generating again
+    generation_id, last_event = parse_event_id(http_request.headers.get("last-event-id"))
+    if generation_id:
+        generation = generations.get(generation_id, current_user.id)
+        if generation is None:
+            raise HTTPException(status_code=404, detail="Generation not found or expired")
+        return StreamingResponse(generations.subscribe(generation, last_event, http_request), media_type="text/event-stream")
+
     try:
         # Merge parameters with stored settings
         merged_params = await _get_merged_parameters(db, current_user.id, request.backend, request.parameters)
+        if bypass_requested(http_request.headers):
+            merged_params["cache"] = False
+        scheduler.admit(request.backend, merged_params)
+        # Keeps the conversation on one replica of a pool (warm prefix cache)
+        merged_params["conversation_id"] = request.conversation_id
         
         # Verify conversation belongs to user
         conversation = db.query(Conversation).filter(
@@ -127,6 +370,7 @@ async def generate(
                 raise HTTPException(status_code=404, detail="Message to edit not found")
             
             user_message.content = request.message
+            user_message.token_count = None
             user_message.backend = request.backend
             user_message.model = request.model
             user_message.output_format = request.output_format
@@ -138,6 +382,7 @@ async def generate(
             ).delete()
             db.commit()
             db.refresh(user_message)
+            history_cache.invalidate(request.conversation_id)
         else:
             # New message mode
             user_message = Message(
@@ -151,69 +396,34 @@ async def generate(
             db.add(user_message)
             db.commit()
             db.refresh(user_message)
+            history_cache.append(user_message)
 
         # Update title if it's the first message
         if not conversation.title or conversation.title == "New Conversation":
             conversation.title = request.message[:50] + ("..." if len(request.message) > 50 else "")
             db.commit()
 
-        # Get history for the LLM
-        history = db.query(Message).filter(
-            Message.conversation_id == request.conversation_id
-        ).order_by(Message.created_at).all()
+        # Get history for the LLM, fitted to the context budget
+        llm_messages, context = conversation_history(db, request.conversation_id, merged_params)
         
-        llm_messages = []
-        for m in history:
-            llm_messages.append({"role": m.role.value, "content": m.content})
-        
-        async def stream_generator():
-            try:
-                # Send the IDs of the messages to the client
-                yield f"data: {json.dumps({'user_message_id': user_message.id})}\n\n"
-                
-                accumulated_content = ""
-                async for chunk in generate_llm_response_stream(
-                    backend=request.backend,
-                    model=request.model,
-                    messages=llm_messages,
-                    output_format=request.output_format,
-                    format_spec=request.format_spec,
-                    parameters=merged_params
-                ):
-                    if chunk:
-                        if "content" in chunk:
-                            accumulated_content += chunk["content"]
-                        
-                        yield f"data: {json.dumps(chunk)}\n\n"
-                
-                # Save assistant message once done
-                if accumulated_content:
-                    assistant_message = Message(
-                        conversation_id=request.conversation_id,
-                        role=MessageRole.assistant,
-                        content=accumulated_content,
-                        backend=request.backend,
-                        model=request.model,
-                        output_format=request.output_format,
-                        format_spec=request.format_spec,
-                        llm_parameters=request.parameters
-                    )
-                    db.add(assistant_message)
-                    conversation.updated_at = datetime.utcnow()
-                    db.commit()
-                    db.refresh(assistant_message)
-                    yield f"data: {json.dumps({'assistant_message_id': assistant_message.id})}\n\n"
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-            finally:
-                yield "data: [DONE]\n\n"
-
+        # Runs in the background: a client that loses the connection can resume with Last-Event-ID
+        generation = generations.start(current_user.id, request.conversation_id)
+        generations.run(generation, partial(
+            _produce,
+            request=request,
+            parameters=merged_params,
+            user_id=current_user.id,
+            weight=user_weight(current_user),
+            user_message_id=user_message.id,
+            llm_messages=llm_messages,
+            context=context
+        ))
         return StreamingResponse(
-            stream_generator(),
+            generations.subscribe(generation, 0, http_request),
             media_type="text/event-stream"
         )
+    except (HTTPException, QueueFullError):
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -222,3 +432,79 @@ async def generate(
             detail=f"Error generating response: {str(e)}"
         )
 
+
+@router.post("/batch")
+async def batch_generate(
+    request: BatchRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Run many prompts with bounded concurrency and stream results back as NDJSON in completion order"""
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="No prompts provided")
+    if len(request.prompts) > BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"Too many prompts (max {BATCH_MAX_PROMPTS})")
+
+    merged_params = await _get_merged_parameters(db, current_user.id, request.backend, request.parameters)
+    if bypass_requested(http_request.headers):
+        merged_params["cache"] = False
+    concurrency = batch_concurrency(request.backend, request.concurrency)
+
+    async def result_generator():
+        try:
+            async for index, result in run_batch(
+                prompts=request.prompts,
+                backend=request.backend,
+                model=request.model,
+                output_format=request.output_format,
+                format_spec=request.format_spec,
+                parameters=merged_params,
+                concurrency=concurrency,
+                user_id=current_user.id,
+                weight=user_weight(current_user)
+            ):
+                item = {"index": index, **result}
+                if request.persist and "error" not in result:
+                    item["conversation_id"] = _persist_batch_item(db, current_user.id, request, index, result)
+                yield dumps(item) + "\n"
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(
+        result_generator(),
+        media_type="application/x-ndjson"
+    )
+
+
+def _persist_batch_item(db: Session, user_id: int, request: BatchRequest, index: int, result: Dict[str, Any]) -> int:
+    """Save one batch item as a conversation with the prompt and the answer"""
+    prompt = request.prompts[index]
+    conversation = Conversation(
+        user_id=user_id,
+        title=prompt[:50] + ("..." if len(prompt) > 50 else "")
+    )
+    db.add(conversation)
+    db.flush()
+    db.add(Message(
+        conversation_id=conversation.id,
+        role=MessageRole.user,
+        content=prompt,
+        backend=request.backend,
+        model=request.model,
+        output_format=request.output_format
+    ))
+    db.add(Message(
+        conversation_id=conversation.id,
+        role=MessageRole.assistant,
+        content=result.get("content", ""),
+        backend=request.backend,
+        model=request.model,
+        output_format=request.output_format,
+        format_spec=request.format_spec,
+        llm_parameters=request.parameters
+    ))
+    db.commit()
+    return conversation.id
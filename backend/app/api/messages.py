@@ -1,22 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, Any, List
 from datetime import datetime
-import json
 from app.database import get_db
 from app.models import Message, Conversation, MessageRole
-from app.schemas.message import MessageResponse, MessageCreate, MessageUpdate
+from app.schemas.message import MessageResponse, MessageCreate, MessageUpdate, LLMBackend
 from app.dependencies import get_current_user
 from app.models import User
 from app.services.llm import generate_llm_response, generate_llm_response_stream
+from app.services.response_cache import bypass_requested
+from app.services.scheduler import scheduler, user_weight
+from app.services.sse import coalesce_events
+from app.services.serialization import sse_frame, rows_to_dicts, FastJSONResponse
+from app.services.context_budget import conversation_history
+from app.services.history_cache import history_cache
+from app.services.generations import generations
+from app.services.backend_settings import merge_backend_settings
+from app.services.residency import residency, MODEL_PREFETCH
+import asyncio
+from contextlib import aclosing
 
 router = APIRouter(prefix="/conversations/{conversation_id}/messages", tags=["messages"])
 
+# Columns of MessageResponse, selected directly instead of loading and validating full ORM rows
+_MESSAGE_COLUMNS = (
+    Message.id, Message.conversation_id, Message.role, Message.content, Message.created_at,
+    Message.backend, Message.model, Message.output_format, Message.llm_parameters, Message.format_spec,
+    Message.truncated,
+)
+
 
 @router.get("", response_model=List[MessageResponse])
 def get_messages(
     conversation_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -33,17 +51,19 @@ def get_messages(
             detail="Conversation not found"
         )
     
-    messages = db.query(Message).filter(
+    rows = db.query(*_MESSAGE_COLUMNS).filter(
         Message.conversation_id == conversation_id
     ).order_by(Message.created_at).all()
     
-    return messages
+    _prefetch_model(db, current_user.id, rows, background_tasks)
+    return FastJSONResponse(rows_to_dicts(rows, generation_stats=None), background=background_tasks)
 
 
 @router.post("/", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 async def create_message(
     conversation_id: int,
     message: MessageCreate,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -60,6 +80,9 @@ async def create_message(
             detail="Conversation not found"
         )
     
+    parameters = _request_parameters(message, http_request, conversation_id)
+    scheduler.admit(message.backend, parameters)
+
     # Save user message
     user_message = Message(
         conversation_id=conversation_id,
@@ -69,17 +92,20 @@ async def create_message(
     db.add(user_message)
     db.commit()
     db.refresh(user_message)
+    history_cache.append(user_message)
     
     # Generate LLM response
     try:
-        response_data = await generate_llm_response(
-            backend=message.backend,
-            model=message.model,
-            messages=_get_conversation_history(conversation_id, db),
-            output_format=message.output_format,
-            format_spec=message.format_spec,
-            parameters=message.llm_parameters or {}
-        )
+        history, context = conversation_history(db, conversation_id, parameters)
+        async with scheduler.slot(message.backend, parameters, current_user.id, user_weight(current_user), message.model):
+            response_data = await generate_llm_response(
+                backend=message.backend,
+                model=message.model,
+                messages=history,
+                output_format=message.output_format,
+                format_spec=message.format_spec,
+                parameters=parameters
+            )
         
         # Save assistant message
         assistant_message = Message(
@@ -96,11 +122,15 @@ async def create_message(
         
         # Update conversation timestamp and auto-title
         conversation.updated_at = datetime.utcnow()
-        if len(conversation.messages) <= 1:
+        if _message_count(db, conversation_id) <= 1:
             conversation.title = message.content[:50] + ("..." if len(message.content) > 50 else "")
             
         db.commit()
         db.refresh(assistant_message)
+        history_cache.append(assistant_message)
+        assistant_message.generation_stats = response_data.get("stats")
+        if context:
+            assistant_message.generation_stats = {**(assistant_message.generation_stats or {}), "context": context}
         
         return assistant_message
         
@@ -115,6 +145,7 @@ async def create_message(
 async def create_message_stream(
     conversation_id: int,
     message: MessageCreate,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -131,6 +162,9 @@ async def create_message_stream(
             detail="Conversation not found"
         )
     
+    parameters = _request_parameters(message, http_request, conversation_id)
+    scheduler.admit(message.backend, parameters)
+
     # Save user message
     user_message = Message(
         conversation_id=conversation_id,
@@ -140,53 +174,84 @@ async def create_message_stream(
     db.add(user_message)
     db.commit()
     db.refresh(user_message)
+    history_cache.append(user_message)
     
+    generation = generations.start(current_user.id, conversation_id)
+
+    def save_answer(content: str) -> Message:
+        assistant_message = Message(
+            conversation_id=conversation_id,
+            role=MessageRole.assistant,
+            content=content,
+            backend=message.backend,
+            model=message.model,
+            output_format=message.output_format,
+            llm_parameters=message.llm_parameters,
+            format_spec=message.format_spec,
+            truncated=generation.stopped
+        )
+        db.add(assistant_message)
+        
+        # Update conversation
+        conversation.updated_at = datetime.utcnow()
+        if _message_count(db, conversation_id) <= 2: # User + initial
+            conversation.title = message.content[:50] + ("..." if len(message.content) > 50 else "")
+        
+        db.commit()
+        db.refresh(assistant_message)
+        history_cache.append(assistant_message)
+        return assistant_message
+
     async def generate():
         full_content = ""
+        saved = False
         try:
             # Send initial IDs
-            yield f"data: {json.dumps({'user_message_id': user_message.id})}\n\n"
+            yield sse_frame({"user_message_id": user_message.id, "generation_id": generation.id})
+
+            history, context = conversation_history(db, conversation_id, parameters)
+            if context:
+                yield sse_frame({"context": context})
 
-            async for chunk in generate_llm_response_stream(
+            events = generations.stream(generation, coalesce_events(generate_llm_response_stream(
                 backend=message.backend,
                 model=message.model,
-                messages=_get_conversation_history(conversation_id, db),
+                messages=history,
                 output_format=message.output_format,
                 format_spec=message.format_spec,
-                parameters=message.llm_parameters or {}
-            ):
-                if "content" in chunk:
-                    full_content += chunk["content"]
-                
-                yield f"data: {json.dumps(chunk)}\n\n"
+                parameters=parameters
+            ), parameters), http_request)
+            async with scheduler.slot(message.backend, parameters, current_user.id, user_weight(current_user), message.model), aclosing(events):
+                async for chunk in events:
+                    if "content" in chunk:
+                        full_content += chunk["content"]
+                    
+                    yield sse_frame(chunk)
             
-            # Save complete assistant message
-            assistant_message = Message(
-                conversation_id=conversation_id,
-                role=MessageRole.assistant,
-                content=full_content,
-                backend=message.backend,
-                model=message.model,
-                output_format=message.output_format,
-                llm_parameters=message.llm_parameters,
-                format_spec=message.format_spec
-            )
-            db.add(assistant_message)
-            
-            # Update conversation
-            conversation.updated_at = datetime.utcnow()
-            if len(conversation.messages) <= 2: # User + initial
-                conversation.title = message.content[:50] + ("..." if len(message.content) > 50 else "")
-            
-            db.commit()
-            db.refresh(assistant_message)
-            
-            yield f"data: {json.dumps({'done': True, 'assistant_message_id': assistant_message.id})}\n\n"
+            # Save complete assistant message (a stopped one only if something was generated, marked as truncated)
+            if generation.stopped and not full_content:
+                yield sse_frame({"done": True, "cancelled": True, "reason": generation.reason})
+                return
+            assistant_message = save_answer(full_content)
+            saved = True
+            done: Dict[str, Any] = {"done": True, "assistant_message_id": assistant_message.id}
+            if generation.stopped:
+                done.update(cancelled=True, reason=generation.reason, truncated=True)
+            yield sse_frame(done)
             
+        except (asyncio.CancelledError, GeneratorExit):
+            # The server dropped the response because the client disconnected
+            generation.cancel("client_disconnected")
+            if full_content and not saved:
+                save_answer(full_content)
+                saved = True
+            raise
         except Exception as e:
             import traceback
             traceback.print_exc()
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield sse_frame({"error": str(e)})
+        finally:
+            generations.finish(generation, saved and generation.stopped)
     
     return StreamingResponse(generate(), media_type="text/event-stream")
 
@@ -213,6 +278,7 @@ def update_message(
         raise HTTPException(status_code=404, detail="Message not found")
         
     message.content = message_update.content
+    message.token_count = None
     
     # If it's a user message, delete all subsequent messages in this conversation
     if message.role == MessageRole.user:
@@ -223,6 +289,7 @@ def update_message(
     
     db.commit()
     db.refresh(message)
+    history_cache.invalidate(conversation_id)
     return message
 
 
@@ -248,16 +315,29 @@ def delete_message(
         
     db.delete(message)
     db.commit()
+    history_cache.invalidate(conversation_id)
     return None
 
 
-def _get_conversation_history(conversation_id: int, db: Session) -> List[dict]:
-    """Get conversation history for LLM context"""
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(Message.created_at).all()
-    
-    history = []
-    for msg in messages:
-        history.append({"role": msg.role.value, "content": msg.content})
-    return history
+def _prefetch_model(db: Session, user_id: int, rows: List, background_tasks: BackgroundTasks) -> None:
+    """Opening a conversation: start loading the model that answered last, before the user sends anything"""
+    last = next((row for row in reversed(rows) if row.backend and row.model), None)
+    if last is None or not MODEL_PREFETCH or last.backend.value != LLMBackend.ollama.value:
+        return
+    params = merge_backend_settings(db, user_id, last.backend.value, last.llm_parameters)
+    background_tasks.add_task(residency.prefetch, LLMBackend(last.backend.value), last.model, params)
+
+
+def _message_count(db: Session, conversation_id: int) -> int:
+    """Number of stored messages, without loading them"""
+    return db.query(Message.id).filter(Message.conversation_id == conversation_id).count()
+
+
+def _request_parameters(message: MessageCreate, http_request: Request, conversation_id: int) -> dict:
+    """LLM parameters of the request, honouring the cache bypass header"""
+    parameters = dict(message.llm_parameters or {})
+    if bypass_requested(http_request.headers):
+        parameters["cache"] = False
+    # Keeps the conversation on one replica of a pool (warm prefix cache)
+    parameters["conversation_id"] = conversation_id
+    return parameters
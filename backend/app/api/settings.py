@@ -11,6 +11,8 @@ router = APIRouter(prefix="/settings", tags=["settings"])
 class BackendSettingSchema(BaseModel):
     backend: str
     base_url: Optional[str] = None
+    # Replica pool; stored comma-separated in base_url
+    endpoints: Optional[List[str]] = None
     api_key: Optional[str] = None
 
     class Config:
@@ -29,19 +31,21 @@ async def update_backend_setting(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    base_url = ",".join(url.strip() for url in setting.endpoints if url.strip()) if setting.endpoints else setting.base_url
+
     db_setting = db.query(BackendSetting).filter(
         BackendSetting.user_id == current_user.id,
         BackendSetting.backend == setting.backend
     ).first()
 
     if db_setting:
-        db_setting.base_url = setting.base_url
+        db_setting.base_url = base_url
         db_setting.api_key = setting.api_key
     else:
         db_setting = BackendSetting(
             user_id=current_user.id,
             backend=setting.backend,
-            base_url=setting.base_url,
+            base_url=base_url,
             api_key=setting.api_key
         )
         db.add(db_setting)
@@ -4,9 +4,13 @@ from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import User
 from app.services.auth import verify_token
+import os
 
 security = HTTPBearer()
 
+# Usernames allowed to see service-wide data such as /api/llm/metrics, comma-separated (empty: nobody)
+ADMIN_USERS = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
@@ -32,3 +36,13 @@ async def get_current_user(
         )
     
     return user
+
+
+async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """The current user, if it is listed in ADMIN_USERS"""
+    if current_user.username not in ADMIN_USERS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
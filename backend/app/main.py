@@ -1,20 +1,47 @@
 import os
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from app.database import engine, Base
-from app.api import auth, conversations, messages, formats, llm, settings
+from app.api import auth, conversations, messages, formats, llm, settings, jobs
+from app.services.clients import registry
+from app.services.jobs import worker_pool
+from app.services.scheduler import QueueFullError
+from app.services.endpoints import endpoint_router
+from app.services.residency import residency
+from app.services.generations import generations
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown hooks"""
+    # Resume offline jobs left over from a previous run
+    worker_pool.start()
+    endpoint_router.start()
+    # Warm up the models listed in MODEL_PRELOAD in the background
+    residency.start()
+    yield
+    # Background generations save their partial answers
+    await generations.stop()
+    await residency.stop()
+    await endpoint_router.stop()
+    await worker_pool.stop()
+    # Close pooled upstream connections cleanly
+    await registry.aclose()
+
+
 app = FastAPI(
     title="Structura Backend",
     version="0.1.0",
     description="FastAPI Backend for Structura - LLM Structured Outputs",
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    lifespan=lifespan
 )
 
 # CORS Middleware
@@ -28,6 +55,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    """Upstream endpoint is saturated: ask the client to back off"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
 # Include routers
 app.include_router(auth.router, prefix="/api")
 app.include_router(conversations.router, prefix="/api")
@@ -35,6 +72,7 @@ app.include_router(messages.router, prefix="/api")
 app.include_router(formats.router, prefix="/api")
 app.include_router(llm.router, prefix="/api")
 app.include_router(settings.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
 
 
 @app.get("/health")
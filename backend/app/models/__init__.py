@@ -8,6 +8,8 @@ from app.models.template import Template
 from app.models.regex_pattern import RegexPattern
 from app.models.csv_preset import CSVPreset
 from app.models.backend_setting import BackendSetting
+from app.models.response_cache import ResponseCacheEntry
+from app.models.job import Job, JobItem, JobStatus, JobItemStatus
 
 __all__ = [
     "User",
@@ -21,5 +23,10 @@ __all__ = [
     "RegexPattern",
     "CSVPreset",
     "BackendSetting",
+    "ResponseCacheEntry",
+    "Job",
+    "JobItem",
+    "JobStatus",
+    "JobItemStatus",
 ]
 
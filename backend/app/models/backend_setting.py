@@ -9,7 +9,7 @@ class BackendSetting(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     backend = Column(String, nullable=False)  # 'openai', 'ollama', 'vllm'
-    base_url = Column(String, nullable=True)
+    base_url = Column(String, nullable=True)  # one URL, or several replica URLs separated by commas
     api_key = Column(String, nullable=True)
 
     # Relationships
@@ -18,3 +18,7 @@ class BackendSetting(Base):
     __table_args__ = (
         UniqueConstraint("user_id", "backend", name="uq_user_backend_settings"),
     )
+
+    @property
+    def endpoints(self):
+        return [url.strip() for url in (self.base_url or "").split(",") if url.strip()]
@@ -0,0 +1,70 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Enum, Index
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from app.database import Base
+from app.models.message import OutputFormat, LLMBackend
+import enum
+
+
+class JobStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    completed = "completed"
+    cancelled = "cancelled"
+
+
+class JobItemStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    name = Column(String, nullable=True)
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.pending)
+    backend = Column(Enum(LLMBackend), nullable=False)
+    model = Column(String, nullable=False)
+    output_format = Column(Enum(OutputFormat), nullable=False)
+    format_spec = Column(Text, nullable=True)
+    llm_parameters = Column(JSON, nullable=True)
+
+    # Progress counters, checkpointed by the workers
+    total_items = Column(Integer, nullable=False, default=0)
+    completed_items = Column(Integer, nullable=False, default=0)
+    failed_items = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    # Relationships
+    user = relationship("User", backref="jobs")
+    items = relationship("JobItem", back_populates="job", cascade="all, delete-orphan")
+
+
+class JobItem(Base):
+    __tablename__ = "job_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), nullable=False)
+    index = Column(Integer, nullable=False)
+    prompt = Column(Text, nullable=False)
+    status = Column(Enum(JobItemStatus), nullable=False, default=JobItemStatus.pending)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    # Relationships
+    job = relationship("Job", back_populates="items")
+
+    __table_args__ = (
+        Index("ix_job_items_job_status", "job_id", "status"),
+        Index("ix_job_items_job_index", "job_id", "index"),
+    )
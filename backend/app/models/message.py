@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Enum, Boolean, false
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -45,5 +45,12 @@ class Message(Base):
     # Format specification (JSON schema, template, or regex)
     format_spec = Column(Text, nullable=True)
 
+    # Cached token count of the content and the tokenizer that produced it (reset when content changes)
+    token_count = Column(Integer, nullable=True)
+    token_counter = Column(String, nullable=True)
+
+    # Partial answer saved when the generation was cancelled or the client went away
+    truncated = Column(Boolean, nullable=False, default=False, server_default=false())
+
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
@@ -0,0 +1,44 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+from app.schemas.message import OutputFormat, LLMBackend
+
+
+class JobCreate(BaseModel):
+    name: Optional[str] = None
+    prompts: List[str]
+    backend: LLMBackend
+    model: str
+    output_format: OutputFormat
+    format_spec: Optional[str] = None
+    llm_parameters: Optional[Dict[str, Any]] = None
+
+
+class JobProgress(BaseModel):
+    pending: int
+    running: int
+    done: int
+    failed: int
+    progress: float
+    elapsed_seconds: float
+    throughput: float
+    eta_seconds: Optional[float] = None
+
+
+class JobResponse(BaseModel):
+    id: int
+    name: Optional[str] = None
+    status: str
+    backend: LLMBackend
+    model: str
+    output_format: OutputFormat
+    total_items: int
+    completed_items: int
+    failed_items: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    progress: Optional[JobProgress] = None
+
+    class Config:
+        from_attributes = True
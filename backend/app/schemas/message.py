@@ -53,6 +53,10 @@ class MessageResponse(BaseModel):
     output_format: Optional[OutputFormat] = None
     llm_parameters: Optional[Dict[str, Any]] = None
     format_spec: Optional[str] = None
+    # The generation was stopped before the model finished
+    truncated: bool = False
+    # Backend timing/usage stats, only set on freshly generated responses
+    generation_stats: Optional[Dict[str, Any]] = None
 
     class Config:
         from_attributes = True
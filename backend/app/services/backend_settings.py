@@ -0,0 +1,22 @@
+from typing import Dict, Any, Optional
+from sqlalchemy.orm import Session
+from app.models import BackendSetting
+
+
+def merge_backend_settings(db: Session, user_id: int, backend: str, request_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Merge provided parameters with the user's stored backend settings"""
+    params = request_params.copy() if request_params else {}
+    
+    # Load stored settings
+    setting = db.query(BackendSetting).filter(
+        BackendSetting.user_id == user_id,
+        BackendSetting.backend == backend
+    ).first()
+    
+    if setting:
+        if not params.get("base_url") and setting.base_url:
+            params["base_url"] = setting.base_url
+        if not params.get("api_key") and setting.api_key:
+            params["api_key"] = setting.api_key
+            
+    return params
@@ -0,0 +1,63 @@
+from typing import List, Dict, Any, AsyncGenerator, Tuple
+from app.schemas.message import OutputFormat, LLMBackend
+from app.services.llm import generate_llm_response
+from app.services.scheduler import scheduler
+import asyncio
+import os
+
+
+# Max concurrent generations one batch may run against each backend
+BATCH_CONCURRENCY = {
+    LLMBackend.openai: int(os.getenv("BATCH_CONCURRENCY_OPENAI", "16")),
+    LLMBackend.vllm: int(os.getenv("BATCH_CONCURRENCY_VLLM", "32")),
+    LLMBackend.ollama: int(os.getenv("BATCH_CONCURRENCY_OLLAMA", "4")),
+}
+BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", "10000"))
+
+
+def batch_concurrency(backend: LLMBackend, requested: int | None = None) -> int:
+    cap = max(1, BATCH_CONCURRENCY.get(backend, 4))
+    return max(1, min(requested, cap)) if requested else cap
+
+
+async def run_batch(
+    prompts: List[str],
+    backend: LLMBackend,
+    model: str,
+    output_format: OutputFormat,
+    format_spec: str | None,
+    parameters: Dict[str, Any],
+    concurrency: int,
+    user_id: int,
+    weight: float = 1.0
+) -> AsyncGenerator[Tuple[int, Dict[str, Any]], None]:
+    """Run every prompt with bounded fan-out and yield (index, result) in completion order"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(index: int, prompt: str) -> Tuple[int, Dict[str, Any]]:
+        async with semaphore, scheduler.slot(backend, parameters, user_id, weight, model, interactive=False):
+            try:
+                result = await generate_llm_response(
+                    backend=backend,
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    output_format=output_format,
+                    format_spec=format_spec,
+                    parameters=parameters
+                )
+            except Exception as e:
+                return index, {"error": str(e)}
+            if result.get("upstream_error"):
+                # Failures reported in-band (e.g. Ollama connection errors) are errors, not answers
+                return index, {"error": result.get("content") or "Upstream error"}
+            return index, result
+
+    tasks = [asyncio.create_task(run_one(i, p)) for i, p in enumerate(prompts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client went away (or we failed): don't leave generations running
+        for task in tasks:
+            if not task.done():
+                task.cancel()
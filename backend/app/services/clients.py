@@ -0,0 +1,211 @@
+from typing import Dict, Any, AsyncIterator, Callable, Optional, Set, Tuple
+from collections import OrderedDict
+from openai import AsyncOpenAI
+import asyncio
+import os
+import time
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))
+POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 is only negotiated (via ALPN) with TLS upstreams that offer it; plain http stays on HTTP/1.1
+HTTP2_ENABLED = HTTP2_AVAILABLE and os.getenv("LLM_HTTP2", "true").lower() in ("1", "true", "yes")
+
+# Upstream clients kept at once; least recently used idle ones beyond that are closed
+LLM_CLIENT_MAX = int(os.getenv("LLM_CLIENT_MAX", "64"))
+# Clients unused for this long (seconds) are closed as well
+LLM_CLIENT_IDLE_TTL = float(os.getenv("LLM_CLIENT_IDLE_TTL", "600"))
+
+ClientKey = Tuple[str, str, str]
+
+
+def fix_url(url: str) -> str:
+    """Replace localhost with host.docker.internal when running in Docker (macOS/Windows support)"""
+    if os.path.exists("/.dockerenv") and "localhost" in url:
+        return url.replace("localhost", "host.docker.internal")
+    return url
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close()
+        await self._stream.aclose()
+
+
+class _TrackingTransport(httpx.AsyncBaseTransport):
+    """Pooled transport that counts requests and the responses still open, so idle clients can be closed"""
+
+    def __init__(self, **kwargs: Any):
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+        self.requests = 0
+        self.active = 0
+        self.last_used = time.monotonic()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.active += 1
+        self.last_used = time.monotonic()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._done()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(response.stream, self._done),
+            extensions=response.extensions,
+        )
+
+    def _done(self) -> None:
+        self.active -= 1
+        self.last_used = time.monotonic()
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class ClientRegistry:
+    """Hands out shared keep-alive clients keyed by (backend, base_url, api_key).
+
+    Keys come from request parameters, so the registry is bounded: clients beyond LLM_CLIENT_MAX
+    (least recently used first) or idle for LLM_CLIENT_IDLE_TTL are closed once no response is open.
+    """
+
+    def __init__(self):
+        self._http: "OrderedDict[ClientKey, httpx.AsyncClient]" = OrderedDict()
+        self._transports: Dict[ClientKey, _TrackingTransport] = {}
+        self._openai: Dict[ClientKey, AsyncOpenAI] = {}
+        self._closing: Set[asyncio.Task] = set()
+        self.metrics = {"created": 0, "evicted": 0}
+
+    @staticmethod
+    def _key(backend: Any, base_url: str | None, api_key: str | None) -> ClientKey:
+        return (getattr(backend, "value", str(backend)), base_url or "", api_key or "")
+
+    def get_http_client(self, backend: Any, base_url: str | None = None, api_key: str | None = None) -> httpx.AsyncClient:
+        """Get (or create) the pooled httpx client for an upstream"""
+        key = self._key(backend, base_url, api_key)
+        client = self._http.get(key)
+        if client is None or client.is_closed:
+            transport = _TrackingTransport(
+                http2=HTTP2_ENABLED,
+                limits=httpx.Limits(
+                    max_connections=POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+                ),
+            )
+            client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(120.0, connect=10.0))
+            self._http[key] = client
+            self._transports[key] = transport
+            self._openai.pop(key, None)
+            self.metrics["created"] += 1
+            self._evict(key)
+        else:
+            # Handing a client out counts as use, even before its first request
+            self._transports[key].last_used = time.monotonic()
+        self._http.move_to_end(key)
+        return client
+
+    def get_openai_client(self, backend: Any, base_url: str | None, api_key: str) -> AsyncOpenAI:
+        """Get (or create) an AsyncOpenAI client that reuses the pooled transport"""
+        key = self._key(backend, base_url, api_key)
+        http_client = self.get_http_client(backend, base_url, api_key)
+        client = self._openai.get(key)
+        if client is None:
+            kwargs: Dict[str, Any] = {"api_key": api_key, "http_client": http_client}
+            if base_url:
+                kwargs["base_url"] = base_url
+            client = AsyncOpenAI(**kwargs)
+            self._openai[key] = client
+        return client
+
+    def _evict(self, keep: ClientKey) -> None:
+        now = time.monotonic()
+        excess = len(self._http) - LLM_CLIENT_MAX
+        for key in list(self._http):
+            transport = self._transports[key]
+            if key == keep or transport.active:
+                continue
+            if excess > 0 or now - transport.last_used >= LLM_CLIENT_IDLE_TTL:
+                excess -= 1
+                self._retire(key)
+
+    def _retire(self, key: ClientKey) -> None:
+        client = self._http.pop(key)
+        transport = self._transports.pop(key)
+        self._openai.pop(key, None)
+        self.metrics["evicted"] += 1
+        try:
+            task = asyncio.get_running_loop().create_task(self._close_when_idle(client, transport))
+        except RuntimeError:
+            return
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_when_idle(client: httpx.AsyncClient, transport: _TrackingTransport) -> None:
+        # Whoever got the client just before it was evicted may still be about to send on it
+        await asyncio.sleep(1)
+        while transport.active:
+            await asyncio.sleep(1)
+        await client.aclose()
+
+    async def aclose(self) -> None:
+        """Close every pooled client (called on app shutdown)"""
+        clients = list(self._http.values())
+        self._http.clear()
+        self._transports.clear()
+        self._openai.clear()
+        for task in list(self._closing):
+            task.cancel()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Report the registry's own counters per upstream (API keys are never included)"""
+        now = time.monotonic()
+        return {
+            "max_clients": LLM_CLIENT_MAX,
+            "http2": HTTP2_ENABLED,
+            "max_connections": POOL_MAX_CONNECTIONS,
+            "max_keepalive": POOL_MAX_KEEPALIVE,
+            **self.metrics,
+            "closing": len(self._closing),
+            "clients": [
+                {
+                    "backend": backend,
+                    "base_url": base_url or None,
+                    "requests": self._transports[key].requests,
+                    "active": self._transports[key].active,
+                    "idle_s": round(now - self._transports[key].last_used, 1),
+                }
+                for key in self._http
+                for backend, base_url, _ in [key]
+            ],
+        }
+
+
+registry = ClientRegistry()
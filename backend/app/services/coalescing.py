@@ -0,0 +1,149 @@
+from typing import Dict, Any, AsyncGenerator, Callable, List, Optional
+import asyncio
+import hashlib
+import json
+import os
+
+
+# Share one upstream generation between identical deterministic requests (per-request "coalesce" overrides)
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() in ("1", "true", "yes")
+
+# Per-request stream options: subscribers only get the events they asked for
+_STREAM_PARAMETERS = ["stream_validation", "json_deltas"]
+
+# Events a flight holds for its slowest subscriber; beyond that the upstream waits for it to catch up
+COALESCE_MAX_EVENTS = int(os.getenv("COALESCE_MAX_EVENTS", "4096"))
+
+coalescing_metrics = {"flights": 0, "coalesced": 0, "late_joins": 0, "cancelled": 0, "trimmed": 0, "stalls": 0}
+
+
+class _Flight:
+    """One in-flight upstream generation and the events its subscribers have not all read yet"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.events: List[Dict[str, Any]] = []
+        # Events dropped from the front once every subscriber had read them
+        self.base = 0
+        # Subscriber -> number of the next event it reads
+        self.cursors: Dict[object, int] = {}
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        # Set by subscribers that caught up or left, for an upstream waiting on a full buffer
+        self.drained = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def end(self) -> int:
+        return self.base + len(self.events)
+
+    async def run(self, factory: Callable[[], AsyncGenerator[Dict[str, Any], None]]) -> None:
+        try:
+            async for event in factory():
+                while len(self.events) >= COALESCE_MAX_EVENTS and not self._trim():
+                    coalescing_metrics["stalls"] += 1
+                    self.drained.clear()
+                    await self.drained.wait()
+                self.events.append(event)
+                async with self.changed:
+                    self.changed.notify_all()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._unregister()
+            async with self.changed:
+                self.changed.notify_all()
+
+    def _trim(self) -> bool:
+        """Drop the events every subscriber has read; False if there were none"""
+        drop = min(self.cursors.values(), default=self.end) - self.base
+        if drop <= 0:
+            return False
+        del self.events[:drop]
+        self.base += drop
+        if _flights.get(self.key) is self:
+            # Late joiners need the whole history: identical requests start a flight of their own from now on
+            coalescing_metrics["trimmed"] += 1
+            self._unregister()
+        return True
+
+    def _unregister(self) -> None:
+        # A newer flight for the same key may already have taken this one's place
+        if _flights.get(self.key) is self:
+            del _flights[self.key]
+
+
+_flights: Dict[str, _Flight] = {}
+
+
+def flight_key(fingerprint: str, parameters: Dict[str, Any]) -> str:
+    """Coalescing key: the request fingerprint plus the credential it is billed to and the stream options"""
+    identity = {
+        "fingerprint": fingerprint,
+        "credential": hashlib.sha256(str(parameters.get("api_key") or "").encode("utf-8")).hexdigest(),
+        "stream": {k: parameters.get(k) for k in _STREAM_PARAMETERS},
+    }
+    raw = json.dumps(identity, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def coalesced_stream(
+    key: str | None,
+    factory: Callable[[], AsyncGenerator[Dict[str, Any], None]]
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Subscribe to the generation for key, starting it if nobody else is running it.
+
+    Every subscriber walks the shared event history with its own cursor, so late joiners
+    get the already-produced prefix replayed. The history is bounded by COALESCE_MAX_EVENTS:
+    events everyone has read are dropped once it is full (the flight then takes no new
+    subscribers), and a reader that is that far behind holds the upstream until it catches up.
+    """
+    if key is None:
+        async for event in factory():
+            yield event
+        return
+
+    flight = _flights.get(key)
+    if flight is None:
+        flight = _Flight(key)
+        _flights[key] = flight
+        coalescing_metrics["flights"] += 1
+        flight.task = asyncio.create_task(flight.run(factory))
+    else:
+        coalescing_metrics["coalesced"] += 1
+        if flight.events:
+            coalescing_metrics["late_joins"] += 1
+
+    reader = object()
+    # Registered flights have dropped nothing yet
+    position = flight.cursors[reader] = flight.base
+    try:
+        while True:
+            while position < flight.end:
+                yield flight.events[position - flight.base]
+                position += 1
+                flight.cursors[reader] = position
+            flight.drained.set()
+            if flight.done:
+                break
+            async with flight.changed:
+                if position >= flight.end and not flight.done:
+                    await flight.changed.wait()
+        if flight.error is not None and not isinstance(flight.error, asyncio.CancelledError):
+            raise flight.error
+    finally:
+        del flight.cursors[reader]
+        flight.drained.set()
+        if not flight.cursors and not flight.done and flight.task is not None:
+            # Nobody is listening any more: stop the upstream generation
+            coalescing_metrics["cancelled"] += 1
+            flight._unregister()
+            flight.task.cancel()
+
+
+def coalescing_stats() -> Dict[str, Any]:
+    return {"in_flight": len(_flights), **coalescing_metrics}
@@ -0,0 +1,183 @@
+from typing import Dict, Any, List, Callable, Tuple, NamedTuple, Optional
+from sqlalchemy.orm import Session
+from app.models import MessageRole
+from app.services.history_cache import history_cache
+import importlib
+import math
+import os
+import re
+import traceback
+
+
+# Token budget for the conversation history sent to the model (0 = send everything; per-request "context_budget" overrides)
+CONTEXT_BUDGET_TOKENS = int(os.getenv("CONTEXT_BUDGET_TOKENS", "0"))
+# sliding_window, last_turns or drop_structured (per-request "context_strategy" overrides)
+CONTEXT_STRATEGY = os.getenv("CONTEXT_STRATEGY", "sliding_window")
+# Turns kept by the last_turns strategy (per-request "context_keep_turns" overrides)
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "10"))
+# "estimate", "tiktoken[:encoding]" (if installed) or a "package.module:function" counting the tokens of a string
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "estimate")
+# Role markers and separators the chat template adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+STRATEGIES = ("sliding_window", "last_turns", "drop_structured")
+
+context_metrics = {"fitted": 0, "trimmed": 0, "dropped_messages": 0, "dropped_tokens": 0}
+
+_WORDS = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Vocabulary-free estimate: about four characters per token, but at least one per word or symbol"""
+    if not text:
+        return 0
+    return max(len(_WORDS.findall(text)), math.ceil(len(text) / 4))
+
+
+tokenizers: Dict[str, Callable[[str], int]] = {"estimate": estimate_tokens}
+# Configured names that could not be loaded and fell back to the estimate
+_fallbacks: Dict[str, str] = {}
+
+
+def register_tokenizer(name: str, count: Callable[[str], int]) -> None:
+    """Make a token counter available under a name usable in CONTEXT_TOKENIZER"""
+    tokenizers[name] = count
+
+
+def _load_tokenizer(name: str) -> Callable[[str], int]:
+    if name == "tiktoken" or name.startswith("tiktoken:"):
+        import tiktoken
+        encoding = tiktoken.get_encoding(name.partition(":")[2] or "cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    module, _, attr = name.partition(":")
+    if not attr:
+        raise ValueError(f"Unknown tokenizer: {name}")
+    return getattr(importlib.import_module(module), attr)
+
+
+def get_tokenizer(name: Optional[str] = None) -> Tuple[str, Callable[[str], int]]:
+    """The counter for a tokenizer name and the name its counts are stored under"""
+    name = _fallbacks.get(name or CONTEXT_TOKENIZER, name or CONTEXT_TOKENIZER)
+    if name not in tokenizers:
+        try:
+            tokenizers[name] = _load_tokenizer(name)
+        except Exception:
+            traceback.print_exc()
+            _fallbacks[name] = "estimate"
+            return "estimate", estimate_tokens
+    return name, tokenizers[name]
+
+
+class HistoryEntry(NamedTuple):
+    role: str
+    content: str
+    tokens: int
+    # Assistant answer in a structured output format (JSON, CSV, ...)
+    structured: bool = False
+
+
+def fit_history(
+    entries: List[HistoryEntry],
+    budget: int,
+    strategy: str = CONTEXT_STRATEGY,
+    keep_turns: int = CONTEXT_KEEP_TURNS
+) -> Tuple[List[HistoryEntry], Dict[str, Any]]:
+    """Drop history until it fits the budget.
+
+    System messages and the last message (the prompt being answered) are always kept. Depending
+    on the strategy, older turns beyond keep_turns or old structured answers go first; the sliding
+    window (oldest first) is the last resort for every strategy.
+    """
+    if strategy not in STRATEGIES:
+        strategy = "sliding_window"
+    keep = [True] * len(entries)
+    pinned = {i for i, entry in enumerate(entries) if entry.role == "system"}
+    if entries:
+        pinned.add(len(entries) - 1)
+    total = sum(entry.tokens for entry in entries)
+    kept = total
+
+    def drop(index: int) -> None:
+        nonlocal kept
+        keep[index] = False
+        kept -= entries[index].tokens
+
+    if strategy == "last_turns":
+        turn_starts = [i for i, entry in enumerate(entries) if entry.role == MessageRole.user.value]
+        cutoff = turn_starts[-keep_turns] if 0 < keep_turns <= len(turn_starts) else 0
+        for i in range(cutoff):
+            if i not in pinned:
+                drop(i)
+    elif strategy == "drop_structured":
+        last_prompt = max((i for i, entry in enumerate(entries) if entry.role == MessageRole.user.value), default=0)
+        for i in range(last_prompt):
+            if kept <= budget:
+                break
+            if entries[i].structured and i not in pinned:
+                drop(i)
+
+    # Sliding window: oldest first. Everything before the first kept message is gone by then,
+    # so an answer found there would be left without its question
+    for i in range(len(entries)):
+        if i in pinned or not keep[i]:
+            continue
+        if kept <= budget and entries[i].role != MessageRole.assistant.value:
+            break
+        drop(i)
+
+    fitted = [entry for entry, k in zip(entries, keep) if k]
+    report = {
+        "budget": budget,
+        "strategy": strategy,
+        "total_tokens": total,
+        "kept_tokens": kept,
+        "dropped_tokens": total - kept,
+        "dropped_messages": len(entries) - len(fitted),
+        "over_budget": kept > budget,
+    }
+    return fitted, report
+
+
+def conversation_history(
+    db: Session,
+    conversation_id: int,
+    parameters: Dict[str, Any]
+) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+    """LLM messages of a conversation, fitted to the token budget.
+
+    Returns the messages and a report of what was dropped (None when no budget is set).
+    The history comes from the per-conversation cache; token counts are computed once per
+    message and stored on the row.
+    """
+    budget = int(parameters.get("context_budget") or CONTEXT_BUDGET_TOKENS)
+    if budget <= 0:
+        return list(history_cache.load(db, conversation_id).messages), None
+
+    tokenizer = get_tokenizer()
+    history = history_cache.load(db, conversation_id, tokenizer)
+    entries = [
+        HistoryEntry(message["role"], message["content"], tokens + MESSAGE_OVERHEAD_TOKENS, structured)
+        for message, tokens, structured in zip(history.messages, history.tokens, history.structured)
+    ]
+    fitted, report = fit_history(
+        entries,
+        budget,
+        parameters.get("context_strategy") or CONTEXT_STRATEGY,
+        int(parameters.get("context_keep_turns") or CONTEXT_KEEP_TURNS),
+    )
+    report["tokenizer"] = tokenizer[0]
+    context_metrics["fitted"] += 1
+    if report["dropped_messages"]:
+        context_metrics["trimmed"] += 1
+        context_metrics["dropped_messages"] += report["dropped_messages"]
+        context_metrics["dropped_tokens"] += report["dropped_tokens"]
+    return [{"role": entry.role, "content": entry.content} for entry in fitted], report
+
+
+def context_budget_stats() -> Dict[str, Any]:
+    return {
+        "budget_tokens": CONTEXT_BUDGET_TOKENS,
+        "strategy": CONTEXT_STRATEGY,
+        "tokenizer": get_tokenizer()[0],
+        **context_metrics,
+    }
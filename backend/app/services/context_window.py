@@ -0,0 +1,189 @@
+from typing import Dict, Any, List, Optional, Tuple
+from app.schemas.message import LLMBackend
+from app.services.clients import registry
+from app.services.context_budget import get_tokenizer, MESSAGE_OVERHEAD_TOKENS
+import asyncio
+import os
+import re
+import time
+
+
+# "auto": pick num_ctx per model from stable buckets (a requested "num_ctx" only raises the floor);
+# "request": send the requested num_ctx as is (default 4096), like before
+OLLAMA_NUM_CTX_MODE = os.getenv("OLLAMA_NUM_CTX_MODE", "auto")
+# Context sizes num_ctx is rounded up to; Ollama reloads the model whenever num_ctx changes
+OLLAMA_NUM_CTX_BUCKETS = sorted(int(b) for b in os.getenv("OLLAMA_NUM_CTX_BUCKETS", "4096,8192,16384,32768,65536,131072").split(",") if b.strip())
+# Smallest num_ctx sent in auto mode
+OLLAMA_NUM_CTX_MIN = int(os.getenv("OLLAMA_NUM_CTX_MIN", "4096"))
+# A model's num_ctx is kept (never shrunk) while it is used at least this often (seconds); like Ollama's default keep_alive
+OLLAMA_NUM_CTX_IDLE = float(os.getenv("OLLAMA_NUM_CTX_IDLE", "300"))
+# Model profiles from /api/show are refreshed after this many seconds (failed lookups after OLLAMA_SHOW_ERROR_TTL)
+OLLAMA_SHOW_TTL = float(os.getenv("OLLAMA_SHOW_TTL", "3600"))
+OLLAMA_SHOW_ERROR_TTL = float(os.getenv("OLLAMA_SHOW_ERROR_TTL", "60"))
+OLLAMA_SHOW_TIMEOUT = float(os.getenv("OLLAMA_SHOW_TIMEOUT", "5"))
+# Old fixed default, for "request" mode
+DEFAULT_NUM_CTX = 4096
+
+_NUM_CTX_PARAMETER = re.compile(r"^\s*num_ctx\s+(\d+)", re.MULTILINE)
+
+
+class ModelProfile:
+    """What /api/show tells about a model's context window"""
+
+    def __init__(self):
+        # Trained context length (model_info "<arch>.context_length")
+        self.context_length: Optional[int] = None
+        # num_ctx set in the Modelfile, which Ollama loads the model with when a request doesn't say
+        self.default_num_ctx: Optional[int] = None
+        self.expires = 0.0
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+def parse_show(data: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    """(context_length, default num_ctx) of an /api/show response"""
+    context_length = None
+    for key, value in (data.get("model_info") or {}).items():
+        if key.endswith(".context_length") and isinstance(value, int):
+            context_length = value
+            break
+    match = _NUM_CTX_PARAMETER.search(data.get("parameters") or "")
+    return context_length, int(match.group(1)) if match else None
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Local estimate of the prompt size with the configured context tokenizer"""
+    _, count = get_tokenizer()
+    total = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        total += count(content) + MESSAGE_OVERHEAD_TOKENS
+    return total
+
+
+def bucket_for(tokens: int) -> int:
+    """Smallest configured bucket holding this many tokens (the largest one if none does)"""
+    for bucket in OLLAMA_NUM_CTX_BUCKETS:
+        if bucket >= tokens:
+            return bucket
+    return OLLAMA_NUM_CTX_BUCKETS[-1] if OLLAMA_NUM_CTX_BUCKETS else tokens
+
+
+def _requested(parameters: Dict[str, Any]) -> Optional[int]:
+    custom = parameters.get("custom_params")
+    if isinstance(custom, dict) and custom.get("num_ctx"):
+        return int(custom["num_ctx"])
+    return int(parameters["num_ctx"]) if parameters.get("num_ctx") else None
+
+
+class ContextWindows:
+    """Stable num_ctx per (Ollama endpoint, model).
+
+    Each model keeps the num_ctx it was loaded with for as long as it is in use; only a prompt
+    that doesn't fit makes it grow to the next bucket (which reloads the model once).
+    """
+
+    def __init__(self):
+        self.profiles: Dict[Tuple[str, str], ModelProfile] = {}
+        # (endpoint, model) -> [num_ctx, last used]
+        self.windows: Dict[Tuple[str, str], List[float]] = {}
+        self.metrics = {"requests": 0, "kept": 0, "grown": 0, "over_context": 0, "show_lookups": 0, "show_errors": 0}
+
+    async def profile(self, endpoint: str, model: str) -> ModelProfile:
+        profile = self.profiles.setdefault((endpoint, model), ModelProfile())
+        if time.monotonic() >= profile.expires:
+            # Concurrent requests for the same model share one lookup
+            if profile.task is None or profile.task.done():
+                profile.task = asyncio.create_task(self._show(profile, endpoint, model))
+            await asyncio.shield(profile.task)
+        return profile
+
+    async def _show(self, profile: ModelProfile, endpoint: str, model: str) -> None:
+        self.metrics["show_lookups"] += 1
+        try:
+            response = await registry.get_http_client(LLMBackend.ollama, endpoint).post(
+                f"{endpoint}/api/show", json={"model": model}, timeout=OLLAMA_SHOW_TIMEOUT
+            )
+            response.raise_for_status()
+            profile.context_length, profile.default_num_ctx = parse_show(response.json())
+        except Exception as e:
+            # Keep the last good profile (if any) and look again later
+            self.metrics["show_errors"] += 1
+            profile.error = str(e) or type(e).__name__
+            profile.expires = time.monotonic() + OLLAMA_SHOW_ERROR_TTL
+        else:
+            profile.error = None
+            profile.expires = time.monotonic() + OLLAMA_SHOW_TTL
+
+    async def choose(
+        self,
+        endpoint: str,
+        model: str,
+        messages: List[Dict[str, Any]],
+        parameters: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """num_ctx for a request and why it was picked (None in "request" mode: send what was asked for)"""
+        if OLLAMA_NUM_CTX_MODE != "auto":
+            return None
+        profile = await self.profile(endpoint, model)
+        prompt_tokens = estimate_prompt_tokens(messages)
+        needed = prompt_tokens + max(int(parameters.get("max_tokens", 1024)), 0)
+        requested = _requested(parameters)
+        floor = max(needed, requested or 0)
+        limit = profile.context_length
+
+        now = time.monotonic()
+        key = (endpoint, model)
+        current = self.windows.get(key)
+        if current is not None and now - current[1] >= OLLAMA_NUM_CTX_IDLE:
+            # Unused for long enough to have been unloaded: start over
+            current = None
+        self.metrics["requests"] += 1
+        if current is not None and current[0] >= min(floor, limit or floor):
+            num_ctx, reason = int(current[0]), "kept"
+            self.metrics["kept"] += 1
+        else:
+            target = max(floor, OLLAMA_NUM_CTX_MIN)
+            if profile.default_num_ctx and profile.default_num_ctx >= target:
+                # What the model loads with anyway, e.g. for a plain "ollama run"
+                num_ctx, reason = profile.default_num_ctx, "model_default"
+            else:
+                num_ctx, reason = bucket_for(target), "bucket"
+            if limit:
+                num_ctx = min(num_ctx, limit)
+            if current is not None:
+                reason = "grown"
+                self.metrics["grown"] += 1
+        if num_ctx < floor:
+            self.metrics["over_context"] += 1
+        self.windows[key] = [num_ctx, now]
+        return {
+            "num_ctx": num_ctx,
+            "reason": reason,
+            "prompt_tokens": prompt_tokens,
+            "needed": floor,
+            "requested": requested,
+            "context_length": limit,
+            "fits": num_ctx >= floor,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": OLLAMA_NUM_CTX_MODE,
+            "buckets": OLLAMA_NUM_CTX_BUCKETS,
+            **self.metrics,
+            "models": {
+                f"{endpoint} {model}": {
+                    "num_ctx": int(self.windows[(endpoint, model)][0]) if (endpoint, model) in self.windows else None,
+                    "context_length": profile.context_length,
+                    "default_num_ctx": profile.default_num_ctx,
+                    "error": profile.error,
+                }
+                for (endpoint, model), profile in self.profiles.items()
+            },
+        }
+
+
+context_windows = ContextWindows()
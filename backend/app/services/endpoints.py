@@ -0,0 +1,241 @@
+from typing import Dict, Any, List, Optional, Tuple
+from app.schemas.message import LLMBackend
+from app.services.clients import registry, fix_url
+import asyncio
+import bisect
+import hashlib
+import math
+import os
+import time
+import traceback
+import httpx
+import openai
+
+
+# Consecutive failures (requests or probes) before a replica is ejected
+ENDPOINT_FAILURE_THRESHOLD = int(os.getenv("ENDPOINT_FAILURE_THRESHOLD", "3"))
+# Seconds an ejected replica sits out before it gets a trial request again
+ENDPOINT_COOLDOWN = float(os.getenv("ENDPOINT_COOLDOWN", "30"))
+ENDPOINT_HEALTH_INTERVAL = float(os.getenv("ENDPOINT_HEALTH_INTERVAL", "10"))
+ENDPOINT_HEALTH_TIMEOUT = float(os.getenv("ENDPOINT_HEALTH_TIMEOUT", "3"))
+# Bounded-load consistent hashing: a replica takes sticky traffic up to this factor of the average load
+ENDPOINT_AFFINITY_LOAD_FACTOR = float(os.getenv("ENDPOINT_AFFINITY_LOAD_FACTOR", "1.25"))
+# Points per replica on the hash ring
+ENDPOINT_RING_VNODES = 64
+
+# Prompt tokens per endpoint as reported by the backend (usage.prompt_tokens_details.cached_tokens)
+prompt_token_metrics: Dict[str, Dict[str, int]] = {}
+
+
+def split_endpoints(base_url: str | None) -> List[str]:
+    """A base_url may list several replicas separated by commas"""
+    return [url.strip() for url in (base_url or "").split(",") if url.strip()]
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Connection problems and 5xx answers mean the replica, not the request, is at fault"""
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError, httpx.TransportError))
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+def record_prompt_usage(base_url: str | None, usage: Any) -> None:
+    """Count cached vs uncached prompt tokens of one response"""
+    if usage is None or getattr(usage, "prompt_tokens", None) is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    entry = prompt_token_metrics.setdefault(base_url or "default", {"responses": 0, "prompt_tokens": 0, "cached_tokens": 0})
+    entry["responses"] += 1
+    entry["prompt_tokens"] += usage.prompt_tokens
+    entry["cached_tokens"] += cached
+
+
+def prompt_cache_stats() -> Dict[str, Any]:
+    return {
+        url: {
+            **entry,
+            "uncached_tokens": entry["prompt_tokens"] - entry["cached_tokens"],
+            "cached_ratio": round(entry["cached_tokens"] / entry["prompt_tokens"], 4) if entry["prompt_tokens"] else 0.0,
+        }
+        for url, entry in prompt_token_metrics.items()
+    }
+
+
+class Replica:
+    """One upstream endpoint of a pool and its circuit breaker state"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.inflight = 0
+        self.consecutive_failures = 0
+        # Set while the circuit is open (replica ejected)
+        self.opened_at: Optional[float] = None
+        self.metrics = {"requests": 0, "failures": 0, "ejections": 0}
+
+    def available(self, now: float) -> bool:
+        # Half-open after the cooldown: the next request (or probe) decides
+        return self.opened_at is None or now - self.opened_at >= ENDPOINT_COOLDOWN
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+        self.metrics["failures"] += 1
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= ENDPOINT_FAILURE_THRESHOLD:
+            if self.opened_at is None:
+                self.metrics["ejections"] += 1
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": self.inflight,
+            "healthy": self.opened_at is None,
+            "consecutive_failures": self.consecutive_failures,
+            **self.metrics,
+        }
+
+
+class EndpointPool:
+    """Replicas serving the same backend; requests go to the least busy healthy one"""
+
+    def __init__(self, backend: LLMBackend, urls: List[str]):
+        self.backend = backend
+        self.replicas = [Replica(url) for url in urls]
+        self.failovers = 0
+        self.affinity = {"sticky": 0, "spilled": 0}
+        self.ring = sorted(
+            (_hash(f"{replica.url}#{i}"), index)
+            for index, replica in enumerate(self.replicas)
+            for i in range(ENDPOINT_RING_VNODES)
+        )
+        self.ring_points = [point for point, _ in self.ring]
+
+    def candidates(self, affinity_key: Any = None) -> List[Replica]:
+        """Replicas in the order they should be tried.
+
+        Without an affinity key: least outstanding requests first. With one (a conversation id),
+        the key's home replica on the hash ring comes first so follow-up turns hit its warm prefix
+        cache, unless it carries more than its bounded share of the load.
+        """
+        now = time.monotonic()
+        healthy = [r for r in self.replicas if r.available(now)]
+        if not healthy:
+            # Everything is ejected: try the replica that has been out the longest rather than fail outright
+            return sorted(self.replicas, key=lambda r: r.opened_at or 0.0)
+        if affinity_key is None:
+            return sorted(healthy, key=lambda r: r.inflight)
+
+        ordered = self._ring_order(str(affinity_key), healthy)
+        bound = math.ceil(ENDPOINT_AFFINITY_LOAD_FACTOR * (sum(r.inflight for r in healthy) + 1) / len(healthy))
+        chosen = next((r for r in ordered if r.inflight < bound), ordered[0])
+        self.affinity["sticky" if chosen is ordered[0] else "spilled"] += 1
+        return [chosen] + [r for r in ordered if r is not chosen]
+
+    def _ring_order(self, key: str, healthy: List[Replica]) -> List[Replica]:
+        # Walk the ring clockwise from the key and collect each healthy replica once
+        start = bisect.bisect(self.ring_points, _hash(key))
+        ordered: List[Replica] = []
+        for offset in range(len(self.ring)):
+            replica = self.replicas[self.ring[(start + offset) % len(self.ring)][1]]
+            if replica in healthy and replica not in ordered:
+                ordered.append(replica)
+                if len(ordered) == len(healthy):
+                    break
+        return ordered
+
+    def begin(self, replica: Replica) -> None:
+        replica.inflight += 1
+        replica.metrics["requests"] += 1
+
+    def end(self, replica: Replica, ok: Optional[bool]) -> None:
+        """ok=None: the outcome says nothing about the replica's health"""
+        replica.inflight -= 1
+        if ok is not None:
+            replica.record(ok)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "failovers": self.failovers,
+            "affinity": dict(self.affinity),
+            "replicas": {r.url: r.stats() for r in self.replicas},
+        }
+
+
+def _health_url(backend: LLMBackend, url: str) -> str:
+    if backend == LLMBackend.ollama:
+        return url.replace("/v1", "").rstrip("/") + "/api/tags"
+    base = url.rstrip("/")
+    if not base.endswith("/v1"):
+        base += "/v1"
+    return base + "/models"
+
+
+class EndpointRouter:
+    """Keeps one pool per configured replica list and probes their health in the background"""
+
+    def __init__(self):
+        self.pools: Dict[Tuple[str, Tuple[str, ...]], EndpointPool] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def pool_for(self, backend: LLMBackend, parameters: Dict[str, Any]) -> Optional[EndpointPool]:
+        """The pool behind parameters["base_url"], or None for a plain single endpoint"""
+        if backend == LLMBackend.openai:
+            # The OpenAI client always talks to the hosted API and ignores base_url
+            return None
+        urls = split_endpoints(parameters.get("base_url"))
+        if len(urls) < 2:
+            return None
+        key = (getattr(backend, "value", str(backend)), tuple(urls))
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = self.pools[key] = EndpointPool(backend, urls)
+        return pool
+
+    def start(self) -> None:
+        if self.task is None and ENDPOINT_HEALTH_INTERVAL > 0:
+            self.task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(ENDPOINT_HEALTH_INTERVAL)
+            try:
+                await self.probe_all()
+            except Exception:
+                traceback.print_exc()
+
+    async def probe_all(self) -> None:
+        probes = [
+            self._probe(pool.backend, replica)
+            for pool in list(self.pools.values())
+            for replica in pool.replicas
+        ]
+        await asyncio.gather(*probes)
+
+    async def _probe(self, backend: LLMBackend, replica: Replica) -> None:
+        # Probes go through the shared pool but without the API key: a 401 still proves the server is up
+        url = fix_url(_health_url(backend, replica.url))
+        try:
+            response = await registry.get_http_client(backend, replica.url).get(url, timeout=ENDPOINT_HEALTH_TIMEOUT)
+            replica.record(response.status_code < 500)
+        except Exception:
+            replica.record(False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            f"{backend} {','.join(urls)}": pool.stats()
+            for (backend, urls), pool in self.pools.items()
+        }
+
+
+endpoint_router = EndpointRouter()
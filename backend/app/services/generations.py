@@ -0,0 +1,316 @@
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, Deque, List, Optional, Set, Tuple
+from collections import deque
+from starlette.requests import Request
+from app.services.serialization import sse_frame
+import asyncio
+import itertools
+import os
+import time
+import traceback
+import uuid
+
+
+# How often a streaming response checks whether its client is still connected (ms)
+SSE_DISCONNECT_POLL_MS = float(os.getenv("SSE_DISCONNECT_POLL_MS", "250"))
+# Numbered events kept per generation for clients that reconnect with Last-Event-ID
+GENERATION_BUFFER_EVENTS = int(os.getenv("GENERATION_BUFFER_EVENTS", "1024"))
+# Finished generations can be replayed for this long (seconds)
+GENERATION_TTL = float(os.getenv("GENERATION_TTL", "300"))
+# A background generation nobody reads any more is aborted after this many seconds (0: right away)
+GENERATION_RESUME_GRACE = float(os.getenv("GENERATION_RESUME_GRACE", "10"))
+
+
+class Generation:
+    """One streaming generation that can be stopped by its owner or by a client disconnect.
+
+    Generations run in the background also keep their events, numbered, in a bounded
+    ring buffer, so clients can (re)attach and continue where they left off.
+    """
+
+    def __init__(self, user_id: int, conversation_id: Optional[int]):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.started = time.monotonic()
+        self.stop = asyncio.Event()
+        # "cancelled" (cancel endpoint), "client_disconnected" or "interrupted" (shutdown); None while it runs normally
+        self.reason: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.buffer: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=GENERATION_BUFFER_EVENTS)
+        self.last_id = 0
+        # Everything generated so far and the latest value of every other event key,
+        # for clients that fell behind the buffer
+        self.content: List[str] = []
+        self.meta: Dict[str, Any] = {}
+        self.finished_at: Optional[float] = None
+        self.subscribers: Set[object] = set()
+        self.abandon_timer: Optional[asyncio.TimerHandle] = None
+        self.wake = asyncio.Event()
+
+    def cancel(self, reason: str) -> None:
+        if not self.stop.is_set():
+            self.reason = reason
+            self.stop.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def event_id(self, number: int) -> str:
+        return f"{self.id}:{number}"
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        self.last_id += 1
+        self.buffer.append((self.last_id, event))
+        for key, value in event.items():
+            if key == "content":
+                self.content.append(value)
+            elif key != "json_delta":
+                self.meta[key] = value
+        self._notify()
+
+    def _notify(self) -> None:
+        # Readers wait on the current event; the next publish gets a fresh one
+        self.wake.set()
+        self.wake = asyncio.Event()
+
+    def since(self, after: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """Buffered events numbered above after"""
+        if not self.buffer or after >= self.last_id:
+            return []
+        first = self.buffer[0][0]
+        return list(itertools.islice(self.buffer, max(after - first + 1, 0), None))
+
+
+def parse_event_id(value: Optional[str]) -> Tuple[Optional[str], int]:
+    """(generation id, event number) of a Last-Event-ID header ("<generation>:<number>")"""
+    generation_id, _, number = (value or "").strip().rpartition(":")
+    try:
+        return generation_id or None, int(number)
+    except ValueError:
+        return None, 0
+
+
+async def _close_source(iterator: AsyncIterator[Dict[str, Any]], step: Optional[asyncio.Future]) -> None:
+    if step is not None and not step.done():
+        # Throws into the source where it waits for upstream data, which closes the request
+        step.cancel()
+        await asyncio.gather(step, return_exceptions=True)
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+class GenerationRegistry:
+    """Streaming generations: abortable before the model finishes, resumable when run in the background"""
+
+    def __init__(self):
+        self.active: Dict[str, Generation] = {}
+        self.metrics = {
+            "started": 0, "completed": 0, "cancelled": 0, "client_disconnected": 0, "interrupted": 0,
+            "truncated_saved": 0, "resumed": 0, "snapshots": 0, "expired": 0,
+        }
+
+    def start(self, user_id: int, conversation_id: Optional[int] = None) -> Generation:
+        self._expire()
+        generation = Generation(user_id, conversation_id)
+        self.active[generation.id] = generation
+        self.metrics["started"] += 1
+        return generation
+
+    def finish(self, generation: Generation, truncated_saved: bool = False) -> None:
+        if generation.finished or generation.id not in self.active:
+            return
+        generation.finished_at = time.monotonic()
+        if generation.task is None:
+            # Streamed inline: nothing to replay
+            del self.active[generation.id]
+        self.metrics[generation.reason or "completed"] += 1
+        if truncated_saved:
+            self.metrics["truncated_saved"] += 1
+        generation._notify()
+
+    def run(self, generation: Generation, produce: Callable[[Generation], Awaitable[None]]) -> None:
+        """Run the generation as a task of its own, independent of the response that started it"""
+
+        async def runner() -> None:
+            try:
+                await produce(generation)
+            except asyncio.CancelledError:
+                generation.cancel("interrupted")
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                generation.publish({"error": str(e)})
+            finally:
+                self.finish(generation)
+
+        generation.task = asyncio.create_task(runner())
+
+    def get(self, generation_id: str, user_id: int) -> Optional[Generation]:
+        """A generation of this user that can still be read"""
+        self._expire()
+        generation = self.active.get(generation_id)
+        if generation is None or generation.user_id != user_id or generation.task is None:
+            return None
+        return generation
+
+    def cancel(self, generation_id: str, user_id: int) -> Optional[Generation]:
+        """Stop a running generation of this user (None if there is none with that id)"""
+        generation = self.active.get(generation_id)
+        if generation is None or generation.user_id != user_id or generation.finished:
+            return None
+        generation.cancel("cancelled")
+        return generation
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for generation_id, generation in list(self.active.items()):
+            if generation.finished and now - generation.finished_at >= GENERATION_TTL:
+                del self.active[generation_id]
+                self.metrics["expired"] += 1
+
+    async def _watch(self, generation: Generation, request: Request, on_disconnect: Callable[[], None]) -> None:
+        # Servers that don't cancel the response on disconnect only notice it on the next write
+        while not generation.stopped:
+            if await request.is_disconnected():
+                on_disconnect()
+                return
+            await asyncio.sleep(SSE_DISCONNECT_POLL_MS / 1000)
+
+    def _attach(self, generation: Generation, reader: object) -> None:
+        generation.subscribers.add(reader)
+        if generation.abandon_timer is not None:
+            generation.abandon_timer.cancel()
+            generation.abandon_timer = None
+
+    def _detach(self, generation: Generation, reader: object) -> None:
+        if reader not in generation.subscribers:
+            return
+        generation.subscribers.discard(reader)
+        if generation.subscribers or generation.finished:
+            return
+        # Give the client a moment to reconnect before throwing the work away
+        if GENERATION_RESUME_GRACE <= 0:
+            generation.cancel("client_disconnected")
+        else:
+            generation.abandon_timer = asyncio.get_running_loop().call_later(
+                GENERATION_RESUME_GRACE, self._abandon, generation
+            )
+
+    @staticmethod
+    def _abandon(generation: Generation) -> None:
+        generation.abandon_timer = None
+        if not generation.subscribers:
+            generation.cancel("client_disconnected")
+
+    async def subscribe(self, generation: Generation, after: int = 0, request: Optional[Request] = None) -> AsyncIterator[bytes]:
+        """SSE frames of a background generation from event number after on, until it is finished.
+
+        A reader that fell out of the ring buffer first gets one snapshot event with all content
+        generated so far (and the latest message ids etc.) and continues from there.
+        """
+        reader = object()
+        self._attach(generation, reader)
+        if after:
+            self.metrics["resumed"] += 1
+        watcher = None
+        if request is not None:
+            watcher = asyncio.create_task(self._watch(generation, request, lambda: self._detach(generation, reader)))
+        try:
+            cursor = after
+            while True:
+                if generation.buffer and cursor < generation.buffer[0][0] - 1:
+                    cursor = generation.last_id
+                    self.metrics["snapshots"] += 1
+                    snapshot = {**generation.meta, "snapshot": "".join(generation.content)}
+                    yield sse_frame(snapshot, generation.event_id(cursor))
+                    continue
+                wake = generation.wake
+                pending = generation.since(cursor)
+                for number, event in pending:
+                    yield sse_frame(event, generation.event_id(number))
+                    cursor = number
+                if pending:
+                    continue
+                if generation.finished:
+                    break
+                await wake.wait()
+            yield b"data: [DONE]\n\n"
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            self._detach(generation, reader)
+
+    async def stream(
+        self,
+        generation: Generation,
+        events: AsyncIterator[Dict[str, Any]],
+        request: Optional[Request] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Pass events through until the generation is stopped, then close the source right away.
+
+        Closing the source cancels the upstream HTTP request, which makes the model server stop
+        generating. It happens in its own task, so it also works when the server has already
+        abandoned the response. With a request, a client disconnect stops the generation as well.
+        """
+        iterator = events.__aiter__()
+        step: Optional[asyncio.Future] = None
+        closing: Optional[asyncio.Future] = None
+
+        def close() -> asyncio.Future:
+            nonlocal closing
+            if closing is None:
+                closing = asyncio.ensure_future(_close_source(iterator, step))
+            return closing
+
+        async def close_when_stopped() -> None:
+            await generation.stop.wait()
+            await close()
+
+        stopper = asyncio.create_task(close_when_stopped())
+        watcher = None
+        if request is not None:
+            watcher = asyncio.create_task(self._watch(generation, request, lambda: generation.cancel("client_disconnected")))
+        try:
+            while not generation.stopped:
+                step = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait({step, stopper}, return_when=asyncio.FIRST_COMPLETED)
+                if generation.stopped or not step.done():
+                    return
+                try:
+                    event = step.result()
+                except StopAsyncIteration:
+                    return
+                yield event
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not generation.stopped:
+                stopper.cancel()
+            # Shielded: the response may be getting cancelled, the upstream request must be closed anyway
+            await asyncio.shield(close())
+
+    async def stop(self) -> None:
+        """Shutdown: interrupt background generations (they save what they have)"""
+        tasks = [g.task for g in self.active.values() if g.task is not None and not g.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire()
+        running = sum(1 for generation in self.active.values() if not generation.finished)
+        return {
+            "active": running,
+            "buffered": len(self.active) - running,
+            "buffered_events": sum(len(generation.buffer) for generation in self.active.values()),
+            **self.metrics,
+        }
+
+
+generations = GenerationRegistry()
@@ -0,0 +1,146 @@
+from typing import Dict, Any, AsyncGenerator, Callable, List, Optional
+from collections import deque
+from app.services.endpoints import EndpointPool, Replica, is_retryable_error
+import asyncio
+import os
+import time
+
+
+# Opt-in (per-request "hedge" overrides): duplicate a pooled stream on a second replica if it is slow to start
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "false").lower() in ("1", "true", "yes")
+# Fixed hedge delay, used until enough time-to-first-token samples exist for the percentile
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", "1500"))
+# Hedge once a stream is slower to start than this percentile of recent TTFTs (0 disables)
+HEDGE_TTFT_PERCENTILE = float(os.getenv("HEDGE_TTFT_PERCENTILE", "95"))
+# Hedges may never exceed this share of hedge-eligible requests
+HEDGE_BUDGET_PERCENT = float(os.getenv("HEDGE_BUDGET_PERCENT", "5"))
+HEDGE_MIN_SAMPLES = 20
+
+hedge_metrics = {"eligible": 0, "hedged": 0, "hedge_wins": 0, "over_budget": 0, "cancelled": 0}
+_ttft_samples: Dict[int, deque] = {}
+
+
+def _hedge_delay(pool: EndpointPool) -> float:
+    samples = _ttft_samples.get(id(pool))
+    if HEDGE_TTFT_PERCENTILE > 0 and samples and len(samples) >= HEDGE_MIN_SAMPLES:
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * HEDGE_TTFT_PERCENTILE / 100))
+        return ordered[index]
+    return HEDGE_DELAY_MS / 1000
+
+
+def _within_budget() -> bool:
+    return hedge_metrics["hedged"] + 1 <= hedge_metrics["eligible"] * HEDGE_BUDGET_PERCENT / 100
+
+
+class _Attempt:
+    def __init__(self, replica: Replica, stream: AsyncGenerator[Any, None]):
+        self.replica = replica
+        self.stream = stream
+        self.started = time.monotonic()
+        self.hedge = False
+        self.first = asyncio.ensure_future(stream.__anext__())
+
+
+async def hedged_stream(
+    pool: EndpointPool,
+    candidates: List[Replica],
+    open_stream: Callable[[Replica], AsyncGenerator[Any, None]]
+) -> AsyncGenerator[Any, None]:
+    """Stream from the first candidate, racing a duplicate on the next one if no first chunk arrives in time.
+
+    The first attempt to produce a chunk wins and the other is cancelled. Attempts that fail before
+    their first chunk (connection errors, 5xx) fall through to the next candidate like plain failover.
+    """
+    hedge_metrics["eligible"] += 1
+    remaining = list(candidates)
+    attempts: List[_Attempt] = []
+
+    def launch(hedge: bool = False) -> None:
+        replica = remaining.pop(0)
+        pool.begin(replica)
+        attempt = _Attempt(replica, open_stream(replica))
+        attempt.hedge = hedge
+        attempts.append(attempt)
+
+    launch()
+    hedged = False
+    winner: Optional[_Attempt] = None
+    first_event: Any = None
+    failure: Any = None
+    try:
+        while winner is None:
+            pending = [a for a in attempts if not a.first.done()]
+            timeout = None
+            if not hedged and remaining and pending:
+                timeout = max(0.0, _hedge_delay(pool) - (time.monotonic() - attempts[0].started))
+            done = set()
+            if pending:
+                done, _ = await asyncio.wait([a.first for a in pending], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if pending and not done:
+                hedged = True
+                if _within_budget():
+                    hedge_metrics["hedged"] += 1
+                    launch(hedge=True)
+                else:
+                    hedge_metrics["over_budget"] += 1
+                continue
+
+            for attempt in [a for a in pending if a.first in done]:
+                try:
+                    event = attempt.first.result()
+                except StopAsyncIteration:
+                    event = None
+                except Exception as e:
+                    if not is_retryable_error(e):
+                        raise
+                    failure = e
+                else:
+                    if not (isinstance(event, dict) and event.get("retryable")):
+                        winner, first_event = attempt, event
+                        break
+                    failure = event
+                # Failed before producing anything
+                attempts.remove(attempt)
+                await attempt.stream.aclose()
+                pool.end(attempt.replica, False)
+
+            if winner is None and not [a for a in attempts if not a.first.done()]:
+                if not remaining:
+                    break
+                # Every running attempt failed before its first chunk: fail over
+                pool.failovers += 1
+                launch()
+    finally:
+        for attempt in attempts:
+            if attempt is winner:
+                continue
+            # The loser (or everything, if we are being cancelled)
+            attempt.first.cancel()
+            await asyncio.gather(attempt.first, return_exceptions=True)
+            await attempt.stream.aclose()
+            pool.end(attempt.replica, None)
+            hedge_metrics["cancelled"] += 1
+
+    if winner is None:
+        if isinstance(failure, BaseException):
+            raise failure
+        if failure is not None:
+            yield failure
+        return
+
+    _ttft_samples.setdefault(id(pool), deque(maxlen=200)).append(time.monotonic() - winner.started)
+    if winner.hedge:
+        hedge_metrics["hedge_wins"] += 1
+    try:
+        if first_event is not None:
+            yield first_event
+            async for chunk in winner.stream:
+                yield chunk
+    finally:
+        await winner.stream.aclose()
+        pool.end(winner.replica, True)
+
+
+def hedging_stats() -> Dict[str, Any]:
+    return {"enabled": HEDGE_REQUESTS, "budget_percent": HEDGE_BUDGET_PERCENT, **hedge_metrics}
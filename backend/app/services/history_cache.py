@@ -0,0 +1,165 @@
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from collections import OrderedDict
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+from app.models import Message, MessageRole, OutputFormat
+import os
+import threading
+
+
+# Conversations whose prepared LLM message lists are kept in memory (least recently used go first)
+HISTORY_CACHE_CONVERSATIONS = int(os.getenv("HISTORY_CACHE_CONVERSATIONS", "512"))
+# Upper bound for the cached message text of all conversations together
+HISTORY_CACHE_MAX_CHARS = int(os.getenv("HISTORY_CACHE_MAX_CHARS", "50000000"))
+
+Tokenizer = Tuple[str, Callable[[str], int]]
+
+
+class History:
+    """Prepared {"role", "content"} messages of one conversation, plus what the context budget needs"""
+
+    def __init__(self):
+        self.messages: List[Dict[str, str]] = []
+        # Only known when loaded for the context budget (None: loaded from role and content alone)
+        self.ids: Optional[List[int]] = None
+        self.structured: List[bool] = []
+        self.tokens: List[Optional[int]] = []
+        self.tokenizer: Optional[str] = None
+        # Row count and highest id when loaded; a mismatch means another process changed the conversation
+        self.count = 0
+        self.last_id = 0
+        self.chars = 0
+
+    def add(self, role: str, content: str, structured: bool = False, message_id: Optional[int] = None, tokens: Optional[int] = None) -> None:
+        self.messages.append({"role": role, "content": content})
+        self.structured.append(structured)
+        self.tokens.append(tokens)
+        if self.ids is not None:
+            self.ids.append(message_id)
+        self.chars += len(content)
+
+
+def _structured(role: MessageRole, output_format: Optional[OutputFormat]) -> bool:
+    return role == MessageRole.assistant and output_format not in (None, OutputFormat.default)
+
+
+class HistoryCache:
+    """Bounded LRU of prepared conversation histories, kept current by appending new messages"""
+
+    def __init__(self):
+        self.entries: "OrderedDict[int, History]" = OrderedDict()
+        self.chars = 0
+        self.lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0, "stale": 0, "appends": 0, "invalidations": 0, "evictions": 0, "counted_messages": 0}
+
+    def load(self, db: Session, conversation_id: int, tokenizer: Optional[Tokenizer] = None) -> History:
+        """The conversation's history, from memory if it is still current.
+
+        With a tokenizer, token counts and structured flags are filled in as well; counts missing
+        from the rows are computed once and stored back on them.
+        """
+        count, last_id = db.query(func.count(Message.id), func.max(Message.id)).filter(
+            Message.conversation_id == conversation_id
+        ).one()
+        last_id = last_id or 0
+        with self.lock:
+            history = self.entries.get(conversation_id)
+            if history is not None and (history.count, history.last_id) != (count, last_id):
+                self.metrics["stale"] += 1
+                self._drop(conversation_id)
+                history = None
+            if history is not None and (tokenizer is None or (history.ids is not None and history.tokenizer == tokenizer[0])):
+                self.entries.move_to_end(conversation_id)
+                self.metrics["hits"] += 1
+            else:
+                history = None
+
+        if history is None:
+            self.metrics["misses"] += 1
+            history = self._read(db, conversation_id, tokenizer)
+            history.count, history.last_id = count, last_id
+            self._store(conversation_id, history)
+        if tokenizer is not None:
+            self._count_missing(db, history, tokenizer)
+        return history
+
+    @staticmethod
+    def _read(db: Session, conversation_id: int, tokenizer: Optional[Tokenizer]) -> History:
+        history = History()
+        if tokenizer is None:
+            rows = db.query(Message.role, Message.content).filter(
+                Message.conversation_id == conversation_id
+            ).order_by(Message.created_at).all()
+            for row in rows:
+                history.add(row.role.value, row.content)
+            return history
+
+        rows = db.query(
+            Message.id, Message.role, Message.content, Message.output_format, Message.token_count, Message.token_counter
+        ).filter(
+            Message.conversation_id == conversation_id
+        ).order_by(Message.created_at).all()
+        history.ids = []
+        history.tokenizer = tokenizer[0]
+        for row in rows:
+            tokens = row.token_count if row.token_counter == tokenizer[0] else None
+            history.add(row.role.value, row.content, _structured(row.role, row.output_format), row.id, tokens)
+        return history
+
+    def _count_missing(self, db: Session, history: History, tokenizer: Tokenizer) -> None:
+        name, count = tokenizer
+        counted: List[Dict[str, Any]] = []
+        for i, tokens in enumerate(history.tokens):
+            if tokens is None:
+                history.tokens[i] = count(history.messages[i]["content"])
+                counted.append({"id": history.ids[i], "token_count": history.tokens[i], "token_counter": name})
+        if counted:
+            db.execute(update(Message), counted)
+            db.commit()
+            self.metrics["counted_messages"] += len(counted)
+
+    def _store(self, conversation_id: int, history: History) -> None:
+        with self.lock:
+            self._drop(conversation_id)
+            if history.chars > HISTORY_CACHE_MAX_CHARS or HISTORY_CACHE_CONVERSATIONS <= 0:
+                return
+            self.entries[conversation_id] = history
+            self.chars += history.chars
+            while len(self.entries) > HISTORY_CACHE_CONVERSATIONS or self.chars > HISTORY_CACHE_MAX_CHARS:
+                oldest = next(iter(self.entries))
+                self._drop(oldest)
+                self.metrics["evictions"] += 1
+
+    def _drop(self, conversation_id: int) -> None:
+        history = self.entries.pop(conversation_id, None)
+        if history is not None:
+            self.chars -= history.chars
+
+    def append(self, message: Message) -> None:
+        """Add a newly committed message to its conversation's cached history (if cached)"""
+        with self.lock:
+            history = self.entries.get(message.conversation_id)
+            if history is None:
+                return
+            if message.id <= history.last_id:
+                # Not the newest message after all: rebuild on the next read
+                self._drop(message.conversation_id)
+                return
+            history.add(message.role.value, message.content, _structured(message.role, message.output_format), message.id)
+            history.count += 1
+            history.last_id = message.id
+            self.chars += len(message.content)
+            self.metrics["appends"] += 1
+
+    def invalidate(self, conversation_id: int) -> None:
+        """Forget a conversation after its messages were edited or deleted"""
+        with self.lock:
+            if conversation_id in self.entries:
+                self._drop(conversation_id)
+                self.metrics["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"conversations": len(self.entries), "chars": self.chars, **self.metrics}
+
+
+history_cache = HistoryCache()
@@ -0,0 +1,225 @@
+from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta
+from sqlalchemy import insert, func
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from app.database import SessionLocal
+from app.models import Job, JobItem, JobStatus, JobItemStatus
+from app.services.llm import generate_llm_response
+from app.services.backend_settings import merge_backend_settings
+from app.services.scheduler import scheduler, user_weight
+import asyncio
+import os
+import traceback
+
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "2"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "300"))
+# How long idle workers sleep before looking for due retries again
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_INSERT_BATCH = 1000
+
+
+def create_job(
+    db: Session,
+    user_id: int,
+    prompts: List[str],
+    backend: Any,
+    model: str,
+    output_format: Any,
+    format_spec: str | None,
+    parameters: Optional[Dict[str, Any]],
+    name: str | None = None
+) -> Job:
+    """Persist a job and its items, then wake the workers"""
+    job = Job(
+        user_id=user_id,
+        name=name,
+        status=JobStatus.running,
+        backend=backend,
+        model=model,
+        output_format=output_format,
+        format_spec=format_spec,
+        llm_parameters=parameters,
+        total_items=len(prompts),
+        started_at=datetime.utcnow()
+    )
+    db.add(job)
+    db.flush()
+    for start in range(0, len(prompts), JOB_INSERT_BATCH):
+        db.execute(insert(JobItem), [
+            {"job_id": job.id, "index": start + i, "prompt": prompt, "status": JobItemStatus.pending, "attempts": 0}
+            for i, prompt in enumerate(prompts[start:start + JOB_INSERT_BATCH])
+        ])
+    db.commit()
+    db.refresh(job)
+    worker_pool.wake()
+    return job
+
+
+def job_progress(db: Session, job: Job) -> Dict[str, Any]:
+    """Counts, throughput (items/s) and ETA (s) of a job"""
+    counts = dict(
+        db.query(JobItem.status, func.count(JobItem.id))
+        .filter(JobItem.job_id == job.id)
+        .group_by(JobItem.status)
+        .all()
+    )
+    processed = job.completed_items + job.failed_items
+    end = job.finished_at or datetime.utcnow()
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0.0
+    throughput = processed / elapsed if elapsed > 0 else 0.0
+    remaining = job.total_items - processed
+    eta = remaining / throughput if throughput > 0 and job.status == JobStatus.running else None
+    return {
+        "pending": counts.get(JobItemStatus.pending, 0),
+        "running": counts.get(JobItemStatus.running, 0),
+        "done": counts.get(JobItemStatus.done, 0),
+        "failed": counts.get(JobItemStatus.failed, 0),
+        "progress": round(processed / job.total_items, 4) if job.total_items else 1.0,
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput": round(throughput, 3),
+        "eta_seconds": round(eta, 1) if eta is not None else None,
+    }
+
+
+class JobWorkerPool:
+    """In-process asyncio workers that drain job items from the database"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+        self.metrics = {"processed": 0, "failed": 0, "retried": 0}
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self.tasks or self.size <= 0:
+            return
+        self._resume_interrupted()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.size)]
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def _resume_interrupted(self) -> None:
+        # Items that were running when the process died are simply picked up again
+        db = SessionLocal()
+        try:
+            db.query(JobItem).filter(JobItem.status == JobItemStatus.running).update(
+                {JobItem.status: JobItemStatus.pending}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _claim(self, db: Session) -> Optional[JobItem]:
+        now = datetime.utcnow()
+        item = (
+            db.query(JobItem)
+            .join(Job, Job.id == JobItem.job_id)
+            .filter(
+                Job.status == JobStatus.running,
+                JobItem.status == JobItemStatus.pending,
+                (JobItem.next_attempt_at == None) | (JobItem.next_attempt_at <= now)  # noqa: E711
+            )
+            .order_by(JobItem.job_id, JobItem.index)
+            .first()
+        )
+        if item is not None:
+            item.status = JobItemStatus.running
+            item.attempts += 1
+            db.commit()
+        return item
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                db = SessionLocal()
+                try:
+                    async with self._claim_lock:
+                        item = self._claim(db)
+                    if item is not None:
+                        await self._process(db, item)
+                finally:
+                    db.close()
+                if item is None:
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), JOB_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    async def _process(self, db: Session, item: JobItem) -> None:
+        job = item.job
+        parameters = merge_backend_settings(db, job.user_id, job.backend, job.llm_parameters)
+        counter = None
+        try:
+            async with scheduler.slot(job.backend, parameters, job.user_id, user_weight(job.user), job.model, interactive=False):
+                result = await generate_llm_response(
+                    backend=job.backend,
+                    model=job.model,
+                    messages=[{"role": "user", "content": item.prompt}],
+                    output_format=job.output_format,
+                    format_spec=job.format_spec,
+                    parameters=parameters
+                )
+            if result.get("upstream_error"):
+                raise RuntimeError(result.get("content"))
+            item.result = result.get("content", "")
+            item.error = None
+            item.status = JobItemStatus.done
+            item.finished_at = datetime.utcnow()
+            counter = Job.completed_items
+            self.metrics["processed"] += 1
+        except asyncio.CancelledError:
+            # Shutdown: hand the item back so the next start picks it up
+            item.status = JobItemStatus.pending
+            item.attempts -= 1
+            db.commit()
+            raise
+        except Exception as e:
+            item.error = str(e)
+            if item.attempts < JOB_MAX_ATTEMPTS:
+                delay = min(JOB_RETRY_BASE_DELAY * (2 ** (item.attempts - 1)), JOB_RETRY_MAX_DELAY)
+                item.status = JobItemStatus.pending
+                item.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                self.metrics["retried"] += 1
+            else:
+                item.status = JobItemStatus.failed
+                item.finished_at = datetime.utcnow()
+                counter = Job.failed_items
+                self.metrics["failed"] += 1
+
+        if counter is not None:
+            # Several workers finish items of the same job: increment in SQL, not on the stale instance
+            db.query(Job).filter(Job.id == job.id).update({counter: counter + 1}, synchronize_session=False)
+            db.query(Job).filter(
+                Job.id == job.id,
+                Job.status == JobStatus.running,
+                Job.completed_items + Job.failed_items >= Job.total_items
+            ).update({Job.status: JobStatus.completed, Job.finished_at: datetime.utcnow()}, synchronize_session=False)
+        try:
+            db.commit()
+        except StaleDataError:
+            # The job was deleted while this item was running
+            db.rollback()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": len(self.tasks), **self.metrics}
+
+
+worker_pool = JobWorkerPool(JOB_WORKERS)
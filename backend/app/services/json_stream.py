@@ -0,0 +1,285 @@
+from typing import List, Dict, Any, Optional
+import json
+import re
+
+
+# Characters that can make up a number or a true/false/null literal
+_SCALAR_RUN = re.compile(r"[-+.0-9eE]+|[a-z]+")
+_WHITESPACE = " \t\r\n"
+
+_JSON_TYPES = {
+    "object": (dict,),
+    "array": (list,),
+    "string": (str,),
+    "boolean": (bool,),
+    "null": (type(None),),
+}
+
+
+def _pointer(path: List[Any]) -> str:
+    """RFC 6901 JSON pointer for a path"""
+    return "".join("/" + str(p).replace("~", "~0").replace("/", "~1") for p in path)
+
+
+def _type_matches(expected: str, value: Any) -> bool:
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool) or (isinstance(value, float) and value.is_integer())
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    types = _JSON_TYPES.get(expected)
+    return types is None or isinstance(value, types)
+
+
+class _Frame:
+    __slots__ = ("kind", "path", "schema", "key", "index", "keys")
+
+    def __init__(self, kind: str, path: List[Any], schema: Optional[Dict[str, Any]]):
+        self.kind = kind
+        self.path = path
+        self.schema = schema
+        self.key: Optional[str] = None
+        self.index = 0
+        self.keys: set = set()
+
+
+class IncrementalJSONParser:
+    """Consumes a JSON document chunk by chunk and emits JSON-Patch style "add" operations.
+
+    Containers are announced when they open, scalars when they complete, so applying the
+    operations in order rebuilds the document. Completed values are checked against the
+    (subset of) JSON schema that can be judged locally: type, enum, const and required.
+    Output that is not JSON at all only stops the deltas; it is never treated as a violation.
+    """
+
+    def __init__(self, schema: Optional[Dict[str, Any]] = None):
+        self.root_schema = schema if isinstance(schema, dict) else None
+        self.stack: List[_Frame] = []
+        self.state = "VALUE"
+        self.buffer = ""
+        self.offset = 0
+        self.received = ""
+        self._cursor = 0
+        self._string_scan = 1
+        self.broken = False
+        self.error: Optional[Dict[str, Any]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state == "DONE"
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Consume a chunk; returns the patch operations completed by it"""
+        ops: List[Dict[str, Any]] = []
+        if self.broken or self.error or self.done:
+            return ops
+        self.buffer += text
+        buf = self.buffer
+        pos = 0
+        n = len(buf)
+        while pos < n and not (self.broken or self.error or self.done):
+            ch = buf[pos]
+            if ch in _WHITESPACE:
+                pos += 1
+                continue
+            if ch == '"':
+                end = self._find_string_end(buf, pos)
+                if end < 0:
+                    break
+                try:
+                    token = json.loads(buf[pos:end + 1], strict=False)
+                except json.JSONDecodeError:
+                    self.broken = True
+                    break
+                self._string_scan = 1
+                self._cursor = self.offset + pos
+                self._token("string", token, ops)
+                pos = end + 1
+                continue
+            if ch in "{}[]:,":
+                self._cursor = self.offset + pos
+                self._token(ch, None, ops)
+                pos += 1
+                continue
+            m = _SCALAR_RUN.match(buf, pos)
+            if not m:
+                self.broken = True
+                break
+            if m.end() == n:
+                # A number/literal that may still grow
+                break
+            try:
+                value = json.loads(m.group())
+            except json.JSONDecodeError:
+                self.broken = True
+                break
+            self._cursor = self.offset + pos
+            self._token("scalar", value, ops)
+            pos = m.end()
+        self.offset += pos
+        self.received = (self.received + buf[max(0, pos - 80):pos])[-80:]
+        self.buffer = buf[pos:]
+        return ops
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Flush a trailing top-level number/literal at the end of the stream"""
+        ops: List[Dict[str, Any]] = []
+        rest = self.buffer.strip()
+        if rest and not (self.broken or self.error or self.done):
+            try:
+                value = json.loads(rest)
+            except json.JSONDecodeError:
+                self.broken = True
+                return ops
+            self._cursor = self.offset
+            self._token("scalar", value, ops)
+            self.buffer = ""
+        return ops
+
+    def _find_string_end(self, buf: str, start: int) -> int:
+        # Resume scanning where the previous chunk stopped so long strings stay linear
+        i = start + self._string_scan
+        while True:
+            i = buf.find('"', i)
+            if i < 0:
+                self._string_scan = max(1, len(buf) - start)
+                return -1
+            backslashes = 0
+            j = i - 1
+            while j > start and buf[j] == "\\":
+                backslashes += 1
+                j -= 1
+            if backslashes % 2 == 0:
+                return i
+            i += 1
+
+    def _resolve(self, schema: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        seen = 0
+        while isinstance(schema, dict) and "$ref" in schema and self.root_schema is not None and seen < 32:
+            ref = schema["$ref"]
+            if not isinstance(ref, str) or not ref.startswith("#"):
+                return None
+            target: Any = self.root_schema
+            for part in [p for p in ref[1:].split("/") if p]:
+                part = part.replace("~1", "/").replace("~0", "~")
+                target = target.get(part) if isinstance(target, dict) else None
+            schema = target
+            seen += 1
+        if not isinstance(schema, dict) or any(k in schema for k in ("anyOf", "oneOf", "allOf", "not", "if")):
+            # Combinators can't be judged value by value: don't constrain anything below them
+            return None
+        return schema
+
+    def _child_schema(self) -> Optional[Dict[str, Any]]:
+        if not self.stack:
+            return self._resolve(self.root_schema)
+        frame = self.stack[-1]
+        schema = frame.schema
+        if schema is None:
+            return None
+        if frame.kind == "object":
+            sub = (schema.get("properties") or {}).get(frame.key)
+            if sub is None and isinstance(schema.get("additionalProperties"), dict):
+                sub = schema["additionalProperties"]
+        else:
+            prefix = schema.get("prefixItems")
+            if isinstance(prefix, list) and frame.index < len(prefix):
+                sub = prefix[frame.index]
+            else:
+                sub = schema.get("items") if isinstance(schema.get("items"), dict) else None
+        return self._resolve(sub)
+
+    def _child_path(self) -> List[Any]:
+        if not self.stack:
+            return []
+        frame = self.stack[-1]
+        return frame.path + [frame.key if frame.kind == "object" else frame.index]
+
+    def _violation(self, path: List[Any], reason: str) -> None:
+        self.error = {"path": _pointer(path), "offset": self._cursor, "reason": reason}
+
+    def _check(self, schema: Optional[Dict[str, Any]], value: Any, path: List[Any]) -> bool:
+        if schema is None:
+            return True
+        expected = schema.get("type")
+        if expected is not None:
+            allowed = expected if isinstance(expected, list) else [expected]
+            if not any(_type_matches(t, value) for t in allowed):
+                self._violation(path, f"Expected {' or '.join(map(str, allowed))}")
+                return False
+        if isinstance(value, (dict, list)):
+            return True
+        if "enum" in schema and isinstance(schema["enum"], list) and value not in schema["enum"]:
+            self._violation(path, f"Value {json.dumps(value)} is not one of {json.dumps(schema['enum'])}")
+            return False
+        if "const" in schema and value != schema["const"]:
+            self._violation(path, f"Value {json.dumps(value)} does not equal {json.dumps(schema['const'])}")
+            return False
+        return True
+
+    def _token(self, kind: str, value: Any, ops: List[Dict[str, Any]]) -> None:
+        state = self.state
+        if state in ("VALUE", "VALUE_OR_END"):
+            if kind == "]" and state == "VALUE_OR_END":
+                self._close("array")
+            elif kind in ("{", "["):
+                container: Any = {} if kind == "{" else []
+                path, schema = self._child_path(), self._child_schema()
+                if not self._check(schema, container, path):
+                    return
+                ops.append({"op": "add", "path": _pointer(path), "value": container})
+                self.stack.append(_Frame("object" if kind == "{" else "array", path, schema))
+                self.state = "KEY_OR_END" if kind == "{" else "VALUE_OR_END"
+            elif kind in ("string", "scalar"):
+                path = self._child_path()
+                if not self._check(self._child_schema(), value, path):
+                    return
+                ops.append({"op": "add", "path": _pointer(path), "value": value})
+                self._after_value()
+            else:
+                self.broken = True
+        elif state in ("KEY", "KEY_OR_END"):
+            if kind == "string":
+                self.stack[-1].key = value
+                self.state = "COLON"
+            elif kind == "}" and state == "KEY_OR_END":
+                self._close("object")
+            else:
+                self.broken = True
+        elif state == "COLON":
+            if kind == ":":
+                self.state = "VALUE"
+            else:
+                self.broken = True
+        elif state == "COMMA_OR_END":
+            frame = self.stack[-1]
+            if kind == ",":
+                self.state = "KEY" if frame.kind == "object" else "VALUE"
+            elif kind == "}" and frame.kind == "object":
+                self._close("object")
+            elif kind == "]" and frame.kind == "array":
+                self._close("array")
+            else:
+                self.broken = True
+
+    def _after_value(self) -> None:
+        if not self.stack:
+            self.state = "DONE"
+            return
+        frame = self.stack[-1]
+        if frame.kind == "object":
+            frame.keys.add(frame.key)
+        else:
+            frame.index += 1
+        self.state = "COMMA_OR_END"
+
+    def _close(self, kind: str) -> None:
+        frame = self.stack.pop()
+        if kind == "object" and frame.schema is not None:
+            missing = [k for k in frame.schema.get("required") or [] if k not in frame.keys]
+            if missing:
+                self._violation(frame.path, f"Missing required properties: {', '.join(missing)}")
+                return
+        self._after_value()
+
+    def failure_event(self) -> Dict[str, Any]:
+        return {"validation_failed": {**(self.error or {}), "received": self.received}}
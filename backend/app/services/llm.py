@@ -1,44 +1,95 @@
 from typing import List, Dict, Any, AsyncGenerator, Optional
 from app.schemas.message import OutputFormat, LLMBackend
+from app.services.clients import registry, fix_url as _fix_url
+from app.services.plans import GenerationPlan, get_generation_plan, PROMPT_LAYOUT
+from app.services.validation import create_prefix_validator
+from app.services.json_stream import IncrementalJSONParser
+from app.services.response_cache import cache_key, get_cached_response, store_response, is_deterministic, request_fingerprint
+from app.services.coalescing import coalesced_stream, flight_key, COALESCE_REQUESTS
+from app.services.endpoints import endpoint_router, is_retryable_error, record_prompt_usage
+from app.services.hedging import hedged_stream, HEDGE_REQUESTS
+from app.services.model_cache import model_cache
+from app.services.residency import residency
+from app.services.scheduler import scheduler
+from app.services.context_window import context_windows
+from app.services.ollama_stream import iter_ndjson, JSONStringUnescaper, unescape_string_output, json_loads
 from openai import AsyncOpenAI
 import os
-import json
-import re
 import httpx
 
 
-def _fix_url(url: str) -> str:
-    """Replace localhost with host.docker.internal when running in Docker (macOS/Windows support)"""
-    if os.path.exists("/.dockerenv") and "localhost" in url:
-        return url.replace("localhost", "host.docker.internal")
-    return url
+# Abort streams early once regex/template output can no longer match (per-request "stream_validation" overrides)
+STREAM_VALIDATION = os.getenv("STREAM_VALIDATION", "true").lower() in ("1", "true", "yes")
+validation_metrics = {"aborted": 0}
+# Emit incremental json_delta patch events for json output (per-request "json_deltas" overrides)
+STREAM_JSON_DELTAS = os.getenv("STREAM_JSON_DELTAS", "true").lower() in ("1", "true", "yes")
+
+# Characters per chunk when replaying a cached response on a stream
+CACHE_REPLAY_CHUNK_SIZE = 64
+
+# Timing/usage fields reported by Ollama on the final (or only) /api/chat response
+OLLAMA_STAT_FIELDS = ["eval_count", "eval_duration", "prompt_eval_count", "prompt_eval_duration", "load_duration", "total_duration"]
+
+
+def _ollama_base_url(parameters: Dict[str, Any]) -> str:
+    """Root URL of the native Ollama API (without the OpenAI-compatible /v1 suffix)"""
+    base_url = (parameters.get("base_url") or "http://localhost:11434").replace("/v1", "").rstrip("/")
+    return _fix_url(base_url)
 
 
 def _get_openai_client(backend: LLMBackend, parameters: Dict[str, Any]) -> AsyncOpenAI:
-    """Get the appropriate OpenAI-compatible client for the backend"""
+    """Get the appropriate (pooled) OpenAI-compatible client for the backend"""
     if backend == LLMBackend.openai:
         api_key = parameters.get("api_key") or os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OpenAI API key not provided")
-        return AsyncOpenAI(api_key=api_key)
+        client = registry.get_openai_client(backend, None, api_key)
     
     elif backend == LLMBackend.vllm:
         base_url = parameters.get("base_url") or "http://localhost:8000/v1"
         base_url = _fix_url(base_url)
         if not base_url.endswith("/v1") and not base_url.endswith("/v1/"):
             base_url = base_url.rstrip("/") + "/v1"
-        return AsyncOpenAI(base_url=base_url, api_key="vllm-key")
+        client = registry.get_openai_client(backend, base_url, "vllm-key")
     
     elif backend == LLMBackend.ollama:
         base_url = parameters.get("base_url") or "http://localhost:11434/v1"
         base_url = _fix_url(base_url)
         if not base_url.endswith("/v1") and not base_url.endswith("/v1/"):
             base_url = base_url.rstrip("/") + "/v1"
-        return AsyncOpenAI(base_url=base_url, api_key="ollama")
+        client = registry.get_openai_client(backend, base_url, "ollama")
     
     else:
         raise ValueError(f"Unsupported backend for OpenAI client: {backend}")
 
+    if parameters.get("max_retries") is not None:
+        # Pool replicas: fail over right away instead of letting the SDK retry the same replica
+        client = client.with_options(max_retries=parameters["max_retries"])
+    return client
+
+
+def _prepare_messages(plan: GenerationPlan, messages: List[Dict[str, Any]], parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Add the format instruction of the plan to a copy of the messages"""
+    # Create a shallow copy to avoid modifying the original list
+    processed_messages = list(messages)
+    
+    if plan.output_format != OutputFormat.default and plan.format_spec:
+        # Avoid double-adding instructions if they are already in the last user message or system prompt
+        last_msg = processed_messages[-1] if processed_messages else {}
+        last_msg_content = last_msg.get("content", "")
+        last_text = ""
+        if isinstance(last_msg_content, str): last_text = last_msg_content
+        elif isinstance(last_msg_content, list):
+            for part in last_msg_content:
+                if isinstance(part, dict) and part.get("type") == "text":
+                    last_text = part.get("text", "")
+                    break
+
+        if "%-%-%" not in last_text: # Marker check if we ever add one
+            processed_messages = plan.apply_instruction(processed_messages, parameters.get("prompt_layout") or PROMPT_LAYOUT)
+
+    return processed_messages
+
 
 async def generate_llm_response(
     backend: LLMBackend,
@@ -47,78 +98,62 @@ async def generate_llm_response(
     output_format: OutputFormat,
     format_spec: str | None,
     parameters: Dict[str, Any]
-) -> Dict[str, str]:
+) -> Dict[str, Any]:
     """Generate non-streaming response from LLM based on backend and format using OpenAI SDK where possible"""
-    
-    # Pre-process messages
-    processed_messages = messages
-
-    if backend == LLMBackend.ollama:
-        agg_content = ""
-        async for chunk in generate_llm_response_stream(backend, model, messages, output_format, format_spec, parameters):
-            if "content" in chunk: agg_content += chunk["content"]
-        return {"content": agg_content}
+    plan = get_generation_plan(backend, output_format, format_spec)
+    key = cache_key(backend, model, messages, output_format, format_spec, parameters)
+    cached = get_cached_response(key)
+    if cached is not None:
+        return {"content": cached, "cached": True}
+
+    pool = endpoint_router.pool_for(backend, parameters)
+    if pool is None:
+        result = await _generate_upstream(plan, model, messages, parameters)
+    else:
+        candidates = pool.candidates(parameters.get("conversation_id"))
+        for attempt, replica in enumerate(candidates):
+            # Fail over to the next replica on connection errors and 5xx answers
+            can_retry = attempt < len(candidates) - 1
+            pool.begin(replica)
+            try:
+                result = await _generate_upstream(plan, model, messages, _replica_parameters(parameters, replica.url))
+            except Exception as e:
+                pool.end(replica, not is_retryable_error(e))
+                if can_retry and is_retryable_error(e):
+                    pool.failovers += 1
+                    continue
+                raise
+            pool.end(replica, not result.get("retryable"))
+            if can_retry and result.get("retryable"):
+                pool.failovers += 1
+                continue
+            break
+
+    result.pop("retryable", None)
+    if not result.get("upstream_error"):
+        store_response(key, backend, model, result["content"])
+    return result
+
+
+async def _generate_upstream(
+    plan: GenerationPlan,
+    model: str,
+    messages: List[Dict[str, Any]],
+    parameters: Dict[str, Any]
+) -> Dict[str, Any]:
+    """One non-streaming request against the endpoint in parameters["base_url"]"""
+    if plan.backend == LLMBackend.ollama:
+        return await _generate_ollama_native(plan, model, _prepare_messages(plan, messages, parameters), parameters)
 
-    client = _get_openai_client(backend, parameters)
-    
-    request_params = {
-        "model": model,
-        "messages": processed_messages,
-        "temperature": float(parameters.get("temperature", 0.7)),
-        "max_tokens": int(parameters.get("max_tokens", 1024)),
-    }
-    
-    for param in ["top_p", "frequency_penalty", "presence_penalty", "seed"]:
-        if param in parameters and parameters[param] is not None:
-            request_params[param] = parameters[param]
-
-    if output_format != OutputFormat.default and format_spec:
-        format_instruction = _get_format_instruction(output_format, format_spec)
-        messages_copy = list(processed_messages)
-        if messages_copy and messages_copy[0].get("role") == "system":
-            messages_copy[0] = {
-                "role": "system",
-                "content": format_instruction + "\n\n" + messages_copy[0]["content"]
-            }
-        else:
-            messages_copy.insert(0, {"role": "system", "content": format_instruction})
-        request_params["messages"] = messages_copy
-    
-    if output_format == OutputFormat.json and format_spec:
-        try:
-            schema = json.loads(format_spec)
-            # Only use strict json_schema for OpenAI
-            if backend == LLMBackend.openai:
-                request_params["response_format"] = {
-                    "type": "json_schema",
-                    "json_schema": {"name": "response", "schema": schema, "strict": True}
-                }
-            elif backend == LLMBackend.vllm:
-                request_params["response_format"] = {
-                    "type": "json_schema",
-                    "json_schema": {"name": "response", "schema": schema}
-                }
-            else:
-                request_params["response_format"] = {"type": "json_object"}
-        except:
-            request_params["response_format"] = {"type": "json_object"}
-    
-    if backend == LLMBackend.vllm:
-        if "extra_body" not in request_params: request_params["extra_body"] = {}
-        if output_format == OutputFormat.regex and format_spec:
-            request_params["extra_body"]["structured_outputs"] = {"regex": format_spec}
-        elif output_format == OutputFormat.template and format_spec:
-            request_params["extra_body"]["structured_outputs"] = {"regex": _template_to_regex(format_spec)}
-        elif output_format == OutputFormat.html:
-            request_params["extra_body"]["structured_outputs"] = {"regex": r"\s*<[!?a-zA-Z].*"}
-        elif output_format == OutputFormat.csv:
-            request_params["extra_body"]["structured_outputs"] = {"regex": _csv_to_regex(format_spec or "")}
+    client = _get_openai_client(plan.backend, parameters)
+    request_params = plan.openai_request_params(
+        model, plan.apply_instruction(messages, parameters.get("prompt_layout") or PROMPT_LAYOUT), parameters, stream=False
+    )
 
     response = await client.chat.completions.create(**request_params)
+    record_prompt_usage(parameters.get("base_url"), response.usage)
     msg = response.choices[0].message
-    content = msg.content or ""
-    
-    return {"content": content}
+    return {"content": msg.content or ""}
 
 
 async def generate_llm_response_stream(
@@ -128,319 +163,329 @@ async def generate_llm_response_stream(
     output_format: OutputFormat,
     format_spec: str | None,
     parameters: Dict[str, Any]
-) -> AsyncGenerator[Dict[str, str], None]:
+) -> AsyncGenerator[Dict[str, Any], None]:
     """Generate streaming response from LLM based on backend and format using OpenAI SDK where possible"""
-    # Create a shallow copy to avoid modifying the original list
-    processed_messages = list(messages)
-    
-    if output_format != OutputFormat.default and format_spec:
-        # Avoid double-adding instructions if they are already in the last user message or system prompt
-        last_msg = processed_messages[-1] if processed_messages else {}
-        last_msg_content = last_msg.get("content", "")
-        last_text = ""
-        if isinstance(last_msg_content, str): last_text = last_msg_content
-        elif isinstance(last_msg_content, list):
-            for part in last_msg_content:
-                if isinstance(part, dict) and part.get("type") == "text":
-                    last_text = part.get("text", "")
-                    break
+    key = None
+    if parameters.get("coalesce", COALESCE_REQUESTS) and is_deterministic(parameters):
+        key = flight_key(request_fingerprint(backend, model, messages, output_format, format_spec, parameters), parameters)
 
-        if "%-%-%" not in last_text: # Marker check if we ever add one
-            format_instruction = _get_format_instruction(output_format, format_spec)
-            if processed_messages and processed_messages[0].get("role") == "system":
-                processed_messages[0] = {
-                    "role": "system",
-                    "content": format_instruction + "\n\n" + processed_messages[0]["content"]
-                }
-            else:
-                processed_messages.insert(0, {"role": "system", "content": format_instruction})
+    def factory() -> AsyncGenerator[Dict[str, Any], None]:
+        return _generate_llm_response_stream(backend, model, messages, output_format, format_spec, parameters)
+
+    async for event in coalesced_stream(key, factory):
+        yield event
 
-    if backend == LLMBackend.ollama:
-        stream_gen = _generate_ollama_stream_native(model, processed_messages, output_format, format_spec, parameters)
+
+async def _generate_llm_response_stream(
+    backend: LLMBackend,
+    model: str,
+    messages: List[Dict[str, Any]],
+    output_format: OutputFormat,
+    format_spec: str | None,
+    parameters: Dict[str, Any]
+) -> AsyncGenerator[Dict[str, Any], None]:
+    plan = get_generation_plan(backend, output_format, format_spec)
+    processed_messages = _prepare_messages(plan, messages, parameters)
+
+    key = cache_key(backend, model, messages, output_format, format_spec, parameters)
+    cached = get_cached_response(key)
+    if cached is not None:
+        yield {"cached": True}
+        stream_gen = _replay_cached_response(cached)
     else:
-        stream_gen = _generate_openai_compatible_stream(backend, model, processed_messages, output_format, format_spec, parameters)
-
-    async for raw_chunk in stream_gen:
-        if isinstance(raw_chunk, dict):
-            # Extract content text
-            chunk_text = raw_chunk.get("content", "")
-            
-            # Yield any other metadata (like message IDs)
-            other_meta = {k: v for k, v in raw_chunk.items() if k not in ["content"]}
-            if other_meta:
-                yield other_meta
+        stream_gen = _upstream_stream(plan, model, processed_messages, parameters)
+    recorded: List[str] = []
+    upstream_error = False
+
+    validator = None
+    if parameters.get("stream_validation", STREAM_VALIDATION):
+        validator = create_prefix_validator(plan.validation_pattern)
+
+    json_parser = None
+    if output_format == OutputFormat.json and parameters.get("json_deltas", STREAM_JSON_DELTAS):
+        json_parser = IncrementalJSONParser(plan.json_schema)
+
+    try:
+        async for raw_chunk in stream_gen:
+            if isinstance(raw_chunk, dict):
+                if raw_chunk.get("upstream_error"):
+                    # Error text is not model output: pass it on untouched, never record or validate it
+                    upstream_error = True
+                    yield raw_chunk
+                    continue
+
+                # Extract content text
+                chunk_text = raw_chunk.get("content", "")
                 
+                # Yield any other metadata (like message IDs)
+                other_meta = {k: v for k, v in raw_chunk.items() if k not in ["content", "upstream_error", "retryable"]}
+                if other_meta:
+                    yield other_meta
+            else:
+                chunk_text = raw_chunk
+
             if chunk_text:
+                recorded.append(chunk_text)
+                if validator and not validator.feed(chunk_text):
+                    # Output is doomed: stop the upstream generation instead of running to max_tokens
+                    validation_metrics["aborted"] += 1
+                    yield validator.failure_event(plan.validation_pattern)
+                    break
+                json_ops = json_parser.feed(chunk_text) if json_parser else None
+                if json_parser and json_parser.error:
+                    validation_metrics["aborted"] += 1
+                    yield json_parser.failure_event()
+                    break
                 yield {"content": chunk_text}
+                if json_ops:
+                    yield {"json_delta": json_ops}
         else:
-            yield {"content": raw_chunk}
+            if json_parser:
+                json_ops = json_parser.finish()
+                if json_ops:
+                    yield {"json_delta": json_ops}
+            if cached is None and not upstream_error:
+                store_response(key, backend, model, "".join(recorded))
+    finally:
+        await stream_gen.aclose()
 
 
-async def _generate_openai_compatible_stream(
-    backend: LLMBackend,
+def _replica_parameters(parameters: Dict[str, Any], url: str) -> Dict[str, Any]:
+    return {**parameters, "base_url": url, "max_retries": 0}
+
+
+def _open_stream(
+    plan: GenerationPlan,
     model: str,
     messages: List[Dict[str, Any]],
-    output_format: OutputFormat,
-    format_spec: str | None,
     parameters: Dict[str, Any]
 ) -> AsyncGenerator[Any, None]:
-    client = _get_openai_client(backend, parameters)
-    request_params = {
-        "model": model,
-        "messages": messages,
-        "temperature": float(parameters.get("temperature", 0.7)),
-        "max_tokens": int(parameters.get("max_tokens", 1024)),
-        "stream": True,
-    }
+    if plan.backend == LLMBackend.ollama:
+        return _generate_ollama_stream_native(plan, model, messages, parameters)
+    return _generate_openai_compatible_stream(plan, model, messages, parameters)
 
-    for param in ["top_p", "frequency_penalty", "presence_penalty", "seed"]:
-        if param in parameters and parameters[param] is not None:
-            request_params[param] = parameters[param]
-    
-    if "stop" in parameters and parameters["stop"] is not None:
-        request_params["stop"] = parameters["stop"]
-    elif output_format == OutputFormat.template and format_spec:
-        # Extract literals from template to use as stop sequences
-        # This is very helpful for templates to know when a GEN part ends
-        parts = format_spec.split("[GEN]")
-        stops = []
-        for p in parts[1:]:
-            if not p: continue
-            # Take the first few characters of the static text following [GEN]
-            # Ollama/vLLM like short stop sequences
-            stop_candidate = p.split("\n")[0].strip()
-            if stop_candidate:
-                stops.append(stop_candidate[:20]) # Limit length
-        if stops: 
-            # If there's a final static part, that's a good stop
-            if parts[-1].strip():
-                stops.append(parts[-1].strip()[:20])
-            request_params["stop"] = list(set(stops))
-
-    if "custom_params" in parameters and isinstance(parameters["custom_params"], dict):
-        for k, v in parameters["custom_params"].items():
-            request_params[k] = v
-    
-    if output_format == OutputFormat.json and format_spec:
+
+async def _upstream_stream(
+    plan: GenerationPlan,
+    model: str,
+    messages: List[Dict[str, Any]],
+    parameters: Dict[str, Any]
+) -> AsyncGenerator[Any, None]:
+    """Stream from the endpoint, failing over between pool replicas until the first chunk arrives"""
+    pool = endpoint_router.pool_for(plan.backend, parameters)
+    if pool is None:
+        stream = _open_stream(plan, model, messages, parameters)
         try:
-            schema = json.loads(format_spec)
-            if backend == LLMBackend.openai:
-                request_params["response_format"] = {
-                    "type": "json_schema", 
-                    "json_schema": {"name": "response", "schema": schema, "strict": True}
-                }
-            elif backend == LLMBackend.vllm:
-                # vLLM supports json_schema in a similar way
-                request_params["response_format"] = {
-                    "type": "json_schema",
-                    "json_schema": {"name": "response", "schema": schema}
-                }
-            else:
-                request_params["response_format"] = {"type": "json_object"}
-        except:
-            request_params["response_format"] = {"type": "json_object"}
-    
-    if backend == LLMBackend.vllm:
-        if "extra_body" not in request_params: request_params["extra_body"] = {}
-        if output_format == OutputFormat.regex and format_spec:
-            request_params["extra_body"]["structured_outputs"] = {"regex": format_spec}
-        elif output_format == OutputFormat.template and format_spec:
-            request_params["extra_body"]["structured_outputs"] = {"regex": _template_to_regex(format_spec)}
-        elif output_format == OutputFormat.html:
-            request_params["extra_body"]["structured_outputs"] = {"regex": r"\s*<[!?a-zA-Z].*"}
-        elif output_format == OutputFormat.csv:
-            request_params["extra_body"]["structured_outputs"] = {"regex": _csv_to_regex(format_spec or "")}
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+        return
+
+    candidates = pool.candidates(parameters.get("conversation_id"))
+    if parameters.get("hedge", HEDGE_REQUESTS) and len(candidates) > 1:
+        def open_replica(replica):
+            return _open_stream(plan, model, messages, _replica_parameters(parameters, replica.url))
+
+        async for chunk in hedged_stream(pool, candidates, open_replica):
+            yield chunk
+        return
+
+    for attempt, replica in enumerate(candidates):
+        can_retry = attempt < len(candidates) - 1
+        stream = _open_stream(plan, model, messages, _replica_parameters(parameters, replica.url))
+        pool.begin(replica)
+        ok = None
+        try:
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                ok = True
+                return
+            except Exception as e:
+                ok = not is_retryable_error(e)
+                if can_retry and not ok:
+                    pool.failovers += 1
+                    continue
+                raise
+            ok = not (isinstance(first, dict) and first.get("retryable"))
+            if can_retry and not ok:
+                pool.failovers += 1
+                continue
+            # Committed to this replica: later errors are passed through, not retried
+            yield first
+            async for chunk in stream:
+                yield chunk
+            return
+        finally:
+            await stream.aclose()
+            pool.end(replica, ok)
+
+
+async def _replay_cached_response(content: str) -> AsyncGenerator[str, None]:
+    """Re-emit a cached answer as a sequence of stream chunks"""
+    for i in range(0, len(content), CACHE_REPLAY_CHUNK_SIZE):
+        yield content[i:i + CACHE_REPLAY_CHUNK_SIZE]
+
+
+async def _generate_openai_compatible_stream(
+    plan: GenerationPlan,
+    model: str,
+    messages: List[Dict[str, Any]],
+    parameters: Dict[str, Any]
+) -> AsyncGenerator[Any, None]:
+    client = _get_openai_client(plan.backend, parameters)
+    request_params = plan.openai_request_params(model, messages, parameters, stream=True)
 
     stream = await client.chat.completions.create(**request_params)
-    async for chunk in stream:
-        if not chunk.choices: continue
-        delta = chunk.choices[0].delta
-        if delta.content:
-            yield {"content": delta.content}
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                # Final usage chunk (stream_options.include_usage)
+                record_prompt_usage(parameters.get("base_url"), chunk.usage)
+            if not chunk.choices: continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                yield {"content": delta.content}
+    finally:
+        # Closing the response aborts the upstream request if we stop early
+        await stream.close()
 
 
 async def _generate_ollama_stream_native(
+    plan: GenerationPlan,
     model: str,
     messages: List[Dict[str, Any]],
-    output_format: OutputFormat,
-    format_spec: str | None,
     parameters: Dict[str, Any]
 ) -> AsyncGenerator[str, None]:
-    base_url = (parameters.get("base_url") or "http://localhost:11434").replace("/v1", "").rstrip("/")
-    base_url = _fix_url(base_url)
+    base_url = _ollama_base_url(parameters)
     url = f"{base_url}/api/chat"
     
-    stops = []
-    if "stop" in parameters and parameters["stop"]:
-        stops = parameters["stop"] if isinstance(parameters["stop"], list) else [parameters["stop"]]
-    elif output_format == OutputFormat.template and format_spec:
-        parts = format_spec.split("[GEN]")
-        stops = [p.split("\n")[0] for p in parts[1:] if p and p.split("\n")[0].strip()]
-
-    payload = {
-        "model": model,
-        "messages": messages,
-        "stream": True,
-        "options": {
-            "temperature": float(parameters.get("temperature", 0.7)),
-            "num_predict": int(parameters.get("max_tokens", 1024)),
-            "top_p": float(parameters.get("top_p", 1.0)),
-            "seed": parameters.get("seed"),
-            "stop": stops if stops else None,
-            "num_ctx": parameters.get("num_ctx", 4096),
-        }
-    }
-    
-    if "custom_params" in parameters and isinstance(parameters["custom_params"], dict):
-        for k, v in parameters["custom_params"].items():
-            payload["options"][k] = v
-    
-    payload["format"] = _build_ollama_format(output_format, format_spec)
+    payload = plan.ollama_payload(model, messages, parameters, stream=True)
+    keep_alive = residency.keep_alive(model, parameters)
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    window = await context_windows.choose(base_url, model, messages, parameters)
+    if window:
+        payload["options"]["num_ctx"] = window["num_ctx"]
     
-    async with httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0)) as client:
-        try:
-            async with client.stream("POST", url, json=payload) as response:
-                if response.status_code != 200:
-                    try:
-                        error_data = await response.aread()
-                        yield f"Ollama Error ({response.status_code}): {error_data.decode()}"
-                    except:
-                        yield f"Ollama Error ({response.status_code})"
+    client = registry.get_http_client(LLMBackend.ollama, base_url)
+    try:
+        async with client.stream("POST", url, json=payload, timeout=httpx.Timeout(120.0, connect=10.0)) as response:
+            if response.status_code != 200:
+                retryable = response.status_code >= 500
+                try:
+                    error_data = await response.aread()
+                    yield {"content": f"Ollama Error ({response.status_code}): {error_data.decode()}", "upstream_error": True, "retryable": retryable}
+                except:
+                    yield {"content": f"Ollama Error ({response.status_code})", "upstream_error": True, "retryable": retryable}
+                return
+
+            # Pattern-constrained output arrives as an escaped JSON string literal
+            unescaper = JSONStringUnescaper() if plan.ollama_string_output else None
+            async for chunk in iter_ndjson(response.aiter_bytes()):
+                if "error" in chunk:
+                    yield {"content": f"Ollama Error: {chunk['error']}", "upstream_error": True}
                     return
+                content_chunk = (chunk.get("message") or {}).get("content") or ""
+                if content_chunk and unescaper:
+                    content_chunk = unescaper.feed(content_chunk)
+                if content_chunk:
+                    yield content_chunk
+                if chunk.get("done"):
+                    residency.record(LLMBackend.ollama, base_url, model, chunk)
+                    scheduler.record_load(base_url, model, chunk)
+                    if window:
+                        yield {"context_window": window}
+                    break
+            tail = unescaper.finish() if unescaper else ""
+            if tail:
+                yield tail
+    except Exception as e:
+        yield {"content": f"Connection Error: {str(e)}", "upstream_error": True, "retryable": is_retryable_error(e)}
 
-                is_first = True
-                async for line in response.aiter_lines():
-                    if not line: continue
-                    try:
-                        chunk = json.loads(line)
-                        if "error" in chunk:
-                            yield f"Ollama Error: {chunk['error']}"
-                            break
-                        if "message" in chunk and "content" in chunk["message"]:
-                            content_chunk = chunk["message"]["content"]
-                            
-                            if is_first:
-                                if output_format not in [OutputFormat.default, OutputFormat.json]:
-                                    content_chunk = content_chunk.lstrip()
-                                    if content_chunk.startswith('"'):
-                                        content_chunk = content_chunk[1:]
-                                    if not content_chunk:
-                                        continue
-                                is_first = False
-                            
-                            if output_format not in [OutputFormat.default, OutputFormat.json]:
-                                if chunk.get("done") or (content_chunk.endswith('"') and len(content_chunk) > 0):
-                                    if content_chunk.endswith('"'):
-                                        if len(content_chunk) < 2 or content_chunk[-2] != '\\':
-                                            content_chunk = content_chunk[:-1]
-                            
-                            if content_chunk:
-                                # Safe replacement for Ollama's string escaping
-                                content_chunk = content_chunk.replace('\\"', '"').replace('\\n', '\n').replace('\\t', '\t')
-                                yield content_chunk
-                        
-                        if chunk.get("done"):
-                            break
-                    except json.JSONDecodeError:
-                        continue
-        except Exception as e:
-            yield f"Connection Error: {str(e)}"
-
-
-def _get_format_instruction(output_format: OutputFormat, format_spec: str) -> str:
-    """Generate clear format instruction for the LLM based on output format"""
-    if output_format == OutputFormat.template:
-        # Safe replacement for common escapes
-        display_template = format_spec.replace("\\n", "\n").replace("\\t", "\t")
-        return (
-            f"Your response must look exactly like this:\n```\n{display_template}\n```\n\n"
-            f"Replace the entire [GEN] tag with appropriate text content. No conversational filler."
-        )
-    elif output_format == OutputFormat.regex:
-        return f"Your response must match this exact pattern: {format_spec}\nNo conversational filler."
-    elif output_format == OutputFormat.json:
-        if format_spec:
-            try:
-                # Clean up JSON for prompt
-                schema = json.loads(format_spec)
-                return f"You must respond with valid JSON only. The output must strictly follow this JSON schema:\n```json\n{json.dumps(schema, indent=2)}\n```\n\nDo not add any explanations or extra text outside the JSON object."
-            except:
-                pass
-        return "You must respond with valid JSON only."
-    elif output_format == OutputFormat.html:
-        return "You must respond with valid XML/HTML only."
-    elif output_format == OutputFormat.csv:
-        return f"You must respond in CSV format with these columns: {format_spec}." if format_spec else "You must respond in valid CSV format."
-    return ""
-
-
-def _template_to_regex(template: str) -> str:
-    if not template: return ".*"
-    # Escaping everything but the [GEN] markers
-    # We want to match the static text literally
-    parts = template.split("[GEN]")
-    escaped_parts = []
-    for p in parts:
-        # Escape regex special chars in the static part
-        escaped = re.escape(p)
-        # re.escape is a bit too aggressive for things we want to keep literally in the pattern 
-        # (like newlines which we want as \n or \s+ for flexibility)
-        # But for Ollama/vLLM we usually need the literal match or \n
-        escaped = escaped.replace("\\\n", "\\n").replace("\\\t", "\\t").replace("\\ ", " ")
-        escaped_parts.append(escaped)
-    
-    # [GEN] becomes a match-all until the next static part
-    # Use non-greedy match if there's a following static part
-    res = ""
-    for i, p in enumerate(escaped_parts):
-        res += p
-        if i < len(escaped_parts) - 1:
-            # If the NEXT part is empty or starts with whitespace, 
-            # we might want to be careful, but generally (.*?) works
-            res += "(.*?)"
-    
-    return res
 
+async def _generate_ollama_native(
+    plan: GenerationPlan,
+    model: str,
+    messages: List[Dict[str, Any]],
+    parameters: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Single-shot /api/chat call (stream: false), post-processed like the streaming path"""
+    base_url = _ollama_base_url(parameters)
+    url = f"{base_url}/api/chat"
+    payload = plan.ollama_payload(model, messages, parameters, stream=False)
+    keep_alive = residency.keep_alive(model, parameters)
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    window = await context_windows.choose(base_url, model, messages, parameters)
+    if window:
+        payload["options"]["num_ctx"] = window["num_ctx"]
+
+    client = registry.get_http_client(LLMBackend.ollama, base_url)
+    try:
+        response = await client.post(url, json=payload, timeout=httpx.Timeout(120.0, connect=10.0))
+    except Exception as e:
+        return {"content": f"Connection Error: {str(e)}", "upstream_error": True, "retryable": is_retryable_error(e)}
+
+    if response.status_code != 200:
+        return {
+            "content": f"Ollama Error ({response.status_code}): {response.text}",
+            "upstream_error": True,
+            "retryable": response.status_code >= 500
+        }
+    try:
+        data = json_loads(response.content)
+    except ValueError:
+        return {"content": "Ollama Error: invalid response body", "upstream_error": True}
+    if "error" in data:
+        return {"content": f"Ollama Error: {data['error']}", "upstream_error": True}
+
+    residency.record(LLMBackend.ollama, base_url, model, data)
+    scheduler.record_load(base_url, model, data)
+    content = (data.get("message") or {}).get("content") or ""
+    stats: Dict[str, Any] = {k: data[k] for k in OLLAMA_STAT_FIELDS if k in data}
+    if window:
+        stats["context_window"] = window
+    return {
+        "content": unescape_string_output(content) if plan.ollama_string_output else content,
+        "stats": stats,
+    }
 
-def _csv_to_regex(format_spec: str) -> str:
-    if not format_spec: return ".*"
-    columns = [c.strip() for c in format_spec.split(",")]
-    header = ",".join([re.escape(c).replace('\\ ', ' ').replace('\\\\n', '\\n') for c in columns])
-    return f"{header}.*"
 
+async def get_available_models(backend: LLMBackend, parameters: Dict[str, Any]) -> List[str]:
+    """Model ids offered by the backend (served from the model list cache)"""
+    return (await lookup_models(backend, parameters))["models"]
 
-def _build_ollama_format(output_format: OutputFormat, format_spec: str | None) -> Any:
-    if output_format == OutputFormat.json:
-        if format_spec:
-            try:
-                # For newer Ollama versions, we can pass the JSON schema directly
-                return json.loads(format_spec)
-            except:
-                return "json"
-        return "json"
-    pattern = None
-    if output_format == OutputFormat.regex and format_spec:
-        pattern = format_spec.replace('\\ ', ' ').replace("\n", "\\n").replace("\t", "\\t")
-    elif output_format == OutputFormat.template and format_spec:
-        # Templates are tricky with Ollama, let's use the template logic but ensure it's simple
-        pattern = _template_to_regex(format_spec)
-        # For Ollama, the prefix must be absolute sometimes to trigger correctly
-    elif output_format == OutputFormat.csv:
-        pattern = _csv_to_regex(format_spec or "")
-    elif output_format == OutputFormat.html:
-        pattern = r".*<[!a-zA-Z].*"
-    
-    if pattern:
-        # Do not force ^ and $ for everything, especially if they are already there
-        # But for templates, we want the WHOLE response to match
-        if not pattern.startswith('^'): pattern = '^' + pattern
-        if not pattern.endswith('$'): pattern = pattern + '$'
-        return {"type": "string", "pattern": pattern}
-    
-    return None
 
+async def lookup_models(backend: LLMBackend, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """Cached model list of the backend along with its cache state and last error"""
+    return await model_cache.get(backend, parameters, _fetch_models)
 
-async def get_available_models(backend: LLMBackend, parameters: Dict[str, Any]) -> List[str]:
+
+async def _fetch_models(backend: LLMBackend, parameters: Dict[str, Any]) -> List[str]:
+    # A listing must fail fast: no SDK retries
+    parameters = {**parameters, "max_retries": 0}
+    pool = endpoint_router.pool_for(backend, parameters)
+    if pool is None:
+        return await _list_models(backend, parameters)
+
+    # Replicas serve the same models: the first one that answers wins
+    last_error = None
+    for replica in pool.candidates():
+        try:
+            models = await _list_models(backend, _replica_parameters(parameters, replica.url))
+        except Exception as e:
+            last_error = e
+            continue
+        if models:
+            return models
+    if last_error is not None:
+        raise last_error
+    return []
+
+
+async def _list_models(backend: LLMBackend, parameters: Dict[str, Any]) -> List[str]:
     # Default behavior: try OpenAI list approach
     if backend == LLMBackend.ollama and not parameters.get("base_url"):
         return await _get_ollama_models_native(parameters)
@@ -451,19 +496,17 @@ async def get_available_models(backend: LLMBackend, parameters: Dict[str, Any])
         if backend == LLMBackend.openai:
             return sorted([m.id for m in models.data if "gpt" in m.id.lower() or "o1" in m.id.lower()])
         return sorted([m.id for m in models.data])
-    except:
+    except Exception:
         # Fallback for Ollama if OpenAI SDK failed
         if backend == LLMBackend.ollama:
             return await _get_ollama_models_native(parameters)
-        return []
+        raise
 
 
 async def _get_ollama_models_native(parameters: Dict[str, Any]) -> List[str]:
-    base_url = (parameters.get("base_url") or "http://localhost:11434").replace("/v1", "").rstrip("/")
-    base_url = _fix_url(base_url)
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{base_url}/api/tags", timeout=5.0)
-            data = response.json()
-            return sorted([m["name"] for m in data.get("models", [])])
-        except: return []
+    base_url = _ollama_base_url(parameters)
+    client = registry.get_http_client(LLMBackend.ollama, base_url)
+    response = await client.get(f"{base_url}/api/tags", timeout=5.0)
+    response.raise_for_status()
+    data = response.json()
+    return sorted([m["name"] for m in data.get("models", [])])
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+import asyncio
+import hashlib
+import os
+import time
+
+
+# Model lists are served from memory for MODEL_CACHE_TTL seconds, then served stale
+# (and refreshed in the background) for up to MODEL_CACHE_MAX_STALE seconds
+MODEL_CACHE_TTL = float(os.getenv("MODEL_CACHE_TTL", "60"))
+MODEL_CACHE_MAX_STALE = float(os.getenv("MODEL_CACHE_MAX_STALE", "3600"))
+# Failed lookups are retried after this many seconds
+MODEL_CACHE_ERROR_TTL = float(os.getenv("MODEL_CACHE_ERROR_TTL", "10"))
+MODEL_LIST_TIMEOUT = float(os.getenv("MODEL_LIST_TIMEOUT", "5"))
+# Keys come from request parameters: keep at most this many, least recently used go first
+MODEL_CACHE_MAX_ENTRIES = int(os.getenv("MODEL_CACHE_MAX_ENTRIES", "256"))
+
+Fetcher = Callable[[Any, Dict[str, Any]], Awaitable[List[str]]]
+
+
+class _Entry:
+    def __init__(self):
+        self.models: List[str] = []
+        self.fresh_until = 0.0
+        self.stale_until = 0.0
+        self.error: Optional[str] = None
+        self.fetch_ms: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class ModelListCache:
+    """Stale-while-revalidate cache of model lists per (backend, base_url, api key)"""
+
+    def __init__(self):
+        self.entries: "OrderedDict[Tuple[str, str, str], _Entry]" = OrderedDict()
+        self.metrics = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0, "evicted": 0}
+
+    @staticmethod
+    def _key(backend: Any, parameters: Dict[str, Any]) -> Tuple[str, str, str]:
+        # Different keys may see different models; never keep the key itself around
+        api_key = parameters.get("api_key") or ""
+        return (
+            getattr(backend, "value", str(backend)),
+            parameters.get("base_url") or "",
+            hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else "",
+        )
+
+    async def get(self, backend: Any, parameters: Dict[str, Any], fetch: Fetcher) -> Dict[str, Any]:
+        """Models plus where they came from: {"models", "cached", "stale", "error", "fetch_ms"}"""
+        entry = self._entry(self._key(backend, parameters))
+        now = time.monotonic()
+        if now < entry.fresh_until:
+            self.metrics["hits"] += 1
+            return self._result(entry, cached=True, stale=False)
+        if now < entry.stale_until:
+            self.metrics["stale_hits"] += 1
+            self._refresh(entry, backend, parameters, fetch)
+            return self._result(entry, cached=True, stale=True)
+
+        self.metrics["misses"] += 1
+        await asyncio.shield(self._refresh(entry, backend, parameters, fetch))
+        return self._result(entry, cached=False, stale=False)
+
+    def _entry(self, key: Tuple[str, str, str]) -> _Entry:
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = _Entry()
+            self._evict()
+        self.entries.move_to_end(key)
+        return entry
+
+    def _evict(self) -> None:
+        # A running refresh still writes into its entry; dropping it only loses the result
+        while len(self.entries) > MODEL_CACHE_MAX_ENTRIES:
+            self.entries.popitem(last=False)
+            self.metrics["evicted"] += 1
+
+    def _refresh(self, entry: _Entry, backend: Any, parameters: Dict[str, Any], fetch: Fetcher) -> asyncio.Task:
+        # One refresh per key at a time; concurrent callers share it
+        if entry.task is None or entry.task.done():
+            entry.task = asyncio.create_task(self._fetch(entry, backend, parameters, fetch))
+        return entry.task
+
+    async def _fetch(self, entry: _Entry, backend: Any, parameters: Dict[str, Any], fetch: Fetcher) -> None:
+        self.metrics["refreshes"] += 1
+        started = time.monotonic()
+        try:
+            models = await asyncio.wait_for(fetch(backend, parameters), MODEL_LIST_TIMEOUT)
+        except Exception as e:
+            self.metrics["errors"] += 1
+            entry.error = "timeout" if isinstance(e, asyncio.TimeoutError) else (str(e) or type(e).__name__)
+            now = time.monotonic()
+            # Keep serving the last good list (if any) and try again soon
+            entry.fresh_until = now + MODEL_CACHE_ERROR_TTL
+            if not entry.models:
+                entry.stale_until = entry.fresh_until
+        else:
+            now = time.monotonic()
+            entry.models = models
+            entry.error = None
+            entry.fresh_until = now + MODEL_CACHE_TTL
+            entry.stale_until = now + MODEL_CACHE_MAX_STALE
+        finally:
+            entry.fetch_ms = round((time.monotonic() - started) * 1000, 1)
+
+    @staticmethod
+    def _result(entry: _Entry, cached: bool, stale: bool) -> Dict[str, Any]:
+        return {
+            "models": list(entry.models),
+            "cached": cached,
+            "stale": stale,
+            "error": entry.error,
+            "fetch_ms": entry.fetch_ms,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self.entries), **self.metrics}
+
+
+model_cache = ModelListCache()
@@ -0,0 +1,159 @@
+from typing import Dict, Any, List, AsyncIterator
+from app.services.serialization import loads as json_loads, FAST_JSON
+import re
+
+
+_SIMPLE_ESCAPES = {
+    '"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t",
+}
+_SPECIAL = re.compile(r'["\\]')
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+
+class NDJSONDecoder:
+    """Splits a byte stream into JSON objects, one per line, regardless of how the bytes are chunked"""
+
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        self._buffer += data
+        if b"\n" not in data:
+            return []
+        *lines, self._buffer = self._buffer.split(b"\n")
+        return [obj for obj in map(self._parse, lines) if obj is not None]
+
+    def finish(self) -> List[Dict[str, Any]]:
+        line, self._buffer = self._buffer, b""
+        obj = self._parse(line)
+        return [obj] if obj is not None else []
+
+    @staticmethod
+    def _parse(line: bytes) -> Dict[str, Any] | None:
+        if not line.strip():
+            return None
+        try:
+            obj = json_loads(line)
+        except ValueError:
+            # Garbage lines are skipped, as before
+            return None
+        return obj if isinstance(obj, dict) else None
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """Parsed objects of an NDJSON byte stream, including a final line without newline"""
+    decoder = NDJSONDecoder()
+    async for data in chunks:
+        for obj in decoder.feed(data):
+            yield obj
+    for obj in decoder.finish():
+        yield obj
+
+
+class JSONStringUnescaper:
+    """Turns the pieces of a streamed JSON string literal back into plain text.
+
+    Pattern-constrained Ollama output (format {"type": "string", ...}) arrives as the tokens of
+    a quoted, escaped string. Escape sequences, \\uXXXX escapes and the closing quote may be
+    split across chunks, so the state is carried from one feed() to the next.
+    """
+
+    START, STRING, ESCAPE, UNICODE, END, RAW = range(6)
+
+    def __init__(self):
+        self.state = self.START
+        self._hex = ""
+        self._high_surrogate: int | None = None
+
+    @property
+    def done(self) -> bool:
+        return self.state == self.END
+
+    def feed(self, text: str) -> str:
+        out: List[str] = []
+        i, n = 0, len(text)
+        while i < n:
+            state = self.state
+            if state == self.STRING:
+                match = _SPECIAL.search(text, i)
+                end = match.start() if match else n
+                if end > i:
+                    self._flush_surrogate(out)
+                    out.append(text[i:end])
+                if match is None:
+                    break
+                self.state = self.END if text[end] == '"' else self.ESCAPE
+                i = end + 1
+            elif state == self.ESCAPE:
+                char = text[i]
+                i += 1
+                if char == "u":
+                    self.state, self._hex = self.UNICODE, ""
+                    continue
+                self._flush_surrogate(out)
+                out.append(_SIMPLE_ESCAPES.get(char, "\\" + char))
+                self.state = self.STRING
+            elif state == self.UNICODE:
+                take = min(4 - len(self._hex), n - i)
+                self._hex += text[i:i + take]
+                i += take
+                if len(self._hex) == 4:
+                    self._unicode(self._hex, out)
+                    self.state = self.STRING
+            elif state == self.START:
+                stripped = text[i:].lstrip()
+                if not stripped:
+                    break
+                i = n - len(stripped)
+                if stripped[0] == '"':
+                    self.state = self.STRING
+                    i += 1
+                else:
+                    # Not a string literal after all: pass it through untouched
+                    self.state = self.RAW
+            elif state == self.RAW:
+                out.append(text[i:])
+                break
+            else:
+                # END: anything after the closing quote is not part of the value
+                break
+        return "".join(out)
+
+    def finish(self) -> str:
+        """Text still held back when the stream ends (an incomplete escape is emitted verbatim)"""
+        out: List[str] = []
+        self._flush_surrogate(out)
+        if self.state == self.ESCAPE:
+            out.append("\\")
+        elif self.state == self.UNICODE:
+            out.append("\\u" + self._hex)
+        self.state = self.END
+        return "".join(out)
+
+    def _unicode(self, digits: str, out: List[str]) -> None:
+        if not _HEX_DIGITS.issuperset(digits):
+            self._flush_surrogate(out)
+            out.append("\\u" + digits)
+            return
+        code = int(digits, 16)
+        if 0xD800 <= code <= 0xDBFF:
+            self._flush_surrogate(out)
+            self._high_surrogate = code
+        elif 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            out.append(chr(0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)))
+            self._high_surrogate = None
+        else:
+            self._flush_surrogate(out)
+            out.append(chr(code) if not 0xD800 <= code <= 0xDFFF else "\ufffd")
+
+    def _flush_surrogate(self, out: List[str]) -> None:
+        if self._high_surrogate is not None:
+            # Lone high surrogate: not representable in UTF-8
+            out.append("\ufffd")
+            self._high_surrogate = None
+
+
+def unescape_string_output(content: str) -> str:
+    """Unescape a complete (non-streamed) string-format response"""
+    unescaper = JSONStringUnescaper()
+    return unescaper.feed(content) + unescaper.finish()
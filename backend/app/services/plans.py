@@ -0,0 +1,350 @@
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass
+from app.schemas.message import OutputFormat, LLMBackend
+import hashlib
+import json
+import os
+import re
+
+
+PLAN_CACHE_SIZE = int(os.getenv("GENERATION_PLAN_CACHE_SIZE", "256"))
+# Where the format instruction goes (per-request "prompt_layout" overrides):
+# "system" puts it in front of the system prompt, "stable" appends it to the last user message
+# so the conversation prefix stays byte-identical across turns and format switches (prefix/KV cache hits)
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "system")
+
+
+def _append_instruction(message: Dict[str, Any], instruction: str) -> Dict[str, Any]:
+    content = message.get("content")
+    if isinstance(content, list):
+        # Multimodal content parts: add the instruction as a text part of its own
+        return {**message, "content": content + [{"type": "text", "text": instruction}]}
+    return {**message, "content": f"{content or ''}\n\n{instruction}"}
+
+
+@dataclass(frozen=True)
+class GenerationPlan:
+    """Everything derived from (backend, output_format, format_spec), compiled once.
+
+    Nested dicts (e.g. the parsed JSON schema) are shared between requests and must be treated as read-only.
+    """
+    backend: LLMBackend
+    output_format: OutputFormat
+    format_spec: Optional[str]
+    format_instruction: str
+    response_format: Optional[Dict[str, Any]]
+    structured_outputs: Optional[Dict[str, Any]]
+    stop: Optional[Tuple[str, ...]]
+    ollama_format: Any
+    # Regex the streamed output is checked against (regex/template formats only)
+    validation_pattern: Optional[str] = None
+    # Parsed JSON schema for incremental validation of json output
+    json_schema: Optional[Dict[str, Any]] = None
+
+    def apply_instruction(self, messages: List[Dict[str, Any]], layout: str = "system") -> List[Dict[str, Any]]:
+        """Return a copy of messages with the format instruction added according to the prompt layout"""
+        processed = list(messages)
+        if not self.format_instruction:
+            return processed
+        if layout == "stable" and processed and processed[-1].get("role") == "user":
+            # Only the newest message changes; everything before it is exactly what the backend saw last turn
+            processed[-1] = _append_instruction(processed[-1], self.format_instruction)
+            return processed
+        if processed and processed[0].get("role") == "system":
+            processed[0] = {
+                "role": "system",
+                "content": self.format_instruction + "\n\n" + processed[0]["content"]
+            }
+        else:
+            processed.insert(0, {"role": "system", "content": self.format_instruction})
+        return processed
+
+    @property
+    def ollama_string_output(self) -> bool:
+        """Ollama returns pattern-constrained output as a quoted JSON string literal"""
+        return isinstance(self.ollama_format, dict) and self.ollama_format.get("type") == "string"
+
+    def openai_request_params(self, model: str, messages: List[Dict[str, Any]], parameters: Dict[str, Any], stream: bool) -> Dict[str, Any]:
+        """Build the chat.completions.create() arguments for OpenAI-compatible backends"""
+        request_params: Dict[str, Any] = {
+            "model": model,
+            "messages": messages,
+            "temperature": float(parameters.get("temperature", 0.7)),
+            "max_tokens": int(parameters.get("max_tokens", 1024)),
+        }
+        if stream:
+            request_params["stream"] = True
+            # Ask for the usage chunk at the end so prompt cache hits can be counted
+            request_params["stream_options"] = {"include_usage": True}
+
+        for param in ["top_p", "frequency_penalty", "presence_penalty", "seed"]:
+            if param in parameters and parameters[param] is not None:
+                request_params[param] = parameters[param]
+
+        if "stop" in parameters and parameters["stop"] is not None:
+            request_params["stop"] = parameters["stop"]
+        elif self.stop:
+            request_params["stop"] = list(self.stop)
+
+        if "custom_params" in parameters and isinstance(parameters["custom_params"], dict):
+            for k, v in parameters["custom_params"].items():
+                request_params[k] = v
+
+        if self.response_format is not None:
+            request_params["response_format"] = self.response_format
+
+        if self.backend == LLMBackend.vllm:
+            if "extra_body" not in request_params: request_params["extra_body"] = {}
+            if self.structured_outputs is not None:
+                request_params["extra_body"]["structured_outputs"] = self.structured_outputs
+
+        return request_params
+
+    def ollama_payload(self, model: str, messages: List[Dict[str, Any]], parameters: Dict[str, Any], stream: bool) -> Dict[str, Any]:
+        """Build the /api/chat request body for the native Ollama API"""
+        stops: List[str] = []
+        if "stop" in parameters and parameters["stop"]:
+            stops = parameters["stop"] if isinstance(parameters["stop"], list) else [parameters["stop"]]
+        elif self.stop:
+            stops = list(self.stop)
+
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+            "options": {
+                "temperature": float(parameters.get("temperature", 0.7)),
+                "num_predict": int(parameters.get("max_tokens", 1024)),
+                "top_p": float(parameters.get("top_p", 1.0)),
+                "seed": parameters.get("seed"),
+                "stop": stops if stops else None,
+                "num_ctx": parameters.get("num_ctx", 4096),
+            }
+        }
+
+        if "custom_params" in parameters and isinstance(parameters["custom_params"], dict):
+            for k, v in parameters["custom_params"].items():
+                payload["options"][k] = v
+
+        payload["format"] = self.ollama_format
+        return payload
+
+
+_plan_cache: "OrderedDict[str, GenerationPlan]" = OrderedDict()
+_plan_stats = {"hits": 0, "misses": 0}
+
+
+def _plan_key(backend: LLMBackend, output_format: OutputFormat, format_spec: str | None) -> str:
+    raw = json.dumps([backend.value, output_format.value, format_spec])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_generation_plan(backend: LLMBackend, output_format: OutputFormat, format_spec: str | None) -> GenerationPlan:
+    """Return the compiled plan for a format spec, memoized in a bounded LRU"""
+    key = _plan_key(backend, output_format, format_spec)
+    plan = _plan_cache.get(key)
+    if plan is not None:
+        _plan_cache.move_to_end(key)
+        _plan_stats["hits"] += 1
+        return plan
+
+    _plan_stats["misses"] += 1
+    plan = compile_generation_plan(backend, output_format, format_spec)
+    _plan_cache[key] = plan
+    while len(_plan_cache) > PLAN_CACHE_SIZE:
+        _plan_cache.popitem(last=False)
+    return plan
+
+
+def plan_cache_stats() -> Dict[str, int]:
+    return {"size": len(_plan_cache), "max_size": PLAN_CACHE_SIZE, **_plan_stats}
+
+
+def compile_generation_plan(backend: LLMBackend, output_format: OutputFormat, format_spec: str | None) -> GenerationPlan:
+    """Parse the format spec once and derive every backend-specific request fragment"""
+    schema = None
+    if output_format == OutputFormat.json and format_spec:
+        try:
+            schema = json.loads(format_spec)
+        except:
+            schema = None
+
+    format_instruction = ""
+    if output_format != OutputFormat.default and format_spec:
+        format_instruction = _get_format_instruction(output_format, format_spec, schema)
+
+    response_format = None
+    if output_format == OutputFormat.json and format_spec:
+        if schema is None:
+            response_format = {"type": "json_object"}
+        # Only use strict json_schema for OpenAI
+        elif backend == LLMBackend.openai:
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": schema, "strict": True}
+            }
+        elif backend == LLMBackend.vllm:
+            # vLLM supports json_schema in a similar way
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": schema}
+            }
+        else:
+            response_format = {"type": "json_object"}
+
+    structured_outputs = None
+    if backend == LLMBackend.vllm:
+        if output_format == OutputFormat.regex and format_spec:
+            structured_outputs = {"regex": format_spec}
+        elif output_format == OutputFormat.template and format_spec:
+            structured_outputs = {"regex": _template_to_regex(format_spec)}
+        elif output_format == OutputFormat.html:
+            structured_outputs = {"regex": r"\s*<[!?a-zA-Z].*"}
+        elif output_format == OutputFormat.csv:
+            structured_outputs = {"regex": _csv_to_regex(format_spec or "")}
+
+    stop = None
+    if output_format == OutputFormat.template and format_spec:
+        if backend == LLMBackend.ollama:
+            parts = format_spec.split("[GEN]")
+            stop = tuple(p.split("\n")[0] for p in parts[1:] if p and p.split("\n")[0].strip()) or None
+        else:
+            stop = _template_stops(format_spec)
+
+    ollama_format = None
+    if backend == LLMBackend.ollama:
+        ollama_format = schema if schema is not None else _build_ollama_format(output_format, format_spec)
+
+    validation_pattern = None
+    if output_format == OutputFormat.regex and format_spec:
+        validation_pattern = format_spec
+    elif output_format == OutputFormat.template and format_spec:
+        validation_pattern = _template_to_regex(format_spec)
+
+    return GenerationPlan(
+        backend=backend,
+        output_format=output_format,
+        format_spec=format_spec,
+        format_instruction=format_instruction,
+        response_format=response_format,
+        structured_outputs=structured_outputs,
+        stop=stop,
+        ollama_format=ollama_format,
+        validation_pattern=validation_pattern,
+        json_schema=schema if isinstance(schema, dict) else None,
+    )
+
+
+def _template_stops(format_spec: str) -> Optional[Tuple[str, ...]]:
+    # Extract literals from template to use as stop sequences
+    # This is very helpful for templates to know when a GEN part ends
+    parts = format_spec.split("[GEN]")
+    stops = []
+    for p in parts[1:]:
+        if not p: continue
+        # Take the first few characters of the static text following [GEN]
+        # Ollama/vLLM like short stop sequences
+        stop_candidate = p.split("\n")[0].strip()
+        if stop_candidate:
+            stops.append(stop_candidate[:20]) # Limit length
+    if stops:
+        # If there's a final static part, that's a good stop
+        if parts[-1].strip():
+            stops.append(parts[-1].strip()[:20])
+        return tuple(sorted(set(stops)))
+    return None
+
+
+def _get_format_instruction(output_format: OutputFormat, format_spec: str, schema: Any = None) -> str:
+    """Generate clear format instruction for the LLM based on output format"""
+    if output_format == OutputFormat.template:
+        # Safe replacement for common escapes
+        display_template = format_spec.replace("\\n", "\n").replace("\\t", "\t")
+        return (
+            f"Your response must look exactly like this:\n```\n{display_template}\n```\n\n"
+            f"Replace the entire [GEN] tag with appropriate text content. No conversational filler."
+        )
+    elif output_format == OutputFormat.regex:
+        return f"Your response must match this exact pattern: {format_spec}\nNo conversational filler."
+    elif output_format == OutputFormat.json:
+        if format_spec:
+            try:
+                # Clean up JSON for prompt
+                if schema is None:
+                    schema = json.loads(format_spec)
+                return f"You must respond with valid JSON only. The output must strictly follow this JSON schema:\n```json\n{json.dumps(schema, indent=2)}\n```\n\nDo not add any explanations or extra text outside the JSON object."
+            except:
+                pass
+        return "You must respond with valid JSON only."
+    elif output_format == OutputFormat.html:
+        return "You must respond with valid XML/HTML only."
+    elif output_format == OutputFormat.csv:
+        return f"You must respond in CSV format with these columns: {format_spec}." if format_spec else "You must respond in valid CSV format."
+    return ""
+
+
+def _template_to_regex(template: str) -> str:
+    if not template: return ".*"
+    # Escaping everything but the [GEN] markers
+    # We want to match the static text literally
+    parts = template.split("[GEN]")
+    escaped_parts = []
+    for p in parts:
+        # Escape regex special chars in the static part
+        escaped = re.escape(p)
+        # re.escape is a bit too aggressive for things we want to keep literally in the pattern
+        # (like newlines which we want as \n or \s+ for flexibility)
+        # But for Ollama/vLLM we usually need the literal match or \n
+        escaped = escaped.replace("\\\n", "\\n").replace("\\\t", "\\t").replace("\\ ", " ")
+        escaped_parts.append(escaped)
+
+    # [GEN] becomes a match-all until the next static part
+    # Use non-greedy match if there's a following static part
+    res = ""
+    for i, p in enumerate(escaped_parts):
+        res += p
+        if i < len(escaped_parts) - 1:
+            # If the NEXT part is empty or starts with whitespace,
+            # we might want to be careful, but generally (.*?) works
+            res += "(.*?)"
+
+    return res
+
+
+def _csv_to_regex(format_spec: str) -> str:
+    if not format_spec: return ".*"
+    columns = [c.strip() for c in format_spec.split(",")]
+    header = ",".join([re.escape(c).replace('\\ ', ' ').replace('\\\\n', '\\n') for c in columns])
+    return f"{header}.*"
+
+
+def _build_ollama_format(output_format: OutputFormat, format_spec: str | None) -> Any:
+    if output_format == OutputFormat.json:
+        if format_spec:
+            try:
+                # For newer Ollama versions, we can pass the JSON schema directly
+                return json.loads(format_spec)
+            except:
+                return "json"
+        return "json"
+    pattern = None
+    if output_format == OutputFormat.regex and format_spec:
+        pattern = format_spec.replace('\\ ', ' ').replace("\n", "\\n").replace("\t", "\\t")
+    elif output_format == OutputFormat.template and format_spec:
+        # Templates are tricky with Ollama, let's use the template logic but ensure it's simple
+        pattern = _template_to_regex(format_spec)
+        # For Ollama, the prefix must be absolute sometimes to trigger correctly
+    elif output_format == OutputFormat.csv:
+        pattern = _csv_to_regex(format_spec or "")
+    elif output_format == OutputFormat.html:
+        pattern = r".*<[!a-zA-Z].*"
+
+    if pattern:
+        # Do not force ^ and $ for everything, especially if they are already there
+        # But for templates, we want the WHOLE response to match
+        if not pattern.startswith('^'): pattern = '^' + pattern
+        if not pattern.endswith('$'): pattern = pattern + '$'
+        return {"type": "string", "pattern": pattern}
+
+    return None
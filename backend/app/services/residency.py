@@ -0,0 +1,249 @@
+from typing import Dict, Any, List, Optional, Tuple
+from app.schemas.message import LLMBackend
+from app.services.clients import registry, fix_url
+from app.services.endpoints import split_endpoints
+from app.services.context_window import context_windows
+import asyncio
+import os
+import time
+import traceback
+
+
+# Models warmed up in the background at startup, separated by whitespace: backend:model[@base_url[,replica...]]
+# e.g. "ollama:llama3.1:8b vllm:Qwen/Qwen2.5-7B-Instruct@http://gpu1:8000/v1"
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "")
+# How long Ollama keeps a model loaded after a request ("5m", "1h", seconds, -1 = forever; empty = Ollama's default).
+# Per-request "keep_alive" overrides, then per-model OLLAMA_KEEP_ALIVE_MODELS entries ("llama3.1:8b=1h,qwen2.5=-1")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "")
+OLLAMA_KEEP_ALIVE_MODELS = os.getenv("OLLAMA_KEEP_ALIVE_MODELS", "")
+# Load the Ollama model last used in a conversation when the conversation is opened
+# (vLLM and hosted models stay loaded, a prefetch would only burn a completion)
+MODEL_PREFETCH = os.getenv("MODEL_PREFETCH", "true").lower() in ("1", "true", "yes")
+# A model used or warmed up this recently (seconds) is assumed to still be loaded and not prefetched again
+MODEL_PREFETCH_INTERVAL = float(os.getenv("MODEL_PREFETCH_INTERVAL", "60"))
+MODEL_WARMUP_TIMEOUT = float(os.getenv("MODEL_WARMUP_TIMEOUT", "300"))
+# Ollama load_duration above this counts as a cold start
+COLD_LOAD_MS = 250
+
+_DEFAULT_URLS = {
+    LLMBackend.openai: "https://api.openai.com/v1",
+    LLMBackend.ollama: "http://localhost:11434",
+    LLMBackend.vllm: "http://localhost:8000/v1",
+}
+
+
+def _parse_keep_alive(value: Any) -> Any:
+    # Ollama takes durations as strings ("10m") and plain numbers as seconds
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            return int(value)
+        except ValueError:
+            return value or None
+    return value
+
+
+def _parse_policies(raw: str) -> Dict[str, Any]:
+    policies = {}
+    for item in raw.split(","):
+        model, sep, value = item.strip().rpartition("=")
+        if sep and model:
+            policies[model] = _parse_keep_alive(value)
+    return policies
+
+
+def parse_preload(raw: str) -> List[Tuple[LLMBackend, str, Optional[str]]]:
+    """(backend, model, base_url) entries of a MODEL_PRELOAD value"""
+    entries = []
+    for item in raw.split():
+        backend, _, rest = item.partition(":")
+        model, _, base_url = rest.partition("@")
+        try:
+            entries.append((LLMBackend(backend), model, base_url or None))
+        except ValueError:
+            print(f"Ignoring MODEL_PRELOAD entry {item!r}: unknown backend")
+    return [entry for entry in entries if entry[1]]
+
+
+def _ollama_root(url: str) -> str:
+    return fix_url(url.replace("/v1", "").rstrip("/"))
+
+
+def _openai_root(url: str) -> str:
+    url = fix_url(url).rstrip("/")
+    return url if url.endswith("/v1") else url + "/v1"
+
+
+class ModelResidency:
+    """Keeps models loaded: warm-ups, startup preloads, keep_alive policies and conversation prefetch"""
+
+    def __init__(self):
+        self.policies = _parse_policies(OLLAMA_KEEP_ALIVE_MODELS)
+        # (backend, endpoint, model) -> when the model was last known to be loaded there
+        self.loaded_at: Dict[Tuple[str, str, str], float] = {}
+        self.tasks: Dict[Tuple[str, str, str], asyncio.Task] = {}
+        # (backend, model) -> load vs generation time, from Ollama's timings and our warm-ups
+        self.timings: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self.metrics = {"warmups": 0, "warmup_errors": 0, "prefetches": 0, "prefetch_skipped": 0, "preloaded": 0}
+        self.preload_task: Optional[asyncio.Task] = None
+
+    def keep_alive(self, model: str, parameters: Dict[str, Any]) -> Any:
+        """keep_alive to send with an Ollama request for this model (None: leave Ollama's default)"""
+        if parameters.get("keep_alive") is not None:
+            return _parse_keep_alive(parameters["keep_alive"])
+        if model in self.policies:
+            return self.policies[model]
+        return _parse_keep_alive(OLLAMA_KEEP_ALIVE)
+
+    def _timing(self, backend: LLMBackend, model: str) -> Dict[str, float]:
+        return self.timings.setdefault((backend.value, model), {
+            "requests": 0, "cold_starts": 0, "load_ms": 0.0, "prompt_eval_ms": 0.0, "generation_ms": 0.0,
+            "warmups": 0, "warmup_ms": 0.0,
+        })
+
+    def record(self, backend: LLMBackend, endpoint: str, model: str, stats: Dict[str, Any]) -> None:
+        """Account the timings of a finished Ollama response (durations in nanoseconds)"""
+        self.loaded_at[(backend.value, endpoint, model)] = time.monotonic()
+        timing = self._timing(backend, model)
+        load_ms = (stats.get("load_duration") or 0) / 1e6
+        timing["requests"] += 1
+        timing["load_ms"] += load_ms
+        timing["prompt_eval_ms"] += (stats.get("prompt_eval_duration") or 0) / 1e6
+        timing["generation_ms"] += (stats.get("eval_duration") or 0) / 1e6
+        if load_ms >= COLD_LOAD_MS:
+            timing["cold_starts"] += 1
+
+    async def warm(self, backend: LLMBackend, model: str, parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Load the model on every endpoint behind parameters["base_url"] and report how long it took"""
+        urls = [] if backend == LLMBackend.openai else split_endpoints(parameters.get("base_url"))
+        urls = urls or [_DEFAULT_URLS.get(backend, "")]
+        return list(await asyncio.gather(*(self._warm_shared(backend, url, model, parameters) for url in urls)))
+
+    async def _warm_shared(self, backend: LLMBackend, url: str, model: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        return await asyncio.shield(self._start(backend, url, model, parameters))
+
+    def _start(self, backend: LLMBackend, url: str, model: str, parameters: Dict[str, Any]) -> asyncio.Task:
+        # Concurrent warm-ups of the same model on the same endpoint share one request
+        key = (backend.value, self._endpoint(backend, url), model)
+        task = self.tasks.get(key)
+        if task is None or task.done():
+            task = self.tasks[key] = asyncio.create_task(self._warm_one(backend, url, model, parameters))
+        return task
+
+    @staticmethod
+    def _endpoint(backend: LLMBackend, url: str) -> str:
+        return _ollama_root(url) if backend == LLMBackend.ollama else _openai_root(url)
+
+    async def _warm_one(self, backend: LLMBackend, url: str, model: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        endpoint = self._endpoint(backend, url)
+        result: Dict[str, Any] = {"endpoint": endpoint, "model": model}
+        if backend == LLMBackend.openai:
+            # Hosted models are always loaded
+            result["status"] = "skipped"
+            return result
+
+        self.metrics["warmups"] += 1
+        started = time.monotonic()
+        try:
+            if backend == LLMBackend.ollama:
+                # An empty generate request only loads the model
+                payload: Dict[str, Any] = {"model": model}
+                keep_alive = self.keep_alive(model, parameters)
+                if keep_alive is not None:
+                    payload["keep_alive"] = keep_alive
+                # Load it with the num_ctx requests will use, or the first request reloads it
+                window = await context_windows.choose(endpoint, model, [], parameters)
+                if window:
+                    payload["options"] = {"num_ctx": window["num_ctx"]}
+                    result["num_ctx"] = window["num_ctx"]
+                response = await registry.get_http_client(backend, endpoint).post(
+                    f"{endpoint}/api/generate", json=payload, timeout=MODEL_WARMUP_TIMEOUT
+                )
+            else:
+                # One-token completion: makes the server allocate and compile everything on the request path
+                api_key = parameters.get("api_key") or "vllm-key"
+                response = await registry.get_http_client(backend, endpoint, api_key).post(
+                    f"{endpoint}/chat/completions",
+                    json={"model": model, "messages": [{"role": "user", "content": "ping"}], "max_tokens": 1},
+                    headers={"Authorization": f"Bearer {api_key}"},
+                    timeout=MODEL_WARMUP_TIMEOUT,
+                )
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            self.metrics["warmup_errors"] += 1
+            result.update(status="error", error=str(e) or type(e).__name__)
+            return result
+
+        elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+        self.loaded_at[(backend.value, endpoint, model)] = time.monotonic()
+        timing = self._timing(backend, model)
+        timing["warmups"] += 1
+        timing["warmup_ms"] += elapsed_ms
+        result.update(status="loaded", elapsed_ms=elapsed_ms)
+        if backend == LLMBackend.ollama:
+            load_ms = round((data.get("load_duration") or 0) / 1e6, 1)
+            timing["load_ms"] += load_ms
+            if load_ms >= COLD_LOAD_MS:
+                timing["cold_starts"] += 1
+            result["load_ms"] = load_ms
+        return result
+
+    async def prefetch(self, backend: LLMBackend, model: str, parameters: Dict[str, Any]) -> bool:
+        """Start loading an Ollama model in the background unless it was used or warmed up recently (returns right away)"""
+        if not MODEL_PREFETCH or backend != LLMBackend.ollama:
+            return False
+        now = time.monotonic()
+        urls = split_endpoints(parameters.get("base_url")) or [_DEFAULT_URLS.get(backend, "")]
+        # Only endpoints that have not served or loaded the model lately (and are not loading it right now)
+        cold = []
+        for url in urls:
+            key = (backend.value, self._endpoint(backend, url), model)
+            task = self.tasks.get(key)
+            if now - self.loaded_at.get(key, float("-inf")) >= MODEL_PREFETCH_INTERVAL and (task is None or task.done()):
+                cold.append(url)
+        if not cold:
+            self.metrics["prefetch_skipped"] += 1
+            return False
+        self.metrics["prefetches"] += 1
+        for url in cold:
+            self._start(backend, url, model, parameters)
+        return True
+
+    def start(self) -> None:
+        entries = parse_preload(MODEL_PRELOAD)
+        if entries and self.preload_task is None:
+            self.preload_task = asyncio.create_task(self._preload(entries))
+
+    async def stop(self) -> None:
+        tasks = [task for task in [self.preload_task, *self.tasks.values()] if task is not None and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.preload_task = None
+
+    async def _preload(self, entries: List[Tuple[LLMBackend, str, Optional[str]]]) -> None:
+        for backend, model, base_url in entries:
+            try:
+                results = await self.warm(backend, model, {"base_url": base_url} if base_url else {})
+            except Exception:
+                traceback.print_exc()
+                continue
+            self.metrics["preloaded"] += sum(1 for r in results if r["status"] == "loaded")
+            for r in results:
+                if r["status"] == "error":
+                    print(f"Preloading {backend.value}:{model} on {r['endpoint']} failed: {r['error']}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keep_alive": OLLAMA_KEEP_ALIVE or None,
+            "policies": dict(self.policies),
+            **self.metrics,
+            "models": {
+                f"{backend} {model}": {k: round(v, 1) for k, v in timing.items()}
+                for (backend, model), timing in self.timings.items()
+            },
+        }
+
+
+residency = ModelResidency()
@@ -0,0 +1,173 @@
+from typing import List, Dict, Any, Optional, Mapping
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app.database import SessionLocal
+from app.models.response_cache import ResponseCacheEntry
+import hashlib
+import json
+import os
+
+
+# Opt-in: nothing is cached unless RESPONSE_CACHE is enabled (or a request sets "cache": true)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "512"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+BYPASS_HEADER = "X-Cache-Bypass"
+
+# Request parameters that influence what the model produces
+_KEY_PARAMETERS = [
+    "base_url", "temperature", "max_tokens", "top_p", "frequency_penalty",
+    "presence_penalty", "seed", "stop", "num_ctx", "custom_params", "prompt_layout",
+]
+
+_memory: "OrderedDict[str, str]" = OrderedDict()
+cache_metrics = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "evictions": 0}
+
+
+def is_deterministic(parameters: Dict[str, Any]) -> bool:
+    """Only greedy or seeded sampling gives answers worth replaying"""
+    try:
+        temperature = float(parameters.get("temperature", 0.7))
+    except (TypeError, ValueError):
+        return False
+    return temperature == 0 or parameters.get("seed") is not None
+
+
+def bypass_requested(headers: Mapping[str, str]) -> bool:
+    """Per-request opt-out via X-Cache-Bypass or Cache-Control: no-cache"""
+    if headers.get(BYPASS_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    return "no-cache" in headers.get("Cache-Control", "").lower()
+
+
+def cache_key(
+    backend: Any,
+    model: str,
+    messages: List[Dict[str, Any]],
+    output_format: Any,
+    format_spec: str | None,
+    parameters: Dict[str, Any]
+) -> Optional[str]:
+    """Canonical hash of the request, or None if it must not be cached"""
+    enabled = parameters.get("cache", RESPONSE_CACHE_ENABLED)
+    if not enabled:
+        return None
+    if not is_deterministic(parameters):
+        cache_metrics["bypassed"] += 1
+        return None
+    return request_fingerprint(backend, model, messages, output_format, format_spec, parameters)
+
+
+def request_fingerprint(
+    backend: Any,
+    model: str,
+    messages: List[Dict[str, Any]],
+    output_format: Any,
+    format_spec: str | None,
+    parameters: Dict[str, Any]
+) -> str:
+    """sha256 over everything that determines the generated output"""
+    canonical = {
+        "backend": getattr(backend, "value", backend),
+        "model": model,
+        "messages": messages,
+        "output_format": getattr(output_format, "value", output_format),
+        "format_spec": format_spec,
+        "parameters": {k: parameters.get(k) for k in _KEY_PARAMETERS if parameters.get(k) is not None},
+    }
+    raw = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _remember(key: str, content: str) -> None:
+    _memory[key] = content
+    _memory.move_to_end(key)
+    while len(_memory) > RESPONSE_CACHE_MEMORY_ENTRIES:
+        _memory.popitem(last=False)
+
+
+def get_cached_response(key: str | None) -> Optional[str]:
+    """Look a response up in memory, then on disk (promoting disk hits to memory)"""
+    if key is None:
+        return None
+    content = _memory.get(key)
+    if content is not None:
+        _memory.move_to_end(key)
+        cache_metrics["memory_hits"] += 1
+        return content
+
+    db = SessionLocal()
+    try:
+        entry = db.query(ResponseCacheEntry).filter(ResponseCacheEntry.key == key).first()
+        if entry is None or entry.expires_at < datetime.utcnow():
+            cache_metrics["misses"] += 1
+            return None
+        entry.hits += 1
+        entry.last_used_at = datetime.utcnow()
+        db.commit()
+        content = entry.content
+    finally:
+        db.close()
+
+    cache_metrics["disk_hits"] += 1
+    _remember(key, content)
+    return content
+
+
+def store_response(key: str | None, backend: Any, model: str, content: str) -> None:
+    """Write a finished response to both tiers and enforce TTL/size limits on disk"""
+    if key is None or not content:
+        return
+    _remember(key, content)
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        entry = db.query(ResponseCacheEntry).filter(ResponseCacheEntry.key == key).first()
+        if entry is None:
+            entry = ResponseCacheEntry(key=key, backend=getattr(backend, "value", str(backend)), model=model)
+            db.add(entry)
+        entry.content = content
+        entry.size = len(content.encode("utf-8"))
+        entry.last_used_at = now
+        entry.expires_at = now + timedelta(seconds=RESPONSE_CACHE_TTL)
+        db.commit()
+        cache_metrics["stores"] += 1
+        _evict(db, now)
+    finally:
+        db.close()
+
+
+def _evict(db, now: datetime) -> None:
+    expired = db.query(ResponseCacheEntry).filter(ResponseCacheEntry.expires_at < now).delete()
+    total = db.query(func.coalesce(func.sum(ResponseCacheEntry.size), 0)).scalar() or 0
+    evicted = expired
+    if total > RESPONSE_CACHE_MAX_BYTES:
+        # Drop least recently used entries until we are back under the byte budget
+        rows = db.query(ResponseCacheEntry.key, ResponseCacheEntry.size).order_by(ResponseCacheEntry.last_used_at).all()
+        doomed = []
+        for key, size in rows:
+            if total <= RESPONSE_CACHE_MAX_BYTES:
+                break
+            doomed.append(key)
+            total -= size
+        if doomed:
+            db.query(ResponseCacheEntry).filter(ResponseCacheEntry.key.in_(doomed)).delete(synchronize_session=False)
+            for key in doomed:
+                _memory.pop(key, None)
+            evicted += len(doomed)
+    db.commit()
+    cache_metrics["evictions"] += evicted
+
+
+def response_cache_stats() -> Dict[str, Any]:
+    hits = cache_metrics["memory_hits"] + cache_metrics["disk_hits"]
+    lookups = hits + cache_metrics["misses"]
+    return {
+        "enabled": RESPONSE_CACHE_ENABLED,
+        "memory_entries": len(_memory),
+        **cache_metrics,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+    }
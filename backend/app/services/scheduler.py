@@ -0,0 +1,338 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from app.schemas.message import LLMBackend
+from app.services.clients import fix_url
+from app.services.endpoints import split_endpoints, endpoint_router, EndpointPool
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+
+
+# Max concurrent upstream generations per (backend, base_url), per healthy replica for a replica pool.
+# Server config only: the lanes are shared by all users
+MAX_INFLIGHT = {
+    LLMBackend.openai: int(os.getenv("LLM_MAX_INFLIGHT_OPENAI", "64")),
+    LLMBackend.vllm: int(os.getenv("LLM_MAX_INFLIGHT_VLLM", "32")),
+    LLMBackend.ollama: int(os.getenv("LLM_MAX_INFLIGHT_OLLAMA", "4")),
+}
+# Interactive requests beyond this many interactive waiters per endpoint are rejected with 429
+# (/batch and job waiters don't count: a large job must not lock users out)
+MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "100"))
+# Fair-share weights as "username:weight,..." (everyone else gets 1)
+USER_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (
+        entry.split(":", 1) for entry in os.getenv("LLM_USER_WEIGHTS", "").split(",") if ":" in entry
+    )
+}
+
+# Group queued Ollama requests by model and serve already-loaded models first
+OLLAMA_MODEL_AFFINITY = os.getenv("OLLAMA_MODEL_AFFINITY", "true").lower() in ("1", "true", "yes")
+# Models an Ollama endpoint can hold at once (like Ollama's own OLLAMA_MAX_LOADED_MODELS).
+# Requests for another model wait while the loaded ones are busy...
+OLLAMA_MAX_LOADED_MODELS = int(os.getenv("OLLAMA_MAX_LOADED_MODELS", "1"))
+# ...but never longer than this (ms) for the sake of affinity: the fairness window
+OLLAMA_AFFINITY_WINDOW_MS = float(os.getenv("OLLAMA_AFFINITY_WINDOW_MS", "5000"))
+# Ollama load_duration above this counts as a model swap
+SWAP_LOAD_MS = 250
+
+_DEFAULT_URLS = {
+    LLMBackend.openai: "https://api.openai.com/v1",
+    LLMBackend.vllm: "http://localhost:8000/v1",
+    LLMBackend.ollama: "http://localhost:11434",
+}
+
+
+class QueueFullError(Exception):
+    """The endpoint's wait queue is full; retry_after is a rough estimate in seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many queued requests, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def user_weight(user: Any) -> float:
+    return max(USER_WEIGHTS.get(getattr(user, "username", None), 1.0), 0.01)
+
+
+class _Lane:
+    """Slots and the weighted fair queue of one upstream endpoint.
+
+    Start-time fair queuing: each request gets a virtual finish tag of
+    max(virtual time, the user's last tag) + 1/weight and waiters are served in tag
+    order, so a user with many parallel requests only gets their share of the slots.
+
+    With model affinity (Ollama), the lane also tracks which models are loaded. A waiter
+    whose model would evict a loaded model that is still busy is held back and waiters for
+    loaded models go first, until it has waited for the fairness window.
+    """
+
+    def __init__(self, max_inflight: int, max_loaded: int = 0, pool: Optional[EndpointPool] = None):
+        # Per endpoint; a replica pool gets that many slots per healthy replica
+        self.max_inflight = max_inflight
+        self.pool = pool
+        # 0: no model affinity
+        self.max_loaded = max_loaded
+        self.inflight = 0
+        # Waiters of interactive requests, what MAX_QUEUE is checked against
+        self.interactive_waiting = 0
+        self.virtual_time = 0.0
+        self.last_finish: Dict[int, float] = {}
+        # (finish tag, sequence, start tag, future, model, enqueued at)
+        self.queue: List[Tuple[float, int, float, asyncio.Future, Optional[str], float]] = []
+        # Loaded models, least recently used first, and the in-flight requests per model
+        self.resident: "OrderedDict[str, None]" = OrderedDict()
+        self.running: Dict[str, int] = {}
+        self.endpoints: List[str] = []
+        # Wakes the lane up when the oldest held waiter reaches the fairness window
+        self.window_timer: Optional[asyncio.TimerHandle] = None
+        self.metrics = {"admitted": 0, "queued": 0, "rejected": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+        self.affinity_metrics = {"switches": 0, "promotions": 0, "held": 0, "forced": 0, "swaps": 0, "swap_ms": 0.0}
+        # EWMA of how long a slot is held, for Retry-After
+        self.service_time = 1.0
+
+    def _tags(self, user_id: int, weight: float) -> Tuple[float, float]:
+        start = max(self.virtual_time, self.last_finish.get(user_id, 0.0))
+        finish = start + 1.0 / weight
+        self.last_finish[user_id] = finish
+        return start, finish
+
+    def capacity(self) -> int:
+        if self.pool is None:
+            return self.max_inflight
+        now = time.monotonic()
+        return self.max_inflight * max(sum(1 for replica in self.pool.replicas if replica.available(now)), 1)
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.service_time * (len(self.queue) + 1) / max(self.capacity(), 1)))
+
+    async def acquire(self, user_id: int, weight: float, model: Optional[str] = None, interactive: bool = True) -> None:
+        start, finish = self._tags(user_id, weight)
+        self.metrics["admitted"] += 1
+        future = asyncio.get_running_loop().create_future()
+        entry = (finish, next(_sequence), start, future, model, time.monotonic())
+        heapq.heappush(self.queue, entry)
+        self._dispatch()
+        if future.done():
+            return
+
+        self.metrics["queued"] += 1
+        if interactive:
+            self.interactive_waiting += 1
+        began = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted just as we were cancelled: pass it on
+                self.release(model)
+            elif entry in self.queue:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                self._disarm()
+            raise
+        finally:
+            if interactive:
+                self.interactive_waiting -= 1
+        waited = (time.monotonic() - began) * 1000
+        self.metrics["total_wait_ms"] += waited
+        self.metrics["max_wait_ms"] = max(self.metrics["max_wait_ms"], waited)
+
+    def release(self, model: Optional[str] = None) -> None:
+        self.inflight -= 1
+        if self.max_loaded and model is not None:
+            self.running[model] -= 1
+            if not self.running[model]:
+                del self.running[model]
+            self._evict()
+        self._dispatch()
+        if not self.queue and self.inflight == 0:
+            # Idle: forget old tags so the map doesn't grow with every user ever seen
+            self.last_finish.clear()
+
+    def _dispatch(self) -> None:
+        capacity = self.capacity()
+        while self.queue and self.inflight < capacity:
+            entry = self._next()
+            if entry is None:
+                break
+            _, _, start, future, model, _ = entry
+            if future.done():
+                continue
+            self.virtual_time = start
+            self.inflight += 1
+            if self.max_loaded and model is not None:
+                self._load(model)
+            future.set_result(None)
+        if not self.queue:
+            self._disarm()
+
+    def _next(self) -> Optional[tuple]:
+        """Remove and return the waiter to start next (None: leave the free slots empty for now)"""
+        if not self.max_loaded:
+            return heapq.heappop(self.queue)
+        head = self.queue[0]
+        if self._startable(head[4]):
+            return heapq.heappop(self.queue)
+        # Fairness window: whoever waited too long goes next, loaded models or not
+        now = time.monotonic()
+        overdue = [entry for entry in self.queue if (now - entry[5]) * 1000 >= OLLAMA_AFFINITY_WINDOW_MS]
+        if overdue:
+            entry = min(overdue)
+            self.affinity_metrics["forced"] += 1
+        else:
+            # Otherwise the earliest waiter for a model that is loaded (or can be loaded without evicting)
+            entry = min((entry for entry in self.queue if self._startable(entry[4])), default=None)
+            if entry is None:
+                self.affinity_metrics["held"] += 1
+                self._arm()
+                return None
+            self.affinity_metrics["promotions"] += 1
+        if entry is head:
+            return heapq.heappop(self.queue)
+        self.queue.remove(entry)
+        heapq.heapify(self.queue)
+        return entry
+
+    def _arm(self) -> None:
+        # Nothing else may call _dispatch() before the window runs out (e.g. one endless stream)
+        if self.window_timer is not None:
+            return
+        oldest = min(entry[5] for entry in self.queue)
+        delay = max(oldest + OLLAMA_AFFINITY_WINDOW_MS / 1000 - time.monotonic(), 0.0)
+        self.window_timer = asyncio.get_running_loop().call_later(delay, self._window_expired)
+
+    def _window_expired(self) -> None:
+        self.window_timer = None
+        self._dispatch()
+
+    def _disarm(self) -> None:
+        if self.window_timer is not None:
+            self.window_timer.cancel()
+            self.window_timer = None
+
+    def _startable(self, model: Optional[str]) -> bool:
+        """Whether starting a request for this model now avoids evicting a model that is still in use"""
+        if model is None or model in self.resident or len(self.resident) < self.max_loaded:
+            return True
+        return any(loaded not in self.running for loaded in self.resident)
+
+    def _load(self, model: str) -> None:
+        if model in self.resident:
+            self.resident.move_to_end(model)
+        else:
+            self.affinity_metrics["switches"] += 1
+            self.resident[model] = None
+        self.running[model] = self.running.get(model, 0) + 1
+        self._evict()
+
+    def _evict(self) -> None:
+        # The endpoint unloads the least recently used idle models to make room
+        for loaded in list(self.resident):
+            if len(self.resident) <= self.max_loaded:
+                break
+            if loaded not in self.running:
+                del self.resident[loaded]
+
+    def record_load(self, model: str, load_ms: float) -> None:
+        """Account a load reported by the endpoint (it may have evicted the model behind our back)"""
+        if load_ms >= SWAP_LOAD_MS:
+            self.affinity_metrics["swaps"] += 1
+            self.affinity_metrics["swap_ms"] += load_ms
+        if model not in self.resident:
+            self.resident[model] = None
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = self.metrics["queued"]
+        stats = {
+            "inflight": self.inflight,
+            "max_inflight": self.capacity(),
+            "queue_depth": len(self.queue),
+            "interactive_waiting": self.interactive_waiting,
+            **{k: round(v, 1) if isinstance(v, float) else v for k, v in self.metrics.items()},
+            "avg_wait_ms": round(self.metrics["total_wait_ms"] / waits, 1) if waits else 0.0,
+            "avg_service_s": round(self.service_time, 3),
+        }
+        if self.max_loaded:
+            stats["affinity"] = {
+                "max_loaded_models": self.max_loaded,
+                "resident": list(self.resident),
+                **{k: round(v, 1) if isinstance(v, float) else v for k, v in self.affinity_metrics.items()},
+            }
+        return stats
+
+
+_sequence = itertools.count()
+
+
+class FairScheduler:
+    """Per-endpoint concurrency limits with weighted fair queuing across users"""
+
+    def __init__(self):
+        self.lanes: Dict[Tuple[str, str], _Lane] = {}
+
+    def _lane(self, backend: LLMBackend, parameters: Dict[str, Any]) -> _Lane:
+        base_url = parameters.get("base_url") if backend != LLMBackend.openai else None
+        base_url = (base_url or _DEFAULT_URLS.get(backend, "")).rstrip("/")
+        key = (getattr(backend, "value", str(backend)), base_url)
+        limit = MAX_INFLIGHT.get(backend, 8)
+        endpoints = []
+        max_loaded = 0
+        if backend == LLMBackend.ollama and OLLAMA_MODEL_AFFINITY:
+            endpoints = [fix_url(url.replace("/v1", "").rstrip("/")) for url in split_endpoints(base_url)]
+            # A replica pool shares one lane, so it can hold that many models per replica
+            max_loaded = max(OLLAMA_MAX_LOADED_MODELS, 1) * max(len(endpoints), 1)
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = _Lane(limit, max_loaded, endpoint_router.pool_for(backend, parameters))
+            lane.endpoints = endpoints
+        return lane
+
+    def admit(self, backend: LLMBackend, parameters: Dict[str, Any]) -> None:
+        """Reject an interactive request up front (QueueFullError) if too many are already waiting"""
+        lane = self._lane(backend, parameters)
+        if lane.interactive_waiting >= MAX_QUEUE:
+            lane.metrics["rejected"] += 1
+            raise QueueFullError(lane.retry_after())
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        backend: LLMBackend,
+        parameters: Dict[str, Any],
+        user_id: int,
+        weight: float = 1.0,
+        model: Optional[str] = None,
+        interactive: bool = True
+    ):
+        """Hold one in-flight slot of the endpoint for the duration of the block.
+
+        model is used for model affinity; background work (/batch, jobs) passes interactive=False
+        so its waiters don't count against MAX_QUEUE.
+        """
+        lane = self._lane(backend, parameters)
+        await lane.acquire(user_id, weight, model, interactive)
+        began = time.monotonic()
+        try:
+            yield
+        finally:
+            lane.service_time = 0.8 * lane.service_time + 0.2 * (time.monotonic() - began)
+            lane.release(model)
+
+    def record_load(self, endpoint: str, model: str, stats: Dict[str, Any]) -> None:
+        """Account the load_duration of an Ollama response against the lanes serving that endpoint"""
+        load_ms = (stats.get("load_duration") or 0) / 1e6
+        for lane in self.lanes.values():
+            if endpoint in lane.endpoints:
+                lane.record_load(model, load_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        return {f"{backend} {base_url}": lane.stats() for (backend, base_url), lane in self.lanes.items()}
+
+
+scheduler = FairScheduler()
@@ -0,0 +1,69 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from datetime import date, datetime
+from enum import Enum
+from fastapi.responses import JSONResponse
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# "auto" uses orjson when it is installed, "stdlib" forces the json module
+JSON_SERIALIZER = os.getenv("JSON_SERIALIZER", "auto").lower()
+
+
+def _default(value: Any) -> Any:
+    """Types json cannot encode on its own (orjson handles dates and enums natively)"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None and JSON_SERIALIZER != "stdlib":
+    FAST_JSON = True
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(value: Any) -> bytes:
+        return orjson.dumps(value, default=_default, option=_OPTIONS)
+
+    def dumps(value: Any) -> str:
+        return orjson.dumps(value, default=_default, option=_OPTIONS).decode("utf-8")
+
+    loads: Callable[[Any], Any] = orjson.loads
+else:
+    FAST_JSON = False
+
+    def dumps_bytes(value: Any) -> bytes:
+        return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def dumps(value: Any) -> str:
+        return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+    loads = json.loads
+
+
+def sse_frame(event: Dict[str, Any], event_id: Optional[str] = None) -> bytes:
+    """One server-sent event carrying a JSON payload (with an id line if given, for Last-Event-ID)"""
+    frame = b"data: " + dumps_bytes(event) + b"\n\n"
+    if event_id is not None:
+        frame = b"id: " + event_id.encode("utf-8") + b"\n" + frame
+    return frame
+
+
+def rows_to_dicts(rows: Iterable[Any], **extra: Any) -> List[Dict[str, Any]]:
+    """Plain dicts from column-projection query rows, plus constant fields the schema expects"""
+    return [{**row._asdict(), **extra} for row in rows]
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the fast serializer; the content is expected to be plain data already"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
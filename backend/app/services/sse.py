@@ -0,0 +1,139 @@
+from typing import Dict, Any, AsyncIterator, List, Optional
+import asyncio
+import os
+import time
+
+
+# Merge content deltas into one SSE frame per window (per-request "stream_flush_ms" / "stream_flush_bytes" override)
+SSE_FLUSH_INTERVAL_MS = float(os.getenv("SSE_FLUSH_INTERVAL_MS", "25"))
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "4096"))
+
+# Only pure payload events are merged; everything else (ids, errors, cache/validation notices) flushes
+_MERGEABLE_KEYS = {"content", "json_delta"}
+
+
+class _Frame:
+    """Content/json_delta events merged into one outgoing event"""
+
+    def __init__(self):
+        self.content: List[str] = []
+        self.ops: List[Dict[str, Any]] = []
+        self.size = 0
+
+    def add(self, event: Dict[str, Any]) -> None:
+        text = event.get("content")
+        if text:
+            self.content.append(text)
+            self.size += len(text)
+        if event.get("json_delta"):
+            self.ops.extend(event["json_delta"])
+
+    def event(self) -> Dict[str, Any]:
+        merged: Dict[str, Any] = {}
+        if self.content:
+            merged["content"] = "".join(self.content)
+        if self.ops:
+            merged["json_delta"] = self.ops
+        return merged
+
+
+class _Coalescer:
+    """Reads upstream events in a task and hands them out in merged batches.
+
+    The reader does the per-token work (a list append); the consumer only wakes up once
+    per window, when the size limit is hit, or when a metadata event must go out.
+    """
+
+    def __init__(self, interval: float, max_bytes: int):
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.items: List[Any] = []
+        self.open: Optional[_Frame] = None
+        self.opened_at = 0.0
+        self.urgent = False
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.wake = asyncio.Event()
+
+    async def pump(self, events: AsyncIterator[Dict[str, Any]]) -> None:
+        try:
+            async for event in events:
+                if isinstance(event, dict) and event and event.keys() <= _MERGEABLE_KEYS:
+                    if self.open is None:
+                        self.open = _Frame()
+                        self.opened_at = time.monotonic()
+                        self.items.append(self.open)
+                        self.wake.set()
+                    self.open.add(event)
+                    if self.max_bytes > 0 and self.open.size >= self.max_bytes:
+                        # Frame is full: close it, later content starts a new one
+                        self.open = None
+                        self.urgent = True
+                        self.wake.set()
+                else:
+                    self.open = None
+                    self.items.append(event)
+                    self.urgent = True
+                    self.wake.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self.wake.set()
+
+    def take(self) -> List[Dict[str, Any]]:
+        items, self.items, self.open, self.urgent = self.items, [], None, False
+        return [item.event() if isinstance(item, _Frame) else item for item in items]
+
+    async def batches(self) -> AsyncIterator[List[Dict[str, Any]]]:
+        while True:
+            self.wake.clear()
+            if self.urgent or self.finished:
+                if self.items:
+                    yield self.take()
+                if self.finished and not self.items:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                continue
+            if not self.items:
+                await self.wake.wait()
+                continue
+            # A frame is open: wait out the rest of its window unless something urgent comes in
+            remaining = self.interval - (time.monotonic() - self.opened_at) if self.interval > 0 else None
+            if remaining is None or remaining > 0:
+                try:
+                    await asyncio.wait_for(self.wake.wait(), remaining)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            yield self.take()
+
+
+async def coalesce_events(
+    events: AsyncIterator[Dict[str, Any]],
+    parameters: Dict[str, Any] | None = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Merge consecutive content/json_delta events until the time or size window is full"""
+    parameters = parameters or {}
+    interval = float(parameters.get("stream_flush_ms", SSE_FLUSH_INTERVAL_MS)) / 1000
+    max_bytes = int(parameters.get("stream_flush_bytes", SSE_FLUSH_BYTES))
+    if interval <= 0 and max_bytes <= 0:
+        async for event in events:
+            yield event
+        return
+
+    coalescer = _Coalescer(interval, max_bytes)
+    task = asyncio.create_task(coalescer.pump(events))
+    try:
+        async for batch in coalescer.batches():
+            for event in batch:
+                yield event
+    finally:
+        if not task.done():
+            # Client went away: stop reading upstream
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        aclose = getattr(events, "aclose", None)
+        if aclose is not None:
+            await aclose()
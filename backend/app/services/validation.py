@@ -0,0 +1,248 @@
+from typing import List, Dict, Any, Callable, Optional, Tuple, FrozenSet
+from functools import lru_cache
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse, sre_constants
+
+
+# Upper bound on NFA states so huge counted repeats ({1000}) can't blow up memory
+MAX_NFA_STATES = 20000
+
+CharPredicate = Callable[[str], bool]
+
+
+class _UnsupportedPattern(Exception):
+    pass
+
+
+def _any_char(ch: str) -> bool:
+    return True
+
+
+_CATEGORIES: Dict[Any, CharPredicate] = {
+    sre_constants.CATEGORY_DIGIT: lambda ch: ch.isdigit(),
+    sre_constants.CATEGORY_NOT_DIGIT: lambda ch: not ch.isdigit(),
+    sre_constants.CATEGORY_SPACE: lambda ch: ch.isspace(),
+    sre_constants.CATEGORY_NOT_SPACE: lambda ch: not ch.isspace(),
+    sre_constants.CATEGORY_WORD: lambda ch: ch.isalnum() or ch == "_",
+    sre_constants.CATEGORY_NOT_WORD: lambda ch: not (ch.isalnum() or ch == "_"),
+}
+
+
+class PrefixAutomaton:
+    """Thompson NFA compiled from a regex that answers "can this text still become a full match?".
+
+    Constructs the NFA cannot model exactly (lookarounds, backreferences, word boundaries) are
+    over-approximated so the automaton never rejects output the regex could still accept.
+    """
+
+    def __init__(self, pattern: str):
+        parsed = sre_parse.parse(pattern)
+        flags = parsed.state.flags
+        self.ignore_case = bool(flags & sre_constants.SRE_FLAG_IGNORECASE)
+        self.dot_all = bool(flags & sre_constants.SRE_FLAG_DOTALL)
+        self._eps: List[List[int]] = []
+        self._trans: List[List[Tuple[CharPredicate, int]]] = []
+        start, end = self._compile_seq(list(parsed))
+        self.accept = end
+        self.initial = self._closure({start})
+
+    def _new_state(self) -> int:
+        if len(self._eps) >= MAX_NFA_STATES:
+            raise _UnsupportedPattern("pattern too large")
+        self._eps.append([])
+        self._trans.append([])
+        return len(self._eps) - 1
+
+    def _char(self, predicate: CharPredicate) -> Tuple[int, int]:
+        s, e = self._new_state(), self._new_state()
+        self._trans[s].append((predicate, e))
+        return s, e
+
+    def _literal(self, code: int) -> CharPredicate:
+        lit = chr(code)
+        if self.ignore_case:
+            folded = lit.casefold()
+            return lambda ch: ch.casefold() == folded
+        return lambda ch: ch == lit
+
+    def _in_range(self, lo: int, hi: int) -> CharPredicate:
+        if self.ignore_case:
+            return lambda ch: any(lo <= ord(c) <= hi for c in (ch, ch.lower(), ch.upper()) if len(c) == 1)
+        return lambda ch: lo <= ord(ch) <= hi
+
+    def _charset(self, items: List[Tuple[Any, Any]]) -> CharPredicate:
+        negate = False
+        preds: List[CharPredicate] = []
+        for op, av in items:
+            if op == sre_constants.NEGATE:
+                negate = True
+            elif op == sre_constants.LITERAL:
+                preds.append(self._literal(av))
+            elif op == sre_constants.NOT_LITERAL:
+                lit = self._literal(av)
+                preds.append(lambda ch, lit=lit: not lit(ch))
+            elif op == sre_constants.RANGE:
+                preds.append(self._in_range(*av))
+            elif op == sre_constants.CATEGORY:
+                preds.append(_CATEGORIES.get(av, _any_char))
+            else:
+                preds.append(_any_char)
+        if negate:
+            return lambda ch: not any(p(ch) for p in preds)
+        return lambda ch: any(p(ch) for p in preds)
+
+    def _compile_seq(self, items: List[Tuple[Any, Any]]) -> Tuple[int, int]:
+        start = end = self._new_state()
+        for item in items:
+            s, e = self._compile_item(*item)
+            self._eps[end].append(s)
+            end = e
+        return start, end
+
+    def _compile_item(self, op: Any, av: Any) -> Tuple[int, int]:
+        C = sre_constants
+        if op == C.LITERAL:
+            return self._char(self._literal(av))
+        if op == C.NOT_LITERAL:
+            lit = self._literal(av)
+            return self._char(lambda ch: not lit(ch))
+        if op == C.ANY:
+            return self._char(_any_char if self.dot_all else (lambda ch: ch != "\n"))
+        if op == C.IN:
+            return self._char(self._charset(av))
+        if op == C.BRANCH:
+            return self._alternatives([list(alt) for alt in av[1]])
+        if op == C.SUBPATTERN:
+            return self._compile_seq(list(av[-1]))
+        if op in (C.MAX_REPEAT, C.MIN_REPEAT) or op == getattr(C, "POSSESSIVE_REPEAT", None):
+            return self._repeat(av[0], av[1], list(av[2]))
+        if op == getattr(C, "ATOMIC_GROUP", None):
+            return self._compile_seq(list(av))
+        if op == C.GROUPREF_EXISTS:
+            _, yes, no = av
+            return self._alternatives([list(yes), list(no) if no else []])
+        if op == C.GROUPREF:
+            # Backreference: anything could follow
+            s, e = self._new_state(), self._new_state()
+            self._eps[s].append(e)
+            self._trans[e].append((_any_char, e))
+            return s, e
+        # Anchors, boundaries and lookarounds only constrain, never consume: accept freely
+        s = self._new_state()
+        return s, s
+
+    def _alternatives(self, alternatives: List[List[Tuple[Any, Any]]]) -> Tuple[int, int]:
+        s, e = self._new_state(), self._new_state()
+        for alt in alternatives:
+            a_s, a_e = self._compile_seq(alt)
+            self._eps[s].append(a_s)
+            self._eps[a_e].append(e)
+        return s, e
+
+    def _repeat(self, lo: int, hi: int, items: List[Tuple[Any, Any]]) -> Tuple[int, int]:
+        start = end = self._new_state()
+        for _ in range(lo):
+            s, e = self._compile_seq(items)
+            self._eps[end].append(s)
+            end = e
+        if hi == sre_constants.MAXREPEAT:
+            s, e = self._compile_seq(items)
+            self._eps[end].append(s)
+            self._eps[e].append(s)
+            self._eps[s].append(e)
+            return start, e
+        final = self._new_state()
+        self._eps[end].append(final)
+        for _ in range(hi - lo):
+            s, e = self._compile_seq(items)
+            self._eps[end].append(s)
+            self._eps[e].append(final)
+            end = e
+        return start, final
+
+    def _closure(self, states: set) -> FrozenSet[int]:
+        stack = list(states)
+        seen = set(states)
+        while stack:
+            for t in self._eps[stack.pop()]:
+                if t not in seen:
+                    seen.add(t)
+                    stack.append(t)
+        return frozenset(seen)
+
+    def step(self, states: FrozenSet[int], ch: str) -> FrozenSet[int]:
+        nxt = set()
+        for s in states:
+            for pred, t in self._trans[s]:
+                if pred(ch):
+                    nxt.add(t)
+        return self._closure(nxt) if nxt else frozenset()
+
+
+@lru_cache(maxsize=128)
+def compile_prefix_automaton(pattern: str) -> Optional[PrefixAutomaton]:
+    """Compile (and cache) the automaton for a pattern; None if it cannot be parsed"""
+    try:
+        return PrefixAutomaton(pattern)
+    except (_UnsupportedPattern, sre_constants.error, RecursionError, OverflowError):
+        return None
+
+
+class PrefixValidator:
+    """Incrementally checks streamed output against a regex and reports the first impossible position"""
+
+    def __init__(self, automaton: PrefixAutomaton):
+        self.automaton = automaton
+        self.states = automaton.initial
+        self.offset = 0
+        self.received = ""
+        # Leading whitespace is tolerated because the non-vLLM backends often emit it
+        self._leading = True
+        # ...and so is trailing whitespace after a complete match (e.g. a final newline)
+        self._trailing = False
+
+    @property
+    def failed(self) -> bool:
+        return not self.states and not self._trailing
+
+    @property
+    def complete(self) -> bool:
+        return self.automaton.accept in self.states or self._trailing
+
+    def feed(self, text: str) -> bool:
+        """Advance over a chunk; returns False once the output can no longer match"""
+        for ch in text:
+            if self.failed:
+                return False
+            nxt = self.automaton.step(self.states, ch)
+            if self._leading:
+                if ch.isspace():
+                    nxt = nxt | self.automaton.initial
+                else:
+                    self._leading = False
+            # Whitespace may also continue the match ("A B"); only a non-space character ends the tail
+            self._trailing = ch.isspace() and (self._trailing or self.automaton.accept in self.states)
+            self.states = nxt
+            self.offset += 1
+            self.received = (self.received + ch)[-80:]
+        return not self.failed
+
+    def failure_event(self, pattern: str) -> Dict[str, Any]:
+        return {
+            "validation_failed": {
+                "pattern": pattern,
+                "offset": self.offset - 1,
+                "received": self.received,
+                "reason": "Output can no longer match the requested format",
+            }
+        }
+
+
+def create_prefix_validator(pattern: str | None) -> Optional[PrefixValidator]:
+    if not pattern:
+        return None
+    automaton = compile_prefix_automaton(pattern)
+    return PrefixValidator(automaton) if automaton else None
@@ -0,0 +1,57 @@
+"""Micro-benchmark: decoding a streamed Ollama /api/chat response.
+
+Compares the old per-line json.loads + str.replace handling with the incremental
+NDJSON decoder and JSON string unescaper. Run from the backend directory:
+
+    python -m benchmarks.ollama_stream_bench
+"""
+import json
+import timeit
+from app.services.ollama_stream import NDJSONDecoder, JSONStringUnescaper, FAST_JSON
+
+TOKENS = 2000
+NETWORK_CHUNK = 512
+
+
+def _build_stream() -> bytes:
+    text = json.dumps("Name: \"John\"\nAge: 42\t(ok)\n" * (TOKENS // 8))
+    lines = [
+        json.dumps({"model": "llama3", "message": {"role": "assistant", "content": text[i:i + 4]}, "done": False})
+        for i in range(0, len(text), 4)
+    ]
+    lines.append(json.dumps({"model": "llama3", "message": {"role": "assistant", "content": ""}, "done": True}))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def legacy(stream: bytes) -> str:
+    out = []
+    for line in stream.decode("utf-8").split("\n"):
+        if not line:
+            continue
+        chunk = json.loads(line)
+        content = chunk["message"]["content"]
+        if content:
+            out.append(content.replace('\\"', '"').replace('\\n', '\n').replace('\\t', '\t'))
+    return "".join(out).strip('"')
+
+
+def incremental(stream: bytes) -> str:
+    decoder = NDJSONDecoder()
+    unescaper = JSONStringUnescaper()
+    out = []
+    for i in range(0, len(stream), NETWORK_CHUNK):
+        for chunk in decoder.feed(stream[i:i + NETWORK_CHUNK]):
+            out.append(unescaper.feed(chunk["message"]["content"]))
+    out.append(unescaper.finish())
+    return "".join(out)
+
+
+if __name__ == "__main__":
+    stream = _build_stream()
+    expected = json.loads(json.dumps("Name: \"John\"\nAge: 42\t(ok)\n" * (TOKENS // 8)))
+    print(f"fast JSON backend: {FAST_JSON}, {len(stream)} bytes")
+    print(f"legacy output correct:      {legacy(stream) == expected}")
+    print(f"incremental output correct: {incremental(stream) == expected}")
+    for name, fn in [("legacy", legacy), ("incremental", incremental)]:
+        best = min(timeit.repeat(lambda: fn(stream), number=20, repeat=5)) / 20
+        print(f"{name:12s} {best * 1000:8.2f} ms per stream")
@@ -0,0 +1,160 @@
+"""Benchmark: how much of each prompt a backend prefix cache can reuse, per prompt layout.
+
+Plays a scripted conversation that switches output formats between turns through
+generate_llm_response against a local mock of an OpenAI-compatible server, once with
+PROMPT_LAYOUT "system" and once with "stable". The mock renders every request with a
+chat template and measures (in characters) how much of it was seen before:
+
+- previous-request prefix: longest common prefix with the request before it
+  (a single-slot context reuse like Ollama's)
+- block cache: leading blocks found in a hash-chained block cache (like vLLM's
+  automatic prefix caching); also reported back as usage.cached_tokens, so the
+  app's own prompt_cache metrics show the same ratio
+
+Run from the backend directory:
+
+    python -m benchmarks.prefix_stability_bench
+"""
+import asyncio
+import hashlib
+import json
+import socket
+import time
+from typing import Any, Dict, List
+import uvicorn
+from fastapi import FastAPI, Request
+from app.schemas.message import LLMBackend, OutputFormat
+from app.services.llm import generate_llm_response
+from app.services.clients import registry
+from app.services.endpoints import prompt_cache_stats
+
+BLOCK_SIZE = 64
+SYSTEM_PROMPT = "You are a careful assistant that extracts structured data from customer emails. " * 4
+SCHEMA = json.dumps({
+    "type": "object",
+    "properties": {"name": {"type": "string"}, "order_id": {"type": "string"}, "urgent": {"type": "boolean"}},
+    "required": ["name", "order_id", "urgent"],
+})
+# Output format per turn: the format switches are what moves the instruction around
+SCRIPT = [
+    (OutputFormat.default, None),
+    (OutputFormat.json, SCHEMA),
+    (OutputFormat.json, SCHEMA),
+    (OutputFormat.csv, "name,order_id,urgent"),
+    (OutputFormat.default, None),
+    (OutputFormat.regex, r"Order \d+: (yes|no)"),
+    (OutputFormat.json, SCHEMA),
+    (OutputFormat.template, "Name: [GEN]\nOrder: [GEN]"),
+    (OutputFormat.default, None),
+    (OutputFormat.csv, "name,order_id,urgent"),
+    (OutputFormat.json, SCHEMA),
+    (OutputFormat.default, None),
+]
+
+
+class PrefixCacheMock:
+    """Renders prompts like a chat template and tracks what a prefix cache could reuse"""
+
+    def __init__(self):
+        self.previous = ""
+        self.blocks: set = set()
+        self.turns: List[Dict[str, int]] = []
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.chat)
+
+    @staticmethod
+    def render(messages: List[Dict[str, Any]]) -> str:
+        return "".join(f"<|{m['role']}|>\n{m['content']}<|end|>\n" for m in messages) + "<|assistant|>\n"
+
+    def _block_hits(self, prompt: str) -> int:
+        parent, hits, matching = "", 0, True
+        for start in range(0, len(prompt) - BLOCK_SIZE + 1, BLOCK_SIZE):
+            parent = hashlib.sha256((parent + prompt[start:start + BLOCK_SIZE]).encode("utf-8")).hexdigest()
+            if matching and parent in self.blocks:
+                hits += BLOCK_SIZE
+            else:
+                matching = False
+            self.blocks.add(parent)
+        return hits
+
+    async def chat(self, request: Request) -> Dict[str, Any]:
+        body = await request.json()
+        prompt = self.render(body["messages"])
+        common = 0
+        for a, b in zip(prompt, self.previous):
+            if a != b:
+                break
+            common += 1
+        cached = self._block_hits(prompt)
+        self.previous = prompt
+        self.turns.append({"prompt": len(prompt), "common": common, "cached": cached})
+        return {
+            "id": f"cmpl-{len(self.turns)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": f"Answer {len(self.turns)}"}}],
+            "usage": {
+                "prompt_tokens": len(prompt),
+                "completion_tokens": 2,
+                "total_tokens": len(prompt) + 2,
+                "prompt_tokens_details": {"cached_tokens": cached},
+            },
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _run(layout: str) -> Dict[str, float]:
+    mock = PrefixCacheMock()
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(mock.app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    base_url = f"http://127.0.0.1:{port}/v1"
+    history: List[Dict[str, str]] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    try:
+        for turn, (output_format, format_spec) in enumerate(SCRIPT):
+            history.append({"role": "user", "content": f"Email {turn}: Hi, I am customer {turn} and order {1000 + turn} is late."})
+            result = await generate_llm_response(
+                LLMBackend.vllm, "mock", history, output_format, format_spec,
+                {"base_url": base_url, "prompt_layout": layout, "cache": False, "temperature": 0},
+            )
+            history.append({"role": "assistant", "content": result["content"]})
+    finally:
+        server.should_exit = True
+        await task
+
+    # The first turn has nothing to share with
+    turns = mock.turns[1:]
+    prompt = sum(t["prompt"] for t in turns)
+    usage = prompt_cache_stats().get(base_url, {})
+    return {
+        "prompt_chars": prompt,
+        "previous_prefix": sum(t["common"] for t in turns) / prompt,
+        "block_cache": sum(t["cached"] for t in turns) / prompt,
+        "reported_cached_ratio": usage.get("cached_ratio", 0.0),
+    }
+
+
+async def main():
+    print(f"{len(SCRIPT)} turns, {sum(1 for a, b in zip(SCRIPT, SCRIPT[1:]) if a != b)} format switches")
+    for layout in ("system", "stable"):
+        result = await _run(layout)
+        print(
+            f"layout={layout:6s} prompt_chars={result['prompt_chars']:6d} "
+            f"previous-request prefix={result['previous_prefix']:6.1%} "
+            f"block cache={result['block_cache']:6.1%} "
+            f"(app metrics cached_ratio={result['reported_cached_ratio']:.1%})"
+        )
+    await registry.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -21,7 +21,8 @@ from app.database import Base
 # Import models to ensure they are registered with Base.metadata
 from app.models import (
     User, Conversation, Message, JSONSchema, 
-    RegexPattern, Template, BackendSetting, CSVPreset
+    RegexPattern, Template, BackendSetting, CSVPreset,
+    ResponseCacheEntry, Job, JobItem
 )
 target_metadata = Base.metadata
 
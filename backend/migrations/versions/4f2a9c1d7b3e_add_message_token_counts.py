@@ -0,0 +1,47 @@
+"""Add cached token counts to messages
+
+Revision ID: 4f2a9c1d7b3e
+Revises: 63a59ea8b557
+Create Date: 2026-10-17 09:12:44.508113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f2a9c1d7b3e'
+down_revision: Union[str, None] = '63a59ea8b557'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _message_columns() -> set:
+    inspector = sa.inspect(op.get_bind())
+    if "messages" not in inspector.get_table_names():
+        return set()
+    return {column["name"] for column in inspector.get_columns("messages")}
+
+
+def upgrade() -> None:
+    columns = _message_columns()
+    # Fresh databases get the columns from create_all when the app starts
+    if not columns:
+        return
+    if "token_count" not in columns:
+        op.add_column("messages", sa.Column("token_count", sa.Integer(), nullable=True))
+    if "token_counter" not in columns:
+        op.add_column("messages", sa.Column("token_counter", sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    columns = _message_columns()
+    if not columns & {"token_count", "token_counter"}:
+        return
+    with op.batch_alter_table("messages") as batch_op:
+        if "token_counter" in columns:
+            batch_op.drop_column("token_counter")
+        if "token_count" in columns:
+            batch_op.drop_column("token_count")
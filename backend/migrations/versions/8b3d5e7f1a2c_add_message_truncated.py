@@ -0,0 +1,39 @@
+"""Mark messages whose generation was stopped early
+
+Revision ID: 8b3d5e7f1a2c
+Revises: 4f2a9c1d7b3e
+Create Date: 2026-10-17 14:03:21.771406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b3d5e7f1a2c'
+down_revision: Union[str, None] = '4f2a9c1d7b3e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _message_columns() -> set:
+    inspector = sa.inspect(op.get_bind())
+    if "messages" not in inspector.get_table_names():
+        return set()
+    return {column["name"] for column in inspector.get_columns("messages")}
+
+
+def upgrade() -> None:
+    columns = _message_columns()
+    # Fresh databases get the column from create_all when the app starts
+    if columns and "truncated" not in columns:
+        op.add_column("messages", sa.Column("truncated", sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    if "truncated" not in _message_columns():
+        return
+    with op.batch_alter_table("messages") as batch_op:
+        batch_op.drop_column("truncated")
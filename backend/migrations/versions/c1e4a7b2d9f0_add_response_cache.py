@@ -0,0 +1,52 @@
+"""Add the persistent response cache
+
+Revision ID: c1e4a7b2d9f0
+Revises: 8b3d5e7f1a2c
+Create Date: 2026-10-17 16:20:05.184327
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c1e4a7b2d9f0'
+down_revision: Union[str, None] = '8b3d5e7f1a2c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _tables() -> set:
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade() -> None:
+    tables = _tables()
+    # Fresh databases get the table from create_all when the app starts
+    if "users" not in tables or "response_cache" in tables:
+        return
+    op.create_table(
+        "response_cache",
+        sa.Column("key", sa.String(length=64), nullable=False),
+        sa.Column("backend", sa.String(), nullable=False),
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("content", sa.Text(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("hits", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("last_used_at", sa.DateTime(), nullable=True),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index("ix_response_cache_last_used_at", "response_cache", ["last_used_at"])
+    op.create_index("ix_response_cache_expires_at", "response_cache", ["expires_at"])
+
+
+def downgrade() -> None:
+    if "response_cache" not in _tables():
+        return
+    op.drop_index("ix_response_cache_expires_at", table_name="response_cache")
+    op.drop_index("ix_response_cache_last_used_at", table_name="response_cache")
+    op.drop_table("response_cache")
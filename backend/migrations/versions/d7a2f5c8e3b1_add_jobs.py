@@ -0,0 +1,86 @@
+"""Add offline jobs and their items
+
+Revision ID: d7a2f5c8e3b1
+Revises: c1e4a7b2d9f0
+Create Date: 2026-10-17 16:24:48.902513
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a2f5c8e3b1'
+down_revision: Union[str, None] = 'c1e4a7b2d9f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+JOB_STATUSES = ("pending", "running", "completed", "cancelled")
+JOB_ITEM_STATUSES = ("pending", "running", "done", "failed")
+# Types that already exist for the messages table (only PostgreSQL has named enum types)
+LLM_BACKENDS = postgresql.ENUM("openai", "vllm", "ollama", name="llmbackend", create_type=False)
+OUTPUT_FORMATS = postgresql.ENUM("default", "json", "template", "regex", "html", "csv", name="outputformat", create_type=False)
+
+
+def _tables() -> set:
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade() -> None:
+    tables = _tables()
+    # Fresh databases get the tables from create_all when the app starts
+    if "users" not in tables or "jobs" in tables:
+        return
+    op.create_table(
+        "jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("status", sa.Enum(*JOB_STATUSES, name="jobstatus"), nullable=False),
+        sa.Column("backend", LLM_BACKENDS, nullable=False),
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("output_format", OUTPUT_FORMATS, nullable=False),
+        sa.Column("format_spec", sa.Text(), nullable=True),
+        sa.Column("llm_parameters", sa.JSON(), nullable=True),
+        sa.Column("total_items", sa.Integer(), nullable=False),
+        sa.Column("completed_items", sa.Integer(), nullable=False),
+        sa.Column("failed_items", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_jobs_id", "jobs", ["id"])
+    op.create_table(
+        "job_items",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("job_id", sa.Integer(), nullable=False),
+        sa.Column("index", sa.Integer(), nullable=False),
+        sa.Column("prompt", sa.Text(), nullable=False),
+        sa.Column("status", sa.Enum(*JOB_ITEM_STATUSES, name="jobitemstatus"), nullable=False),
+        sa.Column("result", sa.Text(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["job_id"], ["jobs.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_job_items_id", "job_items", ["id"])
+    op.create_index("ix_job_items_job_status", "job_items", ["job_id", "status"])
+    op.create_index("ix_job_items_job_index", "job_items", ["job_id", "index"])
+
+
+def downgrade() -> None:
+    tables = _tables()
+    if "job_items" in tables:
+        op.drop_table("job_items")
+    if "jobs" in tables:
+        op.drop_table("jobs")
+    if op.get_bind().dialect.name == "postgresql":
+        sa.Enum(name="jobitemstatus").drop(op.get_bind(), checkfirst=True)
+        sa.Enum(name="jobstatus").drop(op.get_bind(), checkfirst=True)
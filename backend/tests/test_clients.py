@@ -0,0 +1,96 @@
+"""Upstream client registry: bounded size, and clients are only closed once their responses are.
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.services import clients
+from app.services.clients import ClientRegistry
+
+
+@pytest.fixture(autouse=True)
+def small_registry(monkeypatch):
+    monkeypatch.setattr(clients, "LLM_CLIENT_MAX", 2)
+
+
+def _client(registry: ClientRegistry, url: str) -> httpx.AsyncClient:
+    client = registry.get_http_client("vllm", url)
+    # Answer locally instead of over the network
+    transport = registry._transports[registry._key("vllm", url, None)]
+    transport._transport = httpx.MockTransport(lambda request: httpx.Response(200, text="ok" * 100))
+    return client
+
+
+def test_least_recently_used_clients_are_evicted_and_closed():
+    async def scenario():
+        registry = ClientRegistry()
+        first = _client(registry, "http://a")
+        _client(registry, "http://b")
+        # Using a again makes b the least recently used one
+        assert registry.get_http_client("vllm", "http://a") is first
+        _client(registry, "http://c")
+
+        stats = registry.stats()
+        assert [c["base_url"] for c in stats["clients"]] == ["http://a", "http://c"]
+        assert stats["evicted"] == 1
+        await asyncio.gather(*registry._closing)
+        assert not first.is_closed
+        await registry.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_client_with_open_response_is_kept_until_it_is_closed():
+    async def scenario():
+        registry = ClientRegistry()
+        busy = _client(registry, "http://a")
+        async with busy.stream("GET", "http://a/") as response:
+            _client(registry, "http://b")
+            _client(registry, "http://c")
+            # a is the oldest but still streaming: b goes instead
+            assert [c["base_url"] for c in registry.stats()["clients"]] == ["http://a", "http://c"]
+            assert registry.stats()["clients"][0]["active"] == 1
+            body = await response.aread()
+        assert body == b"ok" * 100
+        assert registry.stats()["clients"][0]["active"] == 0
+        assert registry.stats()["clients"][0]["requests"] == 1
+        await registry.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_evicted_client_closes_after_its_response():
+    async def scenario():
+        registry = ClientRegistry()
+        old = _client(registry, "http://a")
+        response = await old.send(old.build_request("GET", "http://a/"), stream=True)
+        registry._retire(registry._key("vllm", "http://a", None))
+        closing = next(iter(registry._closing))
+        await asyncio.sleep(1.2)
+        assert not closing.done() and not old.is_closed
+
+        await response.aclose()
+        await asyncio.wait_for(closing, 3)
+        assert old.is_closed
+        await registry.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_idle_clients_are_evicted(monkeypatch):
+    monkeypatch.setattr(clients, "LLM_CLIENT_MAX", 10)
+    monkeypatch.setattr(clients, "LLM_CLIENT_IDLE_TTL", 0)
+
+    async def scenario():
+        registry = ClientRegistry()
+        _client(registry, "http://a")
+        _client(registry, "http://b")
+        assert [c["base_url"] for c in registry.stats()["clients"]] == ["http://b"]
+        await registry.aclose()
+
+    asyncio.run(scenario())
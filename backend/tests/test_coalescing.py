@@ -0,0 +1,136 @@
+"""Single-flight coalescing of identical streams: sharing, bounded history, flight registry.
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from app.services import coalescing
+from app.services.coalescing import coalesced_stream
+
+
+def _source(count: int, calls: list, pause: float = 0.0):
+    async def factory():
+        calls.append(1)
+        for i in range(count):
+            if pause:
+                await asyncio.sleep(pause)
+            else:
+                await asyncio.sleep(0)
+            yield {"content": str(i)}
+    return factory
+
+
+async def _collect(key, factory, delay: float = 0.0):
+    events = []
+    async for event in coalesced_stream(key, factory):
+        events.append(event["content"])
+        if delay:
+            await asyncio.sleep(delay)
+    return events
+
+
+@pytest.fixture(autouse=True)
+def no_flights():
+    coalescing._flights.clear()
+    yield
+    coalescing._flights.clear()
+
+
+def test_identical_requests_share_one_upstream():
+    async def scenario():
+        calls = []
+        factory = _source(20, calls)
+        first, second = await asyncio.gather(_collect("k", factory), _collect("k", factory))
+        assert first == second == [str(i) for i in range(20)]
+        assert len(calls) == 1
+        assert not coalescing._flights
+
+    asyncio.run(scenario())
+
+
+def test_history_is_bounded_by_slowest_subscriber(monkeypatch):
+    monkeypatch.setattr(coalescing, "COALESCE_MAX_EVENTS", 8)
+
+    async def scenario():
+        calls = []
+        factory = _source(100, calls)
+        peak = 0
+
+        async def watch():
+            nonlocal peak
+            while True:
+                for flight in list(coalescing._flights.values()) + watched:
+                    peak = max(peak, len(flight.events))
+                await asyncio.sleep(0)
+
+        watched = []
+        fast = asyncio.create_task(_collect("k", factory))
+        await asyncio.sleep(0)
+        watched.append(coalescing._flights["k"])
+        slow = asyncio.create_task(_collect("k", factory, delay=0.001))
+        watcher = asyncio.create_task(watch())
+        fast_events, slow_events = await asyncio.gather(fast, slow)
+        watcher.cancel()
+
+        expected = [str(i) for i in range(100)]
+        assert fast_events == slow_events == expected
+        assert len(calls) == 1
+        assert peak <= 8
+        assert coalescing.coalescing_metrics["stalls"] > 0
+
+    asyncio.run(scenario())
+
+
+def test_trimmed_flight_takes_no_new_subscribers(monkeypatch):
+    monkeypatch.setattr(coalescing, "COALESCE_MAX_EVENTS", 4)
+
+    async def scenario():
+        calls = []
+        factory = _source(50, calls, pause=0.001)
+        first = asyncio.create_task(_collect("k", factory))
+        await asyncio.sleep(0)
+        assert "k" in coalescing._flights
+        # Wait until the flight had to drop read events
+        while coalescing._flights.get("k") is not None:
+            await asyncio.sleep(0.001)
+        # A request now can't get the full prefix replayed: it starts its own flight
+        second = await _collect("k", factory)
+        assert second == [str(i) for i in range(50)]
+        assert await first == [str(i) for i in range(50)]
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_finished_flight_does_not_unregister_newer_one():
+    async def scenario():
+        old = coalescing._Flight("k")
+        new = coalescing._Flight("k")
+        coalescing._flights["k"] = new
+
+        async def empty():
+            return
+            yield
+
+        await old.run(empty)
+        assert coalescing._flights.get("k") is new
+
+    asyncio.run(scenario())
+
+
+def test_last_subscriber_leaving_cancels_upstream():
+    async def scenario():
+        calls = []
+        stream = coalesced_stream("k", _source(1000, calls, pause=0.001))
+        assert (await stream.__anext__())["content"] == "0"
+        flight = coalescing._flights["k"]
+        await stream.aclose()
+        await asyncio.gather(flight.task, return_exceptions=True)
+        assert flight.done
+        assert "k" not in coalescing._flights
+
+    asyncio.run(scenario())
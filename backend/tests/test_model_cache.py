@@ -0,0 +1,32 @@
+"""Model list cache: bounded by least recent use.
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import asyncio
+
+from app.services import model_cache as model_cache_module
+from app.services.model_cache import ModelListCache
+
+
+async def _fetch(backend, parameters):
+    return [parameters["base_url"]]
+
+
+def test_least_recently_used_entries_are_evicted(monkeypatch):
+    monkeypatch.setattr(model_cache_module, "MODEL_CACHE_MAX_ENTRIES", 2)
+
+    async def scenario():
+        cache = ModelListCache()
+        await cache.get("vllm", {"base_url": "http://a"}, _fetch)
+        await cache.get("vllm", {"base_url": "http://b"}, _fetch)
+        # A hit on a makes b the least recently used one
+        assert (await cache.get("vllm", {"base_url": "http://a"}, _fetch))["cached"]
+        await cache.get("vllm", {"base_url": "http://c"}, _fetch)
+
+        assert [key[1] for key in cache.entries] == ["http://a", "http://c"]
+        assert cache.stats()["entries"] == 2
+        assert cache.stats()["evicted"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,136 @@
+"""Property tests for the Ollama stream decoders: the output must not depend on how the stream is chunked.
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import asyncio
+import itertools
+import json
+
+import pytest
+
+from app.services.ollama_stream import JSONStringUnescaper, NDJSONDecoder, iter_ndjson, unescape_string_output
+
+
+# String literals as Ollama streams them for format {"type": "string", ...}
+LITERALS = [
+    '"plain text"',
+    '"quote \\" and backslash \\\\ and slash \\/"',
+    '"controls \\b\\f\\n\\r\\t end"',
+    '"\\u00e9t\\u00E9 \\u20ac"',
+    '"pair \\ud83d\\ude00 and another \\uD83C\\uDF89!"',
+    '"two pairs back to back \\ud83d\\ude00\\ud83d\\ude01"',
+    '"literal non-BMP \U0001F600 and umlauts äöü"',
+    '"\\\\u0041 is not an escape"',
+    '  "leading whitespace"',
+    '""',
+]
+
+
+def _splits(text: str, pieces: int):
+    """text cut at every combination of pieces - 1 boundaries"""
+    for cuts in itertools.combinations(range(1, len(text)), pieces - 1):
+        bounds = (0, *cuts, len(text))
+        yield [text[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+def _unescape(chunks) -> str:
+    unescaper = JSONStringUnescaper()
+    return "".join(unescaper.feed(chunk) for chunk in chunks) + unescaper.finish()
+
+
+@pytest.mark.parametrize("literal", LITERALS)
+def test_unescaper_matches_json_at_every_split(literal):
+    expected = json.loads(literal)
+    assert unescape_string_output(literal) == expected
+    for pieces in (1, 2, 3):
+        for chunks in _splits(literal, pieces):
+            assert _unescape(chunks) == expected, chunks
+
+
+@pytest.mark.parametrize("literal", LITERALS)
+def test_unescaper_char_by_char(literal):
+    assert _unescape(list(literal)) == json.loads(literal)
+
+
+@pytest.mark.parametrize("text, expected", [
+    # A lone surrogate can't be encoded: replaced, whether or not something follows it
+    ('"a\\ud83d"', "a\ufffd"),
+    ('"a\\ud83db"', "a\ufffdb"),
+    ('"a\\ude00b"', "a\ufffdb"),
+    ('"\\ud83d\\u0041"', "\ufffdA"),
+    # Invalid \u escapes are passed through verbatim
+    ('"x\\uZZZZy"', "x\\uZZZZy"),
+    # Nothing after the closing quote belongs to the value
+    ('"done" trailing', "done"),
+    # Not a string literal: passed through untouched
+    ('{"a": 1}', '{"a": 1}'),
+    # Stream cut off inside an escape: what is left is emitted verbatim
+    ('"cut \\', "cut \\"),
+    ('"cut \\u00', "cut \\u00"),
+])
+def test_unescaper_edge_cases_at_every_split(text, expected):
+    for pieces in (1, 2, 3):
+        for chunks in _splits(text, pieces):
+            assert _unescape(chunks) == expected, chunks
+
+
+def test_unescaper_done_after_closing_quote():
+    unescaper = JSONStringUnescaper()
+    assert unescaper.feed('"ab') == "ab"
+    assert not unescaper.done
+    assert unescaper.feed('c"') == "c"
+    assert unescaper.done
+
+
+OBJECTS = [
+    {"model": "m", "message": {"role": "assistant", "content": "café \U0001F600"}, "done": False},
+    {"model": "m", "message": {"role": "assistant", "content": "line\nbreak \"quoted\""}, "done": False},
+    {"model": "m", "done": True, "eval_count": 3},
+]
+
+
+def _ndjson(final_newline: bool = True) -> bytes:
+    body = b"\n".join(json.dumps(obj, ensure_ascii=False).encode("utf-8") for obj in OBJECTS)
+    return body + b"\n" if final_newline else body
+
+
+def _decode(chunks) -> list:
+    decoder = NDJSONDecoder()
+    objects = []
+    for chunk in chunks:
+        objects.extend(decoder.feed(chunk))
+    return objects + decoder.finish()
+
+
+@pytest.mark.parametrize("final_newline", [True, False])
+def test_ndjson_decoder_at_every_byte_split(final_newline):
+    # Byte boundaries include the middle of multi-byte UTF-8 sequences
+    data = _ndjson(final_newline)
+    for pieces in (1, 2):
+        for chunks in _splits(data, pieces):
+            assert _decode(chunks) == OBJECTS, chunks
+    assert _decode(data[i:i + 1] for i in range(len(data))) == OBJECTS
+
+
+def test_ndjson_decoder_skips_blank_and_garbage_lines():
+    data = b'\n{"a": 1}\nnot json\n\n[1, 2]\n{"b": 2}'
+    assert _decode([data]) == [{"a": 1}, {"b": 2}]
+
+
+def test_iter_ndjson_three_way_splits():
+    data = _ndjson()
+
+    async def collect(chunks):
+        async def source():
+            for chunk in chunks:
+                yield chunk
+        return [obj async for obj in iter_ndjson(source())]
+
+    # Three-way splits around the first line break
+    first_line = data.index(b"\n")
+    for cuts in itertools.combinations(range(max(first_line - 6, 1), first_line + 6), 2):
+        bounds = (0, *cuts, len(data))
+        chunks = [data[a:b] for a, b in zip(bounds, bounds[1:])]
+        assert asyncio.run(collect(chunks)) == OBJECTS
@@ -0,0 +1,113 @@
+"""Fair scheduler: affinity fairness window and the interactive queue bound.
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from app.schemas.message import LLMBackend
+from app.services import scheduler as scheduler_module
+from app.services.scheduler import FairScheduler, QueueFullError, _Lane
+
+
+WINDOW_MS = 100
+
+
+@pytest.fixture(autouse=True)
+def short_window(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "OLLAMA_AFFINITY_WINDOW_MS", WINDOW_MS)
+
+
+def test_held_waiter_starts_after_window_behind_endless_slot():
+    async def scenario():
+        lane = _Lane(max_inflight=4, max_loaded=1)
+        # A stream on the loaded model that never ends: release() is never called
+        await lane.acquire(1, 1.0, "loaded")
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        waiter = asyncio.create_task(lane.acquire(2, 1.0, "other"))
+        await asyncio.sleep(WINDOW_MS / 1000 / 2)
+        # Starting it now would evict a model that is still in use
+        assert not waiter.done()
+        assert lane.affinity_metrics["held"] >= 1
+
+        await asyncio.wait_for(waiter, WINDOW_MS / 1000 * 10)
+        assert loop.time() - started >= WINDOW_MS / 1000 * 0.9
+        assert lane.affinity_metrics["forced"] == 1
+        assert lane.inflight == 2
+        assert not lane.queue
+        assert lane.window_timer is None
+
+    asyncio.run(scenario())
+
+
+def test_waiter_for_loaded_model_is_not_held():
+    async def scenario():
+        lane = _Lane(max_inflight=4, max_loaded=1)
+        await lane.acquire(1, 1.0, "loaded")
+        await asyncio.wait_for(lane.acquire(2, 1.0, "loaded"), WINDOW_MS / 1000 / 2)
+        assert lane.affinity_metrics["held"] == 0
+        assert lane.window_timer is None
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_held_waiter_disarms_timer():
+    async def scenario():
+        lane = _Lane(max_inflight=4, max_loaded=1)
+        await lane.acquire(1, 1.0, "loaded")
+        waiter = asyncio.create_task(lane.acquire(2, 1.0, "other"))
+        await asyncio.sleep(0)
+        assert lane.window_timer is not None
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert not lane.queue
+        assert lane.window_timer is None
+
+    asyncio.run(scenario())
+
+
+def test_background_waiters_do_not_fill_interactive_queue(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "MAX_QUEUE", 2)
+    monkeypatch.setattr(scheduler_module, "MAX_INFLIGHT", {LLMBackend.vllm: 1})
+
+    async def scenario():
+        scheduler = FairScheduler()
+        parameters = {"base_url": "http://gpu:8000/v1"}
+        release = asyncio.Event()
+
+        async def hold(interactive):
+            async with scheduler.slot(LLMBackend.vllm, parameters, 1, interactive=interactive):
+                await release.wait()
+
+        # One running request and a large batch waiting behind it
+        tasks = [asyncio.create_task(hold(False)) for _ in range(10)]
+        await asyncio.sleep(0)
+        scheduler.admit(LLMBackend.vllm, parameters)
+
+        tasks += [asyncio.create_task(hold(True)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            scheduler.admit(LLMBackend.vllm, parameters)
+
+        release.set()
+        await asyncio.gather(*tasks)
+        lane = scheduler._lane(LLMBackend.vllm, parameters)
+        assert lane.interactive_waiting == 0
+        scheduler.admit(LLMBackend.vllm, parameters)
+
+    asyncio.run(scenario())
+
+
+def test_openai_base_url_builds_no_replica_pool():
+    scheduler = FairScheduler()
+    lane = scheduler._lane(LLMBackend.openai, {"base_url": "http://a/v1,http://b/v1"})
+    # The OpenAI client ignores base_url: one lane for the hosted API, no failover pool
+    assert lane.pool is None
+    assert lane.capacity() == scheduler_module.MAX_INFLIGHT[LLMBackend.openai]
+    assert scheduler._lane(LLMBackend.openai, {}) is lane
@@ -0,0 +1,74 @@
+"""Prefix validation of streamed output: whitespace around a match, failures, chunking.
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import pytest
+
+from app.services.validation import create_prefix_validator
+
+
+def _feed(pattern: str, chunks) -> tuple:
+    validator = create_prefix_validator(pattern)
+    ok = all(validator.feed(chunk) for chunk in chunks)
+    return ok, validator
+
+
+@pytest.mark.parametrize("pattern, text", [
+    (r"[A-Z]+", "ABC"),
+    # Leading whitespace
+    (r"[A-Z]+", "  \nABC"),
+    # Trailing whitespace after a complete match
+    (r"[A-Z]+", "ABC\n"),
+    (r"[A-Z]+", "ABC \n\t "),
+    (r"\d{3}", "\n123\n"),
+    # Whitespace that is part of the match
+    (r"[A-Z]+ [0-9]+", "ABC 123"),
+    (r"[A-Z]+ [0-9]+", "ABC 123\n"),
+    (r"Order \d+: (yes|no)", " Order 42: yes \n"),
+])
+def test_valid_output_passes(pattern, text):
+    ok, validator = _feed(pattern, [text])
+    assert ok
+    assert validator.complete
+    assert not validator.failed
+
+
+@pytest.mark.parametrize("pattern, text", [
+    (r"[A-Z]+", "ABC\nD"),
+    (r"[A-Z]+", "ABC x"),
+    (r"\d{3}", "123 4"),
+    (r"[A-Z]+", "abc"),
+    # Whitespace mid-match where the pattern has none
+    (r"[A-Z]+[0-9]+", "ABC 123"),
+    # Trailing whitespace only counts after a complete match
+    (r"[A-Z]+ [0-9]+", "ABC \nx"),
+])
+def test_invalid_output_fails(pattern, text):
+    ok, validator = _feed(pattern, [text])
+    assert not ok
+    assert validator.failed
+
+
+def test_incomplete_prefix_is_not_failed():
+    ok, validator = _feed(r"[A-Z]+ [0-9]+", ["ABC "])
+    assert ok
+    assert not validator.failed
+    assert not validator.complete
+
+
+def test_failure_offset_points_at_first_bad_character():
+    ok, validator = _feed(r"[A-Z]+", ["AB", "C\n", "\nD"])
+    assert not ok
+    event = validator.failure_event(r"[A-Z]+")["validation_failed"]
+    assert event["offset"] == 5
+    assert event["received"].endswith("D")
+
+
+@pytest.mark.parametrize("text", ["ABC\n", " ABC 123 \n"])
+def test_result_does_not_depend_on_chunking(text):
+    pattern = r"[A-Z]+( [0-9]+)?"
+    for cut in range(len(text) + 1):
+        ok, validator = _feed(pattern, [text[:cut], text[cut:]])
+        assert ok and validator.complete, cut